@@ -1,86 +1,47 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
-from flask_login import LoginManager
-
-# Inicialização da aplicação
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///FlaskEmprestimo.db'
-app.config['SECRET_KEY'] = '35d9a306792f2de5075a4f32bfe09da6'
-db = SQLAlchemy(app)
-bcrypt = Bcrypt(app)
-
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
-login_manager.login_message = 'Você precisa estar logado para acessar essa página'
-login_manager.login_message_category = 'info'
-
-def is_number(n):
-    try:
-        float(n)
-        return True
-    except ValueError:
-        return False
-
-# Função para checar se um valor é ou não um número
-
-def ofertas(usuario):
-    parcela_max = usuario.salario / 10 * 3
-    ofertas = []
-    oferta = {
-        'titulo': 'Gostaria de ajuda para pagar suas dívidas?',
-        'valor': 3000,
-        'parcelas': 12
-    }
-    ofertas.append(oferta)
-
-    if parcela_max > 1600:
-        valor = 50000
-        parcelas = 36
-        oferta = {
-            'titulo': 'Está querendo trocar de carro?',
-            'valor': valor,
-            'parcelas': parcelas
-        }
-        ofertas.append(oferta)
-
-    if parcela_max > 385:
-        valor = 10000
-        parcelas = 30
-        oferta = {
-            'titulo': 'Gostaria de fazer uma reforma na susa casa?',
-            'valor': valor,
-            'parcelas': parcelas,
-        }
-        ofertas.append(oferta)
-
-    if parcela_max > 480:
-        valor = 7500
-        parcelas = 18
-        oferta = {
-            'titulo': 'Gostaria de agendar sua próxima viagem?',
-            'valor': valor,
-            'parcelas': parcelas,
-        }
-        
-        ofertas.append(oferta)
-    
-    if parcela_max > 480:
-        valor = 10000
-        parcelas = 24
-        oferta = {
-            'titulo': 'Está precisando de uma mãozinha com algum procedimento médico?',
-            'valor': valor,
-            'parcelas': parcelas,
-        }
-        ofertas.append(oferta)
-    # if parcela_max
-
-    return ofertas
-
-# Retorna para o usuário 3 ofertas, dependendo de sua renda mensal
-
-
-# Import após a inicialização do programa pois alguns módulos importados requerem
-# variáveis inicializadas acima
-from FlaskEmprestimo import routes
\ No newline at end of file
+# Fábrica da aplicação.
+# Importar o pacote não cria a aplicação nem importa o Flask: cada processo que precisa
+# da aplicação (run.py, servidor.py, o comando flask, os benchmarks) chama criar_app(),
+# e os processos que só usam uma parte do pacote, como os processos do pool de hashing
+# de senhas, importam apenas os módulos de que precisam.
+
+
+def criar_app(configuracao=None):
+    """
+    Cria e configura uma instância da aplicação.
+    As configurações são lidas de variáveis de ambiente (ver FlaskEmprestimo.config) e
+    configuracao, um dicionário opcional, substitui algumas delas, por exemplo
+    {'SQLALCHEMY_DATABASE_URI': ..., 'WTF_CSRF_ENABLED': False}.
+
+    O banco de dados (db) e o login ficam registrados em cada instância, mas as demais
+    extensões de FlaskEmprestimo.extensoes guardam a configuração da última instância
+    criada: instâncias criadas no mesmo processo devem usar a mesma configuração delas
+    """
+    from flask import Flask
+    from FlaskEmprestimo.config import Config, configurar_banco
+    from FlaskEmprestimo.extensoes import db, login_manager, pool_hash, cache_usuarios, metricas, \
+        cache_paginas, motor_politicas, limitador
+    from FlaskEmprestimo.fila_analise import fila_analise
+    from FlaskEmprestimo.routes import site
+    from FlaskEmprestimo.api import api
+    from FlaskEmprestimo.comandos import comandos
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if configuracao:
+        app.config.update(configuracao)
+    configurar_banco(app)
+
+    db.init_app(app)
+    login_manager.init_app(app)
+    pool_hash.init_app(app)
+    cache_usuarios.init_app(app)
+    metricas.init_app(app)
+    cache_paginas.init_app(app)
+    motor_politicas.init_app(app)
+    limitador.init_app(app)
+    fila_analise.init_app(app)
+
+    app.register_blueprint(site)
+    app.register_blueprint(api)
+    app.register_blueprint(comandos)
+    return app
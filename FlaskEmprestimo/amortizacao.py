@@ -0,0 +1,139 @@
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+
+# Cálculo dos cronogramas de pagamento dos empréstimos pelos sistemas Price (parcelas
+# iguais) e SAC (amortizações iguais), em Decimal e arredondados ao centavo.
+#
+# O produto cobra um custo total de 15% sobre o valor emprestado, qualquer que seja o prazo.
+# Para cada prazo suportado existe uma faixa de taxa mensal: a taxa com a qual as parcelas
+# Price somam exatamente esse custo total. Os fatores de cada faixa são calculados uma única
+# vez e reaproveitados em todos os cronogramas.
+
+CENTAVO = Decimal('0.01')
+CUSTO_TOTAL = Decimal('0.15')
+PRAZOS_SUPORTADOS = (12, 18, 24, 30, 36)
+SISTEMAS = ('price', 'sac')
+
+
+def dinheiro(valor):
+    """
+    Arredonda um valor para o centavo (metade para cima)
+    """
+    if isinstance(valor, float):
+        valor = str(valor)
+    return Decimal(valor).quantize(CENTAVO, ROUND_HALF_UP)
+
+
+def centavos(valor):
+    """
+    Converte um valor em reais para um inteiro em centavos
+    """
+    return int(dinheiro(valor) * 100)
+
+
+@lru_cache(maxsize=None)
+def fator_price(taxa, prazo):
+    """
+    Fator que, multiplicado pelo valor emprestado, resulta na parcela do sistema Price
+    """
+    return taxa / (1 - (1 + taxa) ** -prazo)
+
+
+@lru_cache(maxsize=None)
+def taxa_equivalente(prazo, custo_total=CUSTO_TOTAL):
+    """
+    Retorna a taxa mensal com a qual as parcelas Price de um empréstimo com o prazo
+    informado somam (1 + custo_total) vezes o valor emprestado, calculada por bisseção
+    """
+    alvo = (1 + custo_total) / prazo
+    minimo, maximo = Decimal(0), Decimal(1)
+    for _ in range(100):
+        meio = (minimo + maximo) / 2
+        if meio == 0 or fator_price(meio, prazo) < alvo:
+            minimo = meio
+        else:
+            maximo = meio
+    return ((minimo + maximo) / 2).quantize(Decimal('1e-12'))
+
+
+# Faixas de taxa mensal por prazo, calculadas na importação do módulo
+TAXAS_MENSAIS = {prazo: taxa_equivalente(prazo) for prazo in PRAZOS_SUPORTADOS}
+
+
+def tabela_fatores(taxas=None):
+    """
+    Retorna os fatores Price de cada prazo suportado (por padrão, usando a faixa de taxa
+    de cada prazo)
+    """
+    taxas = taxas or TAXAS_MENSAIS
+    return {prazo: fator_price(taxas[prazo], prazo) for prazo in PRAZOS_SUPORTADOS}
+
+
+# Fatores Price das faixas de taxa, calculados na importação do módulo e usados pelos
+# cronogramas que não informam outra taxa
+FATORES_PRICE = tabela_fatores()
+
+
+def cronograma(valor, prazo, sistema='price', taxa=None):
+    """
+    Gera o cronograma completo de um empréstimo.
+
+    Parâmetros:
+        valor: Valor emprestado, em reais
+
+        prazo: Quantidade de parcelas
+
+        sistema: 'price' (parcelas iguais) ou 'sac' (amortizações iguais)
+
+        taxa: Taxa mensal, por padrão a faixa do prazo (ou a taxa equivalente ao custo total,
+        para prazos fora dos suportados)
+
+    Retorna uma tupla com (numero, valor, juros, amortizacao, saldo) de cada parcela, em
+    Decimal. A última parcela absorve as diferenças de arredondamento, então o saldo
+    final é sempre zero e a soma das amortizações é exatamente o valor emprestado
+    """
+    if sistema not in SISTEMAS:
+        raise ValueError(f'Sistema de amortização desconhecido: {sistema}')
+    saldo = dinheiro(valor)
+    fator = FATORES_PRICE.get(prazo) if taxa is None else None
+    if taxa is None:
+        taxa = TAXAS_MENSAIS.get(prazo) or taxa_equivalente(prazo)
+    taxa = Decimal(taxa)
+
+    if sistema == 'price':
+        prestacao = dinheiro(saldo * (fator or fator_price(taxa, prazo)))
+    else:
+        amortizacao_fixa = dinheiro(saldo / prazo)
+
+    parcelas = []
+    for numero in range(1, prazo + 1):
+        juros = dinheiro(saldo * taxa)
+        if numero == prazo:
+            amortizacao = saldo
+        elif sistema == 'price':
+            amortizacao = prestacao - juros
+        else:
+            amortizacao = amortizacao_fixa
+        saldo -= amortizacao
+        parcelas.append((numero, juros + amortizacao, juros, amortizacao, saldo))
+    return tuple(parcelas)
+
+
+def cronogramas_em_lote(emprestimos, sistema='price'):
+    """
+    Gera as linhas da tabela parcela (valores em centavos) para vários empréstimos.
+    Recebe tuplas (id_emprestimo, valor emprestado, prazo). Empréstimos com o mesmo valor
+    e prazo compartilham o mesmo cronograma, que é calculado apenas uma vez
+    """
+    calculados = {}
+    linhas = []
+    for id_emprestimo, valor, prazo in emprestimos:
+        chave = (dinheiro(valor), prazo)
+        if chave not in calculados:
+            calculados[chave] = [
+                (numero, centavos(parcela), centavos(juros), centavos(amortizacao), centavos(saldo))
+                for numero, parcela, juros, amortizacao, saldo in cronograma(chave[0], prazo, sistema)]
+        for numero, parcela, juros, amortizacao, saldo in calculados[chave]:
+            linhas.append({'id_emprestimo': id_emprestimo, 'numero': numero, 'valor': parcela,
+                'juros': juros, 'amortizacao': amortizacao, 'saldo': saldo})
+    return linhas
@@ -0,0 +1,129 @@
+import csv
+from sqlalchemy import case, func, null, select
+from FlaskEmprestimo.extensoes import db
+from FlaskEmprestimo.models import Usuario, Emprestimo, SaldoUsuario
+from FlaskEmprestimo.consultas import saldo_devedor_emprestimo
+
+# Análise da carteira de empréstimos inteira, feita fora das requisições (pelo comando
+# "flask analise-carteira"). O agrupamento por faixa de salário e por prazo é feito pelo
+# banco de dados (GROUP BY com SUM e COUNT), que retorna uma linha por combinação de faixa
+# e prazo, então nenhum empréstimo é lido pela aplicação e a memória usada não depende da
+# quantidade de empréstimos.
+# Os valores são somados em centavos, como são guardados, e convertidos para reais apenas
+# no resultado.
+# Os totais da carteira e por faixa de salário também podem ser calculados a partir da
+# projeção saldo_usuario (ver FlaskEmprestimo.eventos), que possui uma linha por usuário
+# em vez de uma por empréstimo.
+
+# Limites inferiores das faixas de salário, em centavos
+FAIXAS_SALARIO = (0, 200000, 500000, 1000000, 2000000)
+ROTULOS_FAIXAS = ('até 2000', '2000 a 5000', '5000 a 10000', '10000 a 20000', 'acima de 20000')
+
+COLUNAS_SNAPSHOT = ('dimensao', 'grupo', 'emprestimos', 'ativos', 'proporcao_ativos', 'saldo_devedor', 'valor_total')
+
+
+class Agregado:
+    """
+    Totais de um grupo de empréstimos (a carteira inteira, uma faixa de salário ou um prazo),
+    com os valores em centavos
+    """
+    __slots__ = ('emprestimos', 'ativos', 'saldo_devedor', 'valor_total')
+
+    def __init__(self):
+        self.emprestimos = 0
+        self.ativos = 0
+        self.saldo_devedor = 0
+        self.valor_total = 0
+
+    def somar(self, emprestimos, ativos, saldo_devedor, valor_total):
+        self.emprestimos += emprestimos
+        self.ativos += ativos
+        self.saldo_devedor += saldo_devedor
+        self.valor_total += valor_total
+
+    def linha(self, dimensao, grupo):
+        proporcao = self.ativos / self.emprestimos if self.emprestimos else 0
+        return (dimensao, grupo, self.emprestimos, self.ativos, round(proporcao, 4),
+            self.saldo_devedor / 100, self.valor_total / 100)
+
+
+def faixa_salario(salario):
+    """
+    Expressão SQL do índice em FAIXAS_SALARIO da faixa de um salário em centavos
+    """
+    return case([(salario >= FAIXAS_SALARIO[faixa], faixa) for faixa in range(len(FAIXAS_SALARIO) - 1, 0, -1)],
+        else_=0)
+
+
+def _linhas(grupos):
+    # grupos são as linhas (faixa, prazo, empréstimos, ativos, saldo devedor, valor total)
+    # agrupadas pelo banco de dados, somadas aqui por faixa e por prazo (quando o prazo não
+    # é vazio)
+    carteira = Agregado()
+    por_faixa = {}
+    por_prazo = {}
+    for faixa, prazo, *totais in grupos:
+        totais = [int(total or 0) for total in totais]
+        carteira.somar(*totais)
+        por_faixa.setdefault(faixa, Agregado()).somar(*totais)
+        if prazo is not None:
+            por_prazo.setdefault(prazo, Agregado()).somar(*totais)
+
+    linhas = [carteira.linha('carteira', 'total')]
+    linhas.extend(por_faixa[faixa].linha('faixa_salario', ROTULOS_FAIXAS[faixa]) for faixa in sorted(por_faixa))
+    linhas.extend(por_prazo[prazo].linha('prazo', prazo) for prazo in sorted(por_prazo))
+    return linhas
+
+
+def analisar_carteira():
+    """
+    Calcula os totais da carteira inteira, por faixa de salário e por prazo, com uma única
+    consulta agrupada por faixa de salário e prazo.
+    Retorna uma lista de tuplas com as COLUNAS_SNAPSHOT
+    """
+    faixa = faixa_salario(Usuario.salario_centavos).label('faixa')
+    consulta = select(faixa, Emprestimo.parcelas, func.count(Emprestimo.id),
+            func.sum(case([(Emprestimo.ativo == True, 1)], else_=0)),
+            func.sum(case([(Emprestimo.ativo == True, saldo_devedor_emprestimo())], else_=0)),
+            func.sum(Emprestimo.valor_centavos)) \
+        .select_from(Emprestimo).join(Usuario, Emprestimo.id_usuario == Usuario.id) \
+        .group_by(faixa, Emprestimo.parcelas)
+
+    with db.engine.connect() as conexao:
+        return _linhas(conexao.execute(consulta))
+
+
+def analisar_saldos():
+    """
+    Calcula os totais da carteira inteira e por faixa de salário a partir da projeção de
+    saldos dos usuários, agrupando uma linha por usuário em vez de uma por empréstimo (a
+    dimensão de prazo não existe na projeção). Retorna uma lista de tuplas com as
+    COLUNAS_SNAPSHOT
+    """
+    faixa = faixa_salario(Usuario.salario_centavos).label('faixa')
+    consulta = select(faixa, null(), func.sum(SaldoUsuario.qtd_total), func.sum(SaldoUsuario.qtd_ativos),
+            func.sum(SaldoUsuario.saldo_devedor_centavos), func.sum(SaldoUsuario.valor_total_centavos)) \
+        .select_from(SaldoUsuario).join(Usuario, SaldoUsuario.id_usuario == Usuario.id) \
+        .group_by(faixa)
+
+    with db.engine.connect() as conexao:
+        return _linhas(conexao.execute(consulta))
+
+
+def salvar_snapshot(linhas, caminho, formato='csv'):
+    """
+    Salva o resultado de analisar_carteira() em CSV ou, caso o pacote pyarrow esteja
+    instalado, em Parquet
+    """
+    if formato == 'parquet':
+        import pyarrow
+        import pyarrow.parquet
+        colunas = {nome: [str(linha[i]) if nome == 'grupo' else linha[i] for linha in linhas]
+            for i, nome in enumerate(COLUNAS_SNAPSHOT)}
+        pyarrow.parquet.write_table(pyarrow.table(colunas), caminho)
+        return
+
+    with open(caminho, 'w', newline='', encoding='utf-8') as saida:
+        escritor = csv.writer(saida)
+        escritor.writerow(COLUNAS_SNAPSHOT)
+        escritor.writerows(linhas)
@@ -0,0 +1,242 @@
+import json
+import math
+from flask import Blueprint, Response, current_app, request, g, abort
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from werkzeug.exceptions import HTTPException
+from FlaskEmprestimo.extensoes import pool_hash, cache_usuarios, limitador
+from FlaskEmprestimo.models import Usuario
+from FlaskEmprestimo.senhas import FilaCheiaError
+from FlaskEmprestimo.cadastros import normalizar_cpf
+from FlaskEmprestimo.originacao import simular_emprestimo, originar_emprestimo, ofertas, EmprestimoInvalidoError
+from FlaskEmprestimo.pagamentos import pagar_parcelas
+from FlaskEmprestimo.consultas import pagina_emprestimos, colunas_emprestimo, COLUNAS_EXPORTACAO, \
+    TAMANHO_PAGINA
+
+# API JSON (versão 1) com as mesmas operações do site: ofertas, simulação, criação de
+# empréstimos, histórico e pagamento de parcelas. As rotas ficam em /api/v1 e usam as
+# mesmas funções das páginas HTML, mas:
+#
+#   - A autenticação é feita com um token assinado ("Authorization: Bearer <token>"),
+#     obtido em POST /api/v1/tokens. A sessão e os cookies do site não são usados, então
+#     as respostas nunca possuem Set-Cookie e podem ser atendidas por qualquer processo
+#
+#   - As consultas selecionam apenas as colunas enviadas na resposta, sem criar objetos
+#     do ORM, e o JSON é gerado com orjson quando estiver instalado
+#
+#   - Respostas maiores que API_COMPRESSAO_MINIMO bytes são comprimidas com gzip quando o
+#     cliente aceita (Accept-Encoding)
+#
+# Erros são retornados como {"erro": "<mensagem>"} com o status HTTP correspondente.
+
+try:
+    import orjson
+
+    def _codificar(dados):
+        return orjson.dumps(dados)
+except ImportError:
+    def _codificar(dados):
+        return json.dumps(dados, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+api = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+LIMITE_PAGINA_MAX = 100
+
+
+def resposta_json(dados, status=200):
+    return Response(_codificar(dados), status=status, mimetype='application/json')
+
+
+def _serializador():
+    return URLSafeTimedSerializer(current_app.secret_key, salt='api-token')
+
+
+def gerar_token(id_usuario):
+    """
+    Gera um token assinado com a SECRET_KEY para o usuário, válido por API_TOKEN_VALIDADE
+    segundos. O token não é salvo no banco de dados
+    """
+    return _serializador().dumps({'id': id_usuario})
+
+
+def ler_token(token):
+    """
+    Retorna o id do usuário do token, ou None caso o token seja inválido ou tenha expirado
+    """
+    try:
+        dados = _serializador().loads(token, max_age=current_app.config['API_TOKEN_VALIDADE'])
+    except (BadSignature, SignatureExpired):
+        return None
+    return dados.get('id') if isinstance(dados, dict) else None
+
+
+def usuario_autenticado():
+    """
+    Lê o token do cabeçalho Authorization e retorna a Identidade do usuário (pelo cache de
+    identidades), respondendo 401 caso o token esteja ausente ou seja inválido
+    """
+    if 'usuario' not in g:
+        cabecalho = request.headers.get('Authorization', '')
+        id_usuario = ler_token(cabecalho[7:]) if cabecalho.startswith('Bearer ') else None
+        usuario = cache_usuarios.obter(id_usuario, Usuario.query.get) if id_usuario else None
+        if usuario is None:
+            abort(401, 'Token ausente, inválido ou expirado')
+        g.usuario = usuario
+    return g.usuario
+
+
+def _corpo():
+    dados = request.get_json(silent=True)
+    if not isinstance(dados, dict):
+        abort(400, 'O corpo da requisição deve ser um objeto JSON')
+    return dados
+
+
+def _numero(dados, campo, tipo=float, obrigatorio=True):
+    valor = dados.get(campo)
+    if valor is None and not obrigatorio:
+        return None
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        numero = None
+    # Campos inteiros não aceitam valores fracionários, que seriam truncados por int()
+    if (numero is None or isinstance(valor, bool) or not math.isfinite(numero)
+            or (tipo is int and not numero.is_integer())):
+        abort(400, f'Campo {campo} inválido')
+    return tipo(numero)
+
+
+def _cpf_do_corpo():
+    dados = request.get_json(silent=True)
+    return normalizar_cpf(dados.get('cpf')) if isinstance(dados, dict) else None
+
+
+def _emprestimo(linha):
+    return dict(zip(COLUNAS_EXPORTACAO, linha))
+
+
+@api.errorhandler(HTTPException)
+def erro_http(erro):
+    resposta = resposta_json({'erro': erro.description}, erro.code)
+    # Mantém os cabeçalhos do erro, como o Retry-After do 429
+    for nome, valor in erro.get_headers():
+        if nome != 'Content-Type':
+            resposta.headers[nome] = valor
+    return resposta
+
+
+@api.after_request
+def comprimir(resposta):
+    """
+    Comprime com gzip as respostas grandes quando o cliente aceita
+    """
+    if (resposta.direct_passthrough or resposta.is_streamed or 'Content-Encoding' in resposta.headers
+            or 'gzip' not in request.headers.get('Accept-Encoding', '')):
+        return resposta
+    corpo = resposta.get_data()
+    if len(corpo) < current_app.config['API_COMPRESSAO_MINIMO']:
+        return resposta
+    import gzip
+    resposta.set_data(gzip.compress(corpo, current_app.config['API_COMPRESSAO_NIVEL']))
+    resposta.headers['Content-Encoding'] = 'gzip'
+    resposta.vary.add('Accept-Encoding')
+    return resposta
+
+
+@api.route('/tokens', methods=['POST'])
+@limitador.limitar(_cpf_do_corpo)
+def criar_token():
+    """
+    Recebe {"cpf", "senha"} e retorna {"token", "expira_em"} (segundos até a expiração).
+    As tentativas são limitadas por IP e por CPF, como no login do site
+    """
+    dados = _corpo()
+    usuario = Usuario.query.filter_by(cpf=normalizar_cpf(dados.get('cpf'))).first()
+    try:
+        senha_correta = usuario and pool_hash.verificar(usuario.senha, str(dados.get('senha', '')))
+    except FilaCheiaError:
+        abort(503, 'Muitas requisições no momento, tente novamente em alguns segundos')
+    if not senha_correta:
+        abort(401, 'CPF ou senha incorretos')
+    return resposta_json({'token': gerar_token(usuario.id), 'expira_em': current_app.config['API_TOKEN_VALIDADE']}, 201)
+
+
+@api.route('/ofertas')
+def listar_ofertas():
+    """
+    Ofertas elegíveis para o salário do usuário
+    """
+    return resposta_json(ofertas(usuario_autenticado()))
+
+
+@api.route('/simulacoes', methods=['POST'])
+def simular():
+    """
+    Recebe {"valor", "parcelas"} e, opcionalmente, "salario" (por padrão, o salário
+    cadastrado) e retorna os valores calculados, sem salvar nada.
+    Pedidos recusados pela política retornam 422 com a mensagem da regra
+    """
+    usuario = usuario_autenticado()
+    dados = _corpo()
+    salario = _numero(dados, 'salario', obrigatorio=False)
+    try:
+        simulacao = simular_emprestimo(_numero(dados, 'valor'), _numero(dados, 'parcelas', int),
+            usuario.salario if salario is None else salario)
+    except EmprestimoInvalidoError as erro:
+        abort(422, str(erro))
+    return resposta_json(simulacao)
+
+
+@api.route('/emprestimos', methods=['POST'])
+def criar_emprestimo():
+    """
+    Recebe {"valor", "parcelas"} e cria o empréstimo com o salário cadastrado do usuário.
+    Retorna 201 com o empréstimo criado, cuja situacao é 'em_analise' caso ele tenha sido
+    enviado para a fila de análise
+    """
+    usuario = usuario_autenticado()
+    dados = _corpo()
+    try:
+        simulacao = simular_emprestimo(_numero(dados, 'valor'), _numero(dados, 'parcelas', int), usuario.salario)
+    except EmprestimoInvalidoError as erro:
+        abort(422, str(erro))
+    id_emprestimo = originar_emprestimo(simulacao, usuario.id)
+    return resposta_json(_emprestimo(colunas_emprestimo(id_emprestimo, usuario.id)), 201)
+
+
+@api.route('/emprestimos')
+def listar_emprestimos():
+    """
+    Página do histórico de empréstimos do usuário, na mesma ordem da página de detalhes.
+    Parâmetros: apos (o proximo_cursor da página anterior) e limite (até LIMITE_PAGINA_MAX).
+    Retorna {"emprestimos", "proximo_cursor"}, com proximo_cursor null na última página
+    """
+    usuario = usuario_autenticado()
+    limite = min(max(request.args.get('limite', TAMANHO_PAGINA, type=int), 1), LIMITE_PAGINA_MAX)
+    linhas, proximo_cursor = pagina_emprestimos(usuario.id, request.args.get('apos'), limite,
+        colunas=COLUNAS_EXPORTACAO)
+    return resposta_json({'emprestimos': [_emprestimo(linha) for linha in linhas],
+        'proximo_cursor': proximo_cursor})
+
+
+@api.route('/emprestimos/<int:id_emprestimo>/pagamentos', methods=['POST'])
+def pagar(id_emprestimo):
+    """
+    Recebe, opcionalmente, {"parcelas"} (quantidade de parcelas pagas, 1 por padrão) e
+    retorna o empréstimo atualizado. Retorna 409 caso o empréstimo não esteja ativo ou não
+    possua parcelas restantes suficientes, e 404 caso não pertença ao usuário
+    """
+    usuario = usuario_autenticado()
+    dados = _corpo() if request.get_data() else {}
+    quantidade = _numero(dados, 'parcelas', int, obrigatorio=False)
+    if quantidade is None:
+        quantidade = 1
+    elif quantidade < 1:
+        abort(400, 'Campo parcelas inválido')
+    if not pagar_parcelas(id_emprestimo, usuario.id, quantidade):
+        linha = colunas_emprestimo(id_emprestimo, usuario.id)
+        if linha is None:
+            abort(404, 'Empréstimo não encontrado')
+        abort(409, 'O empréstimo não está ativo ou não possui parcelas restantes suficientes')
+    return resposta_json(_emprestimo(colunas_emprestimo(id_emprestimo, usuario.id)))
+
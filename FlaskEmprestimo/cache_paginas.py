@@ -0,0 +1,163 @@
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from flask import request, session, make_response
+from markupsafe import Markup
+
+# Cache dos trechos renderizados das páginas de cada usuário (ofertas, perfil e
+# detalhamento dos empréstimos). Cada usuário possui um número de versão, que é
+# incrementado sempre que os seus dados mudam: como a versão faz parte da chave, os
+# trechos antigos deixam de ser usados e acabam removidos pelo limite de memória.
+
+
+class BackendMemoria:
+    """
+    Backend do cache dentro do próprio processo, com remoção LRU quando o tamanho total
+    dos valores guardados passa de tamanho_max bytes.
+    Os contadores (usados para as versões) ficam separados dos valores e nunca são
+    removidos, pois perder uma versão faria trechos antigos voltarem a ser válidos
+    """
+
+    def __init__(self, tamanho_max=32 * 1024 * 1024):
+        self.tamanho_max = tamanho_max
+        self.tamanho = 0
+        self._entradas = OrderedDict()
+        self._contadores = {}
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            if chave in self._contadores:
+                return self._contadores[chave]
+            valor = self._entradas.get(chave)
+            if valor is not None:
+                self._entradas.move_to_end(chave)
+            return valor
+
+    def set(self, chave, valor):
+        if len(valor) > self.tamanho_max:
+            return
+        with self._lock:
+            antigo = self._entradas.pop(chave, None)
+            if antigo is not None:
+                self.tamanho -= len(antigo)
+            self._entradas[chave] = valor
+            self.tamanho += len(valor)
+            while self.tamanho > self.tamanho_max:
+                _, removido = self._entradas.popitem(last=False)
+                self.tamanho -= len(removido)
+
+    def incr(self, chave):
+        with self._lock:
+            valor = self._contadores.get(chave, 0) + 1
+            self._contadores[chave] = valor
+            return valor
+
+
+class BackendCompartilhado:
+    """
+    Backend que delega para um cliente compartilhado entre processos, com a mesma interface
+    do Redis (get, set com ex= e incr), para que todos os processos vejam as mesmas
+    versões e os mesmos trechos renderizados
+    """
+
+    def __init__(self, cliente, ttl=3600):
+        self.cliente = cliente
+        self.ttl = ttl
+
+    def get(self, chave):
+        valor = self.cliente.get(chave)
+        return valor.decode('utf-8') if isinstance(valor, bytes) else valor
+
+    def set(self, chave, valor):
+        self.cliente.set(chave, valor, ex=self.ttl)
+
+    def incr(self, chave):
+        return self.cliente.incr(chave)
+
+
+class CachePaginas:
+    """
+    Cache de trechos renderizados por usuário, com suporte a ETag.
+
+    O backend em memória só é coerente com um único processo: com vários processos,
+    uma alteração feita em um deles não invalida o cache dos outros, então deve ser
+    usado o backend compartilhado.
+
+    Configurações lidas da aplicação:
+        CACHE_PAGINAS_MAX_BYTES: Memória máxima usada pelo backend em memória
+
+        CACHE_PAGINAS_REDIS_URL: Caso configurado, usa um servidor Redis (pacote redis)
+        como backend compartilhado entre os processos
+    """
+
+    def __init__(self, app=None, backend=None):
+        self.backend = backend or BackendMemoria()
+        self.epoca = ''
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_PAGINAS_MAX_BYTES', 32 * 1024 * 1024)
+        app.config.setdefault('CACHE_PAGINAS_REDIS_URL', None)
+        if app.config['CACHE_PAGINAS_REDIS_URL']:
+            import redis
+            self.backend = BackendCompartilhado(redis.Redis.from_url(app.config['CACHE_PAGINAS_REDIS_URL']))
+        else:
+            self.backend = BackendMemoria(app.config['CACHE_PAGINAS_MAX_BYTES'])
+            # As versões em memória recomeçam do zero quando o processo reinicia, então
+            # as ETags incluem um valor aleatório para não coincidirem com as anteriores
+            self.epoca = secrets.token_hex(4)
+
+    def versao(self, id_usuario):
+        return int(self.backend.get(f'versao:{id_usuario}') or 0)
+
+    def nova_versao(self, id_usuario):
+        """
+        Invalida todos os trechos em cache do usuário, deve ser chamado sempre que uma
+        alteração nos dados do usuário ou de seus empréstimos for salva
+        """
+        self.backend.incr(f'versao:{id_usuario}')
+
+    def etag(self, id_usuario, nome):
+        """
+        Retorna a ETag da página atual para o usuário, calculada a partir da versão dos
+        dados do usuário, do nome da página e dos parâmetros da URL
+        """
+        base = f'{self.epoca}:{id_usuario}:{self.versao(id_usuario)}:{nome}:{request.query_string.decode()}'
+        return hashlib.sha1(base.encode('utf-8')).hexdigest()
+
+    def nao_modificada(self, etag):
+        """
+        Retorna True caso o navegador já possua a página com esta ETag. Páginas com
+        mensagens flash pendentes nunca são consideradas iguais, pois as mensagens fazem
+        parte do HTML
+        """
+        return '_flashes' not in session and etag in request.if_none_match
+
+    def fragmento(self, etag, renderizar):
+        """
+        Retorna o trecho renderizado da página identificada pela ETag, chamando renderizar()
+        apenas quando ele não estiver em cache para a versão atual dos dados do usuário
+        """
+        chave = f'pagina:{etag}'
+        html = self.backend.get(chave)
+        if html is None:
+            html = str(renderizar())
+            self.backend.set(chave, html)
+        return Markup(html)
+
+    def resposta(self, etag, gerar_pagina):
+        """
+        Retorna 304 caso o navegador já possua a página, ou a página gerada por
+        gerar_pagina() com a ETag. O navegador deve sempre revalidar a página antes de
+        usar a sua cópia
+        """
+        if self.nao_modificada(etag):
+            resposta = make_response('', 304)
+        else:
+            resposta = make_response(gerar_pagina())
+        resposta.set_etag(etag)
+        resposta.headers['Cache-Control'] = 'private, no-cache'
+        return resposta
@@ -0,0 +1,103 @@
+from sqlalchemy import exists
+from sqlalchemy.exc import IntegrityError
+from FlaskEmprestimo.extensoes import db
+from FlaskEmprestimo.models import Usuario
+from FlaskEmprestimo.identidades import Identidade
+
+# Cadastro de usuários. CPF e e-mail são salvos normalizados (apenas os dígitos do CPF e o
+# e-mail em letras minúsculas), então as colunas únicas da tabela usuario, que já possuem
+# índice, garantem que não existam dois cadastros com o mesmo CPF ou e-mail, mesmo quando
+# escritos de formas diferentes.
+
+
+class CadastroDuplicadoError(ValueError):
+    """
+    Lançada quando o CPF ou o e-mail já foram usados por outro usuário.
+    O atributo campos contém os nomes dos campos repetidos ('cpf' e/ou 'email')
+    """
+
+    def __init__(self, campos):
+        super().__init__(f'Campos já cadastrados: {", ".join(campos)}')
+        self.campos = campos
+
+
+def normalizar_cpf(cpf):
+    """
+    Retorna apenas os dígitos do CPF, para que "123.456.789-01" e "12345678901" sejam o mesmo CPF
+    """
+    if cpf is None:
+        return None
+    return ''.join(c for c in str(cpf) if c.isdigit())
+
+
+def normalizar_email(email):
+    """
+    Retorna o e-mail sem espaços nas pontas e em letras minúsculas
+    """
+    if email is None:
+        return None
+    return email.strip().lower()
+
+
+def campos_em_uso(cpf, email):
+    """
+    Verifica numa única consulta (dois EXISTS sobre os índices únicos de cpf e email) se o
+    CPF e o e-mail já foram cadastrados. Retorna uma tupla com os nomes dos campos em uso
+    """
+    cpf_em_uso, email_em_uso = db.session.query(
+        exists().where(Usuario.cpf == normalizar_cpf(cpf)),
+        exists().where(Usuario.email == normalizar_email(email)),
+    ).one()
+    return tuple(campo for campo, em_uso in (('cpf', cpf_em_uso), ('email', email_em_uso)) if em_uso)
+
+
+def cadastrar_usuario(nome, cpf, email, senha_hash, salario):
+    """
+    Insere um novo usuário com CPF e e-mail normalizados e retorna a sua Identidade, que
+    pode ser passada para login_user() sem consultar o usuário novamente depois do commit.
+    A unicidade é garantida pelo próprio banco de dados: caso outro cadastro com o mesmo
+    CPF ou e-mail tenha sido salvo depois da validação do formulário, o INSERT falha,
+    a transação é desfeita e CadastroDuplicadoError é lançada
+    """
+    usuario = Usuario(nome=nome, cpf=normalizar_cpf(cpf), email=normalizar_email(email),
+        senha=senha_hash, salario=salario)
+    db.session.add(usuario)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        campos = campos_em_uso(cpf, email)
+        if not campos:
+            raise
+        raise CadastroDuplicadoError(campos)
+    identidade = Identidade(usuario)
+    db.session.commit()
+    return identidade
+
+
+def normalizar_cadastros(tamanho_lote=1000):
+    """
+    Normaliza o CPF e o e-mail dos usuários cadastrados antes da normalização existir.
+    Usuários cujo valor normalizado já pertence a outro cadastro não são alterados.
+    Retorna (quantidade de usuários normalizados, lista de ids com conflito)
+    """
+    alterados = 0
+    conflitos = []
+    ultimo_id = 0
+    while True:
+        lote = db.session.query(Usuario.id, Usuario.cpf, Usuario.email) \
+            .filter(Usuario.id > ultimo_id).order_by(Usuario.id).limit(tamanho_lote).all()
+        if not lote:
+            return alterados, conflitos
+        for id_usuario, cpf, email in lote:
+            novos = {Usuario.cpf: normalizar_cpf(cpf), Usuario.email: normalizar_email(email)}
+            if (cpf, email) == tuple(novos.values()):
+                continue
+            try:
+                with db.session.begin_nested():
+                    Usuario.query.filter_by(id=id_usuario).update(novos, synchronize_session=False)
+                alterados += 1
+            except IntegrityError:
+                conflitos.append(id_usuario)
+        db.session.commit()
+        ultimo_id = lote[-1][0]
@@ -0,0 +1,63 @@
+from bisect import bisect_left
+
+# Catálogo declarativo das ofertas exibidas na página inicial, definido no arquivo de
+# políticas (ver FlaskEmprestimo.politicas).
+# Cada linha é (limite, titulo, valor, parcelas): a oferta só é exibida quando a parcela
+# máxima recomendada para o usuário (por padrão, 30% do salário) for maior que o limite.
+# Um limite None indica uma oferta que é exibida para qualquer usuário.
+# A ordem das linhas é a ordem em que as ofertas aparecem na página.
+
+
+class TabelaOfertas:
+    """
+    Versão compilada de um catálogo de ofertas, usada para calcular a elegibilidade de
+    muitos salários de uma só vez.
+
+    Os limites distintos do catálogo são ordenados e, para cada quantidade de limites
+    ultrapassados, a tupla de ofertas elegíveis é calculada uma única vez. Assim, avaliar
+    um salário custa apenas uma busca binária, e todos os salários com o mesmo nível
+    compartilham a mesma tupla de resultado.
+
+    Atributos:
+        comprometimento: Fração do salário que define a parcela máxima recomendada
+
+        ofertas: Tupla de dicionários com 'titulo', 'valor' e 'parcelas' de cada oferta,
+        na ordem do catálogo
+
+        limites: Limites distintos do catálogo, em ordem crescente
+
+        niveis: niveis[k] é a tupla com os índices das ofertas elegíveis quando a parcela
+        máxima ultrapassa exatamente os k primeiros limites
+    """
+
+    def __init__(self, catalogo, comprometimento=0.3):
+        self.comprometimento = comprometimento
+        self.ofertas = tuple(
+            {'titulo': titulo, 'valor': valor, 'parcelas': parcelas}
+            for _, titulo, valor, parcelas in catalogo)
+        self.limites = tuple(sorted({linha[0] for linha in catalogo if linha[0] is not None}))
+
+        niveis = []
+        for k in range(len(self.limites) + 1):
+            ultrapassados = self.limites[:k]
+            niveis.append(tuple(
+                i for i, linha in enumerate(catalogo)
+                if linha[0] is None or linha[0] in ultrapassados))
+        self.niveis = tuple(niveis)
+
+    def elegibilidade(self, salarios):
+        """
+        Recebe uma sequência de salários e retorna, para cada um deles e na mesma ordem,
+        a tupla com os índices das ofertas elegíveis
+        """
+        limites = self.limites
+        niveis = self.niveis
+        comprometimento = self.comprometimento
+        return [niveis[bisect_left(limites, salario * comprometimento)] for salario in salarios]
+
+    def ofertas_de(self, indices):
+        """
+        Converte uma tupla de índices (retornada por elegibilidade()) na lista de ofertas
+        que é enviada para o template
+        """
+        return [dict(self.ofertas[i]) for i in indices]
@@ -0,0 +1,173 @@
+import os
+import click
+from flask import Blueprint, current_app
+
+# Comandos de linha de comando da aplicação, executados com "flask <comando>"
+# (com a variável de ambiente FLASK_APP=run.py). Os comandos ficam no blueprint comandos,
+# sem um grupo próprio, e cada comando importa os módulos de que precisa ao ser executado,
+# para que a aplicação não os carregue ao atender requisições ou executar outros comandos.
+
+comandos = Blueprint('comandos', __name__, cli_group=None)
+
+
+@comandos.cli.command('import-emprestimos')
+@click.argument('arquivo', type=click.File('r', encoding='utf-8'))
+@click.option('--formato', type=click.Choice(['csv', 'ndjson']),
+    help='Formato do arquivo. Se omitido, é deduzido da extensão.')
+@click.option('--lote', type=int, default=None, help='Quantidade de empréstimos inseridos por transação.')
+@click.option('--relatorio', type=click.Path(dir_okay=False, writable=True),
+    help='Arquivo CSV onde as linhas rejeitadas e seus motivos serão escritos.')
+def importar_emprestimos_comando(arquivo, formato, lote, relatorio):
+    """
+    Importa empréstimos de um arquivo CSV ou NDJSON (colunas cpf, valor, parcelas e,
+    opcionalmente, salario), aplicando as mesmas regras da confirmação de empréstimos
+    """
+    import csv
+    from FlaskEmprestimo.originacao import importar_emprestimos, ler_csv, ler_ndjson
+
+    if formato is None:
+        formato = 'ndjson' if os.path.splitext(arquivo.name)[1].lower() in ('.ndjson', '.jsonl') else 'csv'
+    linhas = ler_ndjson(arquivo) if formato == 'ndjson' else ler_csv(arquivo)
+
+    resultado = importar_emprestimos(linhas, lote or current_app.config['IMPORTACAO_TAMANHO_LOTE'])
+
+    click.echo(f"Empréstimos inseridos: {resultado['inseridos']} "
+        f"({resultado['em_analise']} precisam de análise)")
+    click.echo(f"Linhas rejeitadas: {len(resultado['rejeitados'])}")
+
+    if relatorio:
+        with open(relatorio, 'w', newline='', encoding='utf-8') as saida:
+            escritor = csv.DictWriter(saida, fieldnames=('linha', 'motivo'))
+            escritor.writeheader()
+            escritor.writerows(resultado['rejeitados'])
+        click.echo(f'Relatório de rejeições salvo em {relatorio}')
+
+
+@comandos.cli.command('gerar-cronogramas')
+@click.option('--lote', type=int, default=1000, help='Quantidade de empréstimos processados por transação.')
+def gerar_cronogramas_comando(lote):
+    """
+    Gera os cronogramas de pagamento dos empréstimos que ainda não possuem parcelas salvas
+    """
+    from FlaskEmprestimo.originacao import gerar_cronogramas_pendentes
+
+    total = gerar_cronogramas_pendentes(lote)
+    click.echo(f'Cronogramas gerados: {total}')
+
+
+@comandos.cli.command('analise-carteira')
+@click.option('--saida', type=click.Path(dir_okay=False, writable=True), default='carteira.csv',
+    help='Arquivo onde o snapshot da análise será salvo.')
+@click.option('--formato', type=click.Choice(['csv', 'parquet']), default='csv',
+    help='Formato do snapshot (parquet requer o pacote pyarrow).')
+@click.option('--saldos', is_flag=True,
+    help='Calcula a partir da projeção de saldos dos usuários, mais rápido, mas sem a dimensão de prazo.')
+def analise_carteira_comando(saida, formato, saldos):
+    """
+    Calcula o saldo devedor, a proporção de empréstimos ativos e a exposição por faixa de
+    salário e por prazo de toda a carteira, salvando o resultado num snapshot
+    """
+    from FlaskEmprestimo.analise import analisar_carteira, analisar_saldos, salvar_snapshot
+
+    linhas = analisar_saldos() if saldos else analisar_carteira()
+    salvar_snapshot(linhas, saida, formato)
+    _, _, emprestimos, ativos, proporcao, saldo, _ = linhas[0]
+    click.echo(f'Empréstimos: {emprestimos}, ativos: {ativos} ({proporcao:.1%}), saldo devedor: R$ {saldo:.2f}')
+    click.echo(f'Snapshot salvo em {saida}')
+
+
+@comandos.cli.command('normalizar-usuarios')
+def normalizar_usuarios_comando():
+    """
+    Normaliza o CPF (apenas dígitos) e o e-mail (letras minúsculas) dos usuários já cadastrados
+    """
+    from FlaskEmprestimo.cadastros import normalizar_cadastros
+
+    alterados, conflitos = normalizar_cadastros()
+    click.echo(f'{alterados} usuários normalizados')
+    if conflitos:
+        click.echo(f'Usuários não alterados por conflito com outro cadastro: {", ".join(map(str, conflitos))}')
+
+
+@comandos.cli.command('processar-analises')
+def processar_analises_comando():
+    """
+    Processa a fila de análise de empréstimos até que fique vazia, para quando os
+    trabalhadores em segundo plano estiverem desativados (FILA_ANALISE_TRABALHADORES=0)
+    """
+    from FlaskEmprestimo.fila_analise import fila_analise
+
+    total = fila_analise.processar_tudo()
+    estatisticas = fila_analise.estatisticas()
+    click.echo(f'Tarefas processadas: {total} (aprovadas: {estatisticas["aprovadas"]}, '
+        f'recusadas: {estatisticas["recusadas"]}, para avaliação manual: {estatisticas["manuais"]})')
+
+
+@comandos.cli.command('analises-manuais')
+@click.option('--limite', type=int, default=100, help='Quantidade máxima de empréstimos listados.')
+def analises_manuais_comando(limite):
+    """
+    Lista os empréstimos que nenhuma regra da política decidiu e aguardam uma avaliação manual
+    """
+    from FlaskEmprestimo.fila_analise import avaliacoes_pendentes
+
+    pendentes = avaliacoes_pendentes(limite)
+    click.echo(f'Empréstimos aguardando avaliação manual: {len(pendentes)}')
+    for id_emprestimo, id_usuario, valor, parcelas, valor_parcela, salario, _ in pendentes:
+        click.echo(f'  {id_emprestimo}: usuário {id_usuario}, R$ {valor:.2f} em {parcelas} parcelas de '
+            f'R$ {valor_parcela:.2f}, salário R$ {salario:.2f}')
+
+
+@comandos.cli.command('avaliar-analise')
+@click.argument('id_emprestimo', type=int)
+@click.argument('decisao', type=click.Choice(['aprovar', 'recusar']))
+def avaliar_analise_comando(id_emprestimo, decisao):
+    """
+    Aprova ou recusa manualmente um empréstimo em análise
+    """
+    from FlaskEmprestimo.fila_analise import avaliar_manualmente
+
+    if not avaliar_manualmente(id_emprestimo, 'aprovado' if decisao == 'aprovar' else 'recusado'):
+        raise click.ClickException(f'O empréstimo {id_emprestimo} não existe ou não está em análise')
+    click.echo(f'Empréstimo {id_emprestimo} {"aprovado" if decisao == "aprovar" else "recusado"}')
+
+
+@comandos.cli.command('reconstruir-saldos')
+@click.option('--lote', type=int, default=1000, help='Quantidade de usuários reconstruídos por transação.')
+@click.option('--verificar', is_flag=True,
+    help='Apenas compara a projeção com os totais calculados a partir dos empréstimos.')
+def reconstruir_saldos_comando(lote, verificar):
+    """
+    Reconstrói a projeção dos saldos dos usuários a partir do registro de eventos dos empréstimos
+    """
+    from FlaskEmprestimo.eventos import reconstruir_saldos, divergencias
+
+    if not verificar:
+        total = reconstruir_saldos(tamanho_lote=lote)
+        click.echo(f'Saldos reconstruídos: {total} usuários')
+    diferentes = divergencias(tamanho_lote=lote)
+    click.echo(f'Usuários com saldo diferente dos empréstimos: {len(diferentes)}')
+    for id_usuario, projecao, calculo in diferentes[:20]:
+        click.echo(f'  usuário {id_usuario}: projeção {projecao}, empréstimos {calculo}')
+
+
+@comandos.cli.command('migrar')
+@click.option('--lote', type=int, default=1000, help='Quantidade de linhas convertidas por transação.')
+@click.option('--pausa', type=float, default=0, help='Pausa, em segundos, entre dois lotes.')
+@click.option('--status', is_flag=True, help='Apenas lista as migrações pendentes.')
+def migrar_comando(lote, pausa, status):
+    """
+    Aplica as migrações pendentes do esquema do banco de dados (ou cria o banco, caso esteja vazio)
+    """
+    from FlaskEmprestimo.migracoes import migrar, pendentes
+
+    if status:
+        lista = pendentes()
+        click.echo(f'Migrações pendentes: {len(lista)}')
+        for versao, descricao in lista:
+            click.echo(f'  {versao}: {descricao}')
+        return
+    aplicadas = migrar(tamanho_lote=lote, pausa=pausa)
+    for versao, descricao in aplicadas:
+        click.echo(f'Migração {versao} aplicada: {descricao}')
+    click.echo(f'Esquema atualizado ({len(aplicadas)} migrações aplicadas)')
@@ -0,0 +1,197 @@
+import os
+import sqlite3
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Configuração da aplicação, lida de variáveis de ambiente.
+# Os valores padrão são os usados no desenvolvimento local com SQLite.
+
+
+def _env(nome, padrao, tipo=str):
+    valor = os.environ.get(nome)
+    return padrao if valor is None or valor == '' else tipo(valor)
+
+
+class Config:
+    """
+    Configurações da aplicação. Cada atributo pode ser sobrescrito pela variável de
+    ambiente de mesmo nome (com exceção de SQLALCHEMY_DATABASE_URI, lida de DATABASE_URL).
+
+    Atributos:
+        DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE: Dimensionamento
+        do pool de conexões (ignorados no SQLite, que não usa um pool de conexões fixo)
+
+        DB_POOL_PRE_PING: Testa cada conexão antes de usá-la, descartando conexões que
+        foram fechadas pelo servidor do banco de dados
+
+        DB_STATEMENT_TIMEOUT_MS: Tempo máximo de execução de um comando no PostgreSQL
+
+        SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_SIZE_KB:
+        PRAGMAs aplicados a cada nova conexão SQLite. O modo WAL permite leituras
+        simultâneas a uma escrita, e o busy_timeout faz uma escrita esperar pelo lock
+        em vez de falhar imediatamente com "database is locked"
+
+        BCRYPT_LOG_ROUNDS, HASH_PROCESSOS, HASH_FILA_MAX, HASH_FILA_TIMEOUT: Configuração
+        do pool de hashing de senhas (ver FlaskEmprestimo.senhas)
+
+        USUARIO_CACHE_TTL, USUARIO_CACHE_MAX: Configuração do cache de identidades dos
+        usuários logados (ver FlaskEmprestimo.identidades)
+
+        IMPORTACAO_TOKEN: Token exigido pela importação de empréstimos em lote pela API.
+        Enquanto não for configurado, a importação pela API fica desativada
+
+        IMPORTACAO_TAMANHO_LOTE: Quantidade de empréstimos inseridos em cada transação
+        durante uma importação
+
+        METRICAS_ATIVAS, METRICAS_LIMITE_N_MAIS_UM: Instrumentação das requisições e rota
+        /metrics (ver FlaskEmprestimo.metricas)
+
+        STATUS_TOKEN: Token exigido pelas rotas de monitoramento (/metrics,
+        /status/cache-usuarios e /status/fila-analise). Enquanto não for configurado, essas
+        rotas ficam desativadas
+
+        CACHE_PAGINAS_MAX_BYTES, CACHE_PAGINAS_REDIS_URL: Cache dos trechos renderizados das
+        páginas de cada usuário (ver FlaskEmprestimo.cache_paginas)
+
+        AMORTIZACAO_SISTEMA: Sistema de amortização dos novos empréstimos, 'price' ou 'sac'
+        (ver FlaskEmprestimo.amortizacao)
+
+        POLITICAS_ARQUIVO, POLITICAS_INTERVALO: Arquivo com as regras de crédito e intervalo
+        entre as verificações de alterações no arquivo (ver FlaskEmprestimo.politicas)
+
+        FILA_ANALISE_TRABALHADORES, FILA_ANALISE_LOTE, FILA_ANALISE_INTERVALO,
+        FILA_ANALISE_RESERVA: Trabalhadores da fila de análise de empréstimos (ver
+        FlaskEmprestimo.fila_analise)
+
+        API_TOKEN_VALIDADE: Tempo, em segundos, em que um token da API continua válido
+
+        API_COMPRESSAO_MINIMO, API_COMPRESSAO_NIVEL: Tamanho mínimo, em bytes, das respostas
+        da API comprimidas com gzip e nível de compressão (ver FlaskEmprestimo.api)
+
+        LIMITE_ATIVO, LIMITE_IP, LIMITE_IP_JANELA, LIMITE_CPF, LIMITE_CPF_JANELA,
+        LIMITE_MAX_CHAVES, LIMITE_REDIS_URL: Limite de tentativas de login e cadastro por IP
+        e por CPF (ver FlaskEmprestimo.limites)
+
+        SERVIDOR_MODO, SERVIDOR_ENDERECO, SERVIDOR_PROCESSOS, SERVIDOR_THREADS,
+        SERVIDOR_TIMEOUT, SERVIDOR_TIMEOUT_GRACIOSO, SERVIDOR_MAX_REQUISICOES: Valores
+        padrão do servidor de produção (ver servidor.py)
+    """
+    SECRET_KEY = _env('SECRET_KEY', '35d9a306792f2de5075a4f32bfe09da6')
+    SQLALCHEMY_DATABASE_URI = _env('DATABASE_URL', 'sqlite:///FlaskEmprestimo.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    DB_POOL_SIZE = _env('DB_POOL_SIZE', 10, int)
+    DB_MAX_OVERFLOW = _env('DB_MAX_OVERFLOW', 20, int)
+    DB_POOL_TIMEOUT = _env('DB_POOL_TIMEOUT', 30, int)
+    DB_POOL_RECYCLE = _env('DB_POOL_RECYCLE', 1800, int)
+    DB_POOL_PRE_PING = _env('DB_POOL_PRE_PING', '1') == '1'
+    DB_STATEMENT_TIMEOUT_MS = _env('DB_STATEMENT_TIMEOUT_MS', 5000, int)
+
+    SQLITE_JOURNAL_MODE = _env('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = _env('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = _env('SQLITE_BUSY_TIMEOUT_MS', 5000, int)
+    SQLITE_CACHE_SIZE_KB = _env('SQLITE_CACHE_SIZE_KB', 20000, int)
+
+    BCRYPT_LOG_ROUNDS = _env('BCRYPT_LOG_ROUNDS', 12, int)
+    HASH_PROCESSOS = _env('HASH_PROCESSOS', 2, int)
+    HASH_FILA_MAX = _env('HASH_FILA_MAX', 64, int)
+    HASH_FILA_TIMEOUT = _env('HASH_FILA_TIMEOUT', 5, int)
+
+    USUARIO_CACHE_TTL = _env('USUARIO_CACHE_TTL', 60, int)
+    USUARIO_CACHE_MAX = _env('USUARIO_CACHE_MAX', 10000, int)
+
+    IMPORTACAO_TOKEN = _env('IMPORTACAO_TOKEN', None)
+    IMPORTACAO_TAMANHO_LOTE = _env('IMPORTACAO_TAMANHO_LOTE', 1000, int)
+
+    METRICAS_ATIVAS = _env('METRICAS_ATIVAS', '0') == '1'
+    METRICAS_LIMITE_N_MAIS_UM = _env('METRICAS_LIMITE_N_MAIS_UM', 5, int)
+    STATUS_TOKEN = _env('STATUS_TOKEN', None)
+
+    CACHE_PAGINAS_MAX_BYTES = _env('CACHE_PAGINAS_MAX_BYTES', 32 * 1024 * 1024, int)
+    CACHE_PAGINAS_REDIS_URL = _env('CACHE_PAGINAS_REDIS_URL', None)
+
+    AMORTIZACAO_SISTEMA = _env('AMORTIZACAO_SISTEMA', 'price')
+
+    POLITICAS_ARQUIVO = _env('POLITICAS_ARQUIVO', os.path.join(os.path.dirname(__file__), 'politicas.json'))
+    POLITICAS_INTERVALO = _env('POLITICAS_INTERVALO', 5, float)
+
+    FILA_ANALISE_TRABALHADORES = _env('FILA_ANALISE_TRABALHADORES', 2, int)
+    FILA_ANALISE_LOTE = _env('FILA_ANALISE_LOTE', 50, int)
+    FILA_ANALISE_INTERVALO = _env('FILA_ANALISE_INTERVALO', 2, float)
+    FILA_ANALISE_RESERVA = _env('FILA_ANALISE_RESERVA', 60, int)
+
+    API_TOKEN_VALIDADE = _env('API_TOKEN_VALIDADE', 24 * 60 * 60, int)
+    API_COMPRESSAO_MINIMO = _env('API_COMPRESSAO_MINIMO', 1024, int)
+    API_COMPRESSAO_NIVEL = _env('API_COMPRESSAO_NIVEL', 5, int)
+
+    LIMITE_ATIVO = _env('LIMITE_ATIVO', '1') == '1'
+    LIMITE_IP = _env('LIMITE_IP', 30, int)
+    LIMITE_IP_JANELA = _env('LIMITE_IP_JANELA', 60, int)
+    LIMITE_CPF = _env('LIMITE_CPF', 5, int)
+    LIMITE_CPF_JANELA = _env('LIMITE_CPF_JANELA', 300, int)
+    LIMITE_MAX_CHAVES = _env('LIMITE_MAX_CHAVES', 100000, int)
+    LIMITE_REDIS_URL = _env('LIMITE_REDIS_URL', None)
+
+    SERVIDOR_MODO = _env('SERVIDOR_MODO', 'wsgi')
+    SERVIDOR_ENDERECO = _env('SERVIDOR_ENDERECO', '127.0.0.1:8000')
+    SERVIDOR_PROCESSOS = _env('SERVIDOR_PROCESSOS', 2 * (os.cpu_count() or 1) + 1, int)
+    SERVIDOR_THREADS = _env('SERVIDOR_THREADS', 4, int)
+    SERVIDOR_TIMEOUT = _env('SERVIDOR_TIMEOUT', 30, int)
+    SERVIDOR_TIMEOUT_GRACIOSO = _env('SERVIDOR_TIMEOUT_GRACIOSO', 30, int)
+    SERVIDOR_MAX_REQUISICOES = _env('SERVIDOR_MAX_REQUISICOES', 0, int)
+
+
+def opcoes_engine(config):
+    """
+    Monta as opções de create_engine() (SQLALCHEMY_ENGINE_OPTIONS) de acordo com o banco
+    de dados configurado
+    """
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    opcoes = {'pool_pre_ping': config['DB_POOL_PRE_PING']}
+
+    if uri.startswith('sqlite'):
+        # O timeout do driver sqlite3 é a espera pelo lock do banco, em segundos
+        opcoes['connect_args'] = {'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000}
+        return opcoes
+
+    opcoes.update({
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    })
+    if uri.startswith('postgresql'):
+        opcoes['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"}
+    return opcoes
+
+
+def aplicar_pragmas_sqlite(conexao, config):
+    """
+    Aplica os PRAGMAs configurados numa conexão sqlite3 recém aberta
+    """
+    cursor = conexao.cursor()
+    cursor.execute(f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}")
+    cursor.execute(f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}")
+    cursor.execute(f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}")
+    # Valores negativos de cache_size são interpretados pelo SQLite como KiB
+    cursor.execute(f"PRAGMA cache_size=-{int(config['SQLITE_CACHE_SIZE_KB'])}")
+    cursor.close()
+
+
+def _configurar_conexao(conexao, registro):
+    # As conexões dos engines da aplicação são abertas dentro do contexto da aplicação
+    # dona do engine, então os PRAGMAs são os da configuração dela. Engines criados fora
+    # da aplicação não são alterados
+    if isinstance(conexao, sqlite3.Connection) and has_app_context():
+        aplicar_pragmas_sqlite(conexao, current_app.config)
+
+
+def configurar_banco(app):
+    """
+    Preenche SQLALCHEMY_ENGINE_OPTIONS e registra a aplicação dos PRAGMAs do SQLite em
+    cada nova conexão. Deve ser chamada antes de db.init_app()
+    """
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', opcoes_engine(app.config))
+    if not event.contains(Engine, 'connect', _configurar_conexao):
+        event.listen(Engine, 'connect', _configurar_conexao)
@@ -0,0 +1,238 @@
+from sqlalchemy import func, case, or_, and_, select
+from FlaskEmprestimo.extensoes import db
+from FlaskEmprestimo.models import Emprestimo, Parcela, EventoEmprestimo, SaldoUsuario
+
+# Consultas agregadas sobre os empréstimos, executadas inteiramente no banco de dados
+# para que as páginas não precisem carregar todos os empréstimos de um usuário
+
+TAMANHO_PAGINA = 20
+
+
+def saldo_devedor_emprestimo():
+    """
+    Expressão SQL do saldo devedor de um empréstimo: a soma das parcelas ainda não pagas do
+    seu cronograma salvo, que já inclui o arredondamento absorvido pela última parcela.
+    Empréstimos sem cronograma salvo usam valor_parcela * parcelas_restantes
+    """
+    nao_pagas = select(func.sum(Parcela.valor)).where(Parcela.id_emprestimo == Emprestimo.id,
+        Parcela.numero > Emprestimo.parcelas - Emprestimo.parcelas_restantes).scalar_subquery()
+    return func.coalesce(nao_pagas, Emprestimo.valor_parcela_centavos * Emprestimo.parcelas_restantes)
+
+
+def saldos_devedores(ids_emprestimos):
+    """
+    Retorna o saldo devedor em centavos (ver saldo_devedor_emprestimo()) de cada empréstimo, num
+    dicionário {id do empréstimo: saldo}
+    """
+    if not ids_emprestimos:
+        return {}
+    return dict(db.session.query(Emprestimo.id, saldo_devedor_emprestimo()).filter(Emprestimo.id.in_(ids_emprestimos)))
+
+
+def somar_parcelas(faixas):
+    """
+    Soma, com uma única consulta, o valor em centavos das parcelas salvas de cada faixa
+    {id do empréstimo: (primeira parcela, última parcela)}. Os empréstimos com a mesma faixa
+    são filtrados juntos, então o tamanho da consulta depende da quantidade de faixas
+    diferentes, e não da quantidade de empréstimos. Retorna um dicionário {id do
+    empréstimo: soma}, sem os empréstimos que não possuem cronograma salvo
+    """
+    if not faixas:
+        return {}
+    por_faixa = {}
+    for id_emprestimo, faixa in faixas.items():
+        por_faixa.setdefault(faixa, []).append(id_emprestimo)
+    return dict(db.session.query(Parcela.id_emprestimo, func.sum(Parcela.valor))
+        .filter(or_(*(and_(Parcela.id_emprestimo.in_(ids), Parcela.numero.between(primeira, ultima))
+            for (primeira, ultima), ids in por_faixa.items())))
+        .group_by(Parcela.id_emprestimo))
+
+
+def resumo_emprestimos(id_usuario):
+    """
+    Retorna um resumo dos empréstimos de um usuário, lido da projeção saldo_usuario (mantida
+    pelo registro de eventos, ver FlaskEmprestimo.eventos) com uma consulta pela chave
+    primária, qualquer que seja a quantidade de empréstimos do usuário.
+    As chaves do dicionário retornado são as mesmas de calcular_resumo_emprestimos()
+    """
+    totais = db.session.query(SaldoUsuario.qtd_total, SaldoUsuario.qtd_ativos, SaldoUsuario.saldo_devedor_centavos,
+        SaldoUsuario.valor_total_centavos).filter(SaldoUsuario.id_usuario == id_usuario).first()
+    qtd_total, qtd_ativos, saldo_devedor, valor_total = totais or (0, 0, 0, 0)
+    return {
+        'qtd_total': qtd_total,
+        'qtd_ativos': qtd_ativos,
+        'saldo_devedor': saldo_devedor / 100,
+        'valor_total': valor_total / 100,
+    }
+
+
+def calcular_resumo_emprestimos(id_usuario):
+    """
+    Calcula o resumo dos empréstimos de um usuário a partir dos próprios empréstimos, com
+    uma única consulta agregada (usando o índice de Emprestimo em (id_usuario, ativo)).
+    Usada para conferir a projeção lida por resumo_emprestimos().
+
+    Chaves do dicionário retornado:
+        qtd_total: Quantidade de empréstimos já feitos pelo usuário, ativos ou não
+
+        qtd_ativos: Quantidade de empréstimos ainda ativos
+
+        saldo_devedor: Soma do saldo devedor (ver saldo_devedor_emprestimo()) dos empréstimos ativos
+
+        valor_total: Soma do valor total (com juros) de todos os empréstimos
+    """
+    ativo = case([(Emprestimo.ativo == True, 1)], else_=0)
+    saldo = case([(Emprestimo.ativo == True, saldo_devedor_emprestimo())], else_=0)
+
+    qtd_total, qtd_ativos, saldo_devedor, valor_total = db.session.query(
+        func.count(Emprestimo.id),
+        func.coalesce(func.sum(ativo), 0),
+        func.coalesce(func.sum(saldo), 0),
+        func.coalesce(func.sum(Emprestimo.valor_centavos), 0),
+    ).filter(Emprestimo.id_usuario == id_usuario).one()
+
+    return {
+        'qtd_total': qtd_total,
+        'qtd_ativos': qtd_ativos,
+        'saldo_devedor': saldo_devedor / 100,
+        'valor_total': valor_total / 100,
+    }
+
+
+def pagina_emprestimos(id_usuario, cursor=None, tamanho=TAMANHO_PAGINA, colunas=None):
+    """
+    Retorna uma página do histórico de empréstimos de um usuário, ordenado por
+    (parcelas_restantes, id), usando paginação por cursor (keyset) sobre o índice
+    ix_emprestimo_usuario_parcelas. Diferente de OFFSET, o custo de cada página não
+    cresce com a quantidade de páginas anteriores.
+
+    Parâmetros:
+        cursor: Texto no formato "parcelas_restantes-id" do último empréstimo da página
+        anterior, ou None para a primeira página
+
+        tamanho: Quantidade máxima de empréstimos na página
+
+        colunas: Nomes das colunas selecionadas (devem incluir id e parcelas_restantes).
+        Caso informadas, a página contém apenas tuplas com essas colunas, sem criar
+        objetos Emprestimo
+
+    Retorna uma tupla (emprestimos, proximo_cursor), onde proximo_cursor é None quando
+    não há mais páginas
+    """
+    if colunas:
+        consulta = db.session.query(*(getattr(Emprestimo, coluna) for coluna in colunas))
+    else:
+        consulta = Emprestimo.query
+    consulta = consulta.filter(Emprestimo.id_usuario == id_usuario)
+
+    posicao = ler_cursor(cursor)
+    if posicao:
+        parcelas_restantes, id_emprestimo = posicao
+        consulta = consulta.filter(or_(
+            Emprestimo.parcelas_restantes > parcelas_restantes,
+            and_(Emprestimo.parcelas_restantes == parcelas_restantes, Emprestimo.id > id_emprestimo)))
+
+    # Busca um empréstimo a mais apenas para saber se existe uma próxima página
+    emprestimos = consulta.order_by(Emprestimo.parcelas_restantes, Emprestimo.id).limit(tamanho + 1).all()
+
+    proximo_cursor = None
+    if len(emprestimos) > tamanho:
+        emprestimos = emprestimos[:tamanho]
+        ultimo = emprestimos[-1]
+        proximo_cursor = f'{ultimo.parcelas_restantes}-{ultimo.id}'
+
+    return emprestimos, proximo_cursor
+
+
+def ler_cursor(cursor):
+    """
+    Converte um cursor no formato "parcelas_restantes-id" para uma tupla de inteiros,
+    retorna None caso o cursor esteja vazio ou seja inválido
+    """
+    if not cursor:
+        return None
+    try:
+        parcelas_restantes, id_emprestimo = cursor.split('-')
+        return int(parcelas_restantes), int(id_emprestimo)
+    except ValueError:
+        return None
+
+
+COLUNAS_EXPORTACAO = ('id', 'valor', 'parcelas', 'valor_parcela', 'parcelas_restantes', 'ativo', 'situacao')
+
+
+def colunas_emprestimo(id_emprestimo, id_usuario, colunas=COLUNAS_EXPORTACAO):
+    """
+    Retorna uma tupla com as colunas de um empréstimo do usuário, sem criar um objeto
+    Emprestimo, ou None caso o empréstimo não exista ou pertença a outro usuário
+    """
+    return db.session.query(*(getattr(Emprestimo, coluna) for coluna in colunas)) \
+        .filter(Emprestimo.id == id_emprestimo, Emprestimo.id_usuario == id_usuario).first()
+
+
+def historico_emprestimos(id_usuario, lote=500):
+    """
+    Percorre todo o histórico de empréstimos de um usuário, na mesma ordem da página de
+    detalhes, retornando uma tupla com as COLUNAS_EXPORTACAO de cada empréstimo.
+    Seleciona apenas as colunas (sem criar objetos Emprestimo) e busca as linhas do banco
+    em lotes, para que a exportação não carregue o histórico inteiro na memória
+    """
+    colunas = [getattr(Emprestimo, coluna) for coluna in COLUNAS_EXPORTACAO]
+    consulta = db.session.query(*colunas).filter(Emprestimo.id_usuario == id_usuario) \
+        .order_by(Emprestimo.parcelas_restantes, Emprestimo.id) \
+        .yield_per(lote)
+    for linha in consulta:
+        yield tuple(linha)
+
+
+def proximas_parcelas(ids_emprestimos):
+    """
+    Lê dos cronogramas salvos a próxima parcela a pagar e o saldo a pagar (soma das parcelas
+    ainda não pagas) de cada empréstimo, com duas consultas para todos os empréstimos.
+
+    Retorna um dicionário {id do empréstimo: {'numero', 'valor', 'juros', 'amortizacao',
+    'saldo'}}, com os valores em reais. Empréstimos quitados ou sem cronograma não aparecem
+    """
+    if not ids_emprestimos:
+        return {}
+    nao_paga = Parcela.numero > Emprestimo.parcelas - Emprestimo.parcelas_restantes
+    consulta = db.session.query(Parcela).join(Emprestimo, Parcela.id_emprestimo == Emprestimo.id) \
+        .filter(Emprestimo.id.in_(ids_emprestimos))
+
+    saldos = dict(consulta.with_entities(Parcela.id_emprestimo, func.sum(Parcela.valor))
+        .filter(nao_paga).group_by(Parcela.id_emprestimo))
+
+    proximas = {}
+    for parcela in consulta.filter(Parcela.numero == Emprestimo.parcelas - Emprestimo.parcelas_restantes + 1):
+        proximas[parcela.id_emprestimo] = {
+            'numero': parcela.numero,
+            'valor': parcela.valor / 100,
+            'juros': parcela.juros / 100,
+            'amortizacao': parcela.amortizacao / 100,
+            'saldo': saldos.get(parcela.id_emprestimo, 0) / 100,
+        }
+    return proximas
+
+
+def datas_pagamento(id_emprestimo):
+    """
+    Lê do registro de eventos o momento (timestamp Unix) em que cada parcela de um empréstimo
+    foi paga. Retorna um dicionário {número da parcela: momento}, sem as parcelas pagas
+    antes do registro de eventos existir, cujo momento é desconhecido
+    """
+    datas = {}
+    pagas = 0
+    for parcelas, criado_em in db.session.query(EventoEmprestimo.parcelas, EventoEmprestimo.criado_em) \
+            .filter(EventoEmprestimo.id_emprestimo == id_emprestimo, EventoEmprestimo.tipo == 'parcela_paga') \
+            .order_by(EventoEmprestimo.id):
+        if criado_em is not None:
+            datas.update((numero, criado_em) for numero in range(pagas + 1, pagas + parcelas + 1))
+        pagas += parcelas
+    return datas
+
+
+def cronograma_emprestimo(id_emprestimo):
+    """
+    Retorna as parcelas do cronograma salvo de um empréstimo, em ordem
+    """
+    return Parcela.query.filter_by(id_emprestimo=id_emprestimo).order_by(Parcela.numero).all()
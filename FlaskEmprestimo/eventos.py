@@ -0,0 +1,231 @@
+import time
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from FlaskEmprestimo.extensoes import db
+from FlaskEmprestimo.models import Usuario, Emprestimo, EventoEmprestimo, SaldoUsuario
+from FlaskEmprestimo.consultas import saldo_devedor_emprestimo, somar_parcelas
+
+# Registro de eventos dos empréstimos e projeção dos totais de cada usuário.
+#
+# Cada alteração de um empréstimo (originação, decisão da fila de análise, pagamento de
+# parcelas e quitação) insere os seus eventos na tabela evento_emprestimo, na mesma
+# transação da alteração, e soma a variação causada por eles à linha do usuário na
+# tabela saldo_usuario. Assim o perfil lê os totais do usuário com uma consulta pela
+# chave primária, em vez de agregar todos os seus empréstimos, e o histórico de
+# pagamentos fica guardado nos eventos.
+#
+# A projeção pode ser reconstruída a partir dos eventos a qualquer momento (comando
+# "flask reconstruir-saldos"), e comparada com os totais calculados a partir dos
+# empréstimos com divergencias().
+#
+# Os saldos e os valores pagos registrados são somas das parcelas do cronograma salvo de
+# cada empréstimo (ver consultas.saldo_devedor_emprestimo()), e não múltiplos do valor da primeira
+# parcela, que difere da última parcela pelo arredondamento.
+
+COLUNAS_SALDO = ('qtd_total', 'qtd_ativos', 'saldo_devedor_centavos', 'valor_total_centavos')
+
+# INSERT ... ON CONFLICT DO UPDATE de cada banco que o suporta. Nos demais, a projeção é
+# atualizada com um UPDATE seguido de um INSERT quando o usuário ainda não possui linha
+INSERT_COM_CONFLITO = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def evento(id_emprestimo, id_usuario, tipo, parcelas=0, valor_centavos=0, saldo_centavos=0):
+    """
+    Retorna o dicionário com as colunas de um evento, no formato esperado por registrar()
+    """
+    return {'id_emprestimo': id_emprestimo, 'id_usuario': id_usuario, 'tipo': tipo, 'parcelas': parcelas,
+        'valor_centavos': valor_centavos, 'saldo_centavos': saldo_centavos, 'criado_em': time.time()}
+
+
+def variacao(tipo, valor_centavos, saldo_centavos):
+    """
+    Retorna a variação (qtd_total, qtd_ativos, saldo_devedor_centavos, valor_total_centavos)
+    dos totais do usuário causada por um evento. Um empréstimo passa a ser ativo quando é
+    originado já aprovado (com saldo devedor) ou aprovado pela fila de análise, e deixa de
+    ser ativo quando é quitado
+    """
+    if tipo == 'originado':
+        return 1, 1 if saldo_centavos > 0 else 0, saldo_centavos, valor_centavos
+    return 0, {'aprovado': 1, 'quitado': -1}.get(tipo, 0), saldo_centavos, 0
+
+
+def registrar(eventos):
+    """
+    Insere os eventos (criados por evento()) com um único INSERT com vários valores e soma
+    a variação causada por eles aos totais de cada usuário. Não faz commit: deve ser
+    chamada na transação da alteração que os eventos registram
+    """
+    if not eventos:
+        return 0
+    variacoes = {}
+    for linha in eventos:
+        atual = variacoes.get(linha['id_usuario'], (0, 0, 0, 0))
+        nova = variacao(linha['tipo'], linha['valor_centavos'], linha['saldo_centavos'])
+        variacoes[linha['id_usuario']] = tuple(a + b for a, b in zip(atual, nova))
+    db.session.execute(EventoEmprestimo.__table__.insert(), eventos)
+    _aplicar(variacoes)
+    return len(eventos)
+
+
+def _aplicar(variacoes):
+    tabela = SaldoUsuario.__table__
+    # Os usuários são atualizados sempre na mesma ordem, para que duas transações que
+    # alteram os mesmos usuários não travem uma à outra no PostgreSQL
+    linhas = [{'id_usuario': id_usuario, **dict(zip(COLUNAS_SALDO, valores))}
+        for id_usuario, valores in sorted(variacoes.items())]
+
+    inserir = INSERT_COM_CONFLITO.get(db.engine.dialect.name)
+    if inserir is not None:
+        comando = inserir(tabela)
+        comando = comando.on_conflict_do_update(index_elements=[tabela.c.id_usuario],
+            set_={coluna: tabela.c[coluna] + comando.excluded[coluna] for coluna in COLUNAS_SALDO})
+        db.session.execute(comando, linhas)
+        return
+
+    for linha in linhas:
+        atualizadas = db.session.execute(tabela.update().where(tabela.c.id_usuario == linha['id_usuario'])
+            .values({coluna: tabela.c[coluna] + linha[coluna] for coluna in COLUNAS_SALDO})).rowcount
+        if not atualizadas:
+            db.session.execute(tabela.insert(), linha)
+
+
+def registrar_originacao(emprestimos):
+    """
+    Registra a originação de empréstimos criados por originacao.novo_emprestimo(), que já
+    devem possuir id (após db.session.flush() ou originacao.inserir_emprestimos()) e o
+    cronograma salvo. O saldo devedor inicial é a soma de todas as parcelas do cronograma.
+    Empréstimos em análise são originados sem saldo devedor, que é somado apenas quando a
+    fila de análise os aprova
+    """
+    aprovados = [emprestimo for emprestimo in emprestimos if emprestimo.situacao == 'aprovado']
+    saldos = somar_parcelas({emprestimo.id: (1, emprestimo.parcelas) for emprestimo in aprovados})
+    return registrar([evento(emprestimo.id, emprestimo.id_usuario, 'originado', emprestimo.parcelas,
+            emprestimo.valor_centavos,
+            saldos.get(emprestimo.id, emprestimo.valor_parcela_centavos * emprestimo.parcelas)
+            if emprestimo.situacao == 'aprovado' else 0)
+        for emprestimo in emprestimos])
+
+
+def registrar_decisoes(decisoes):
+    """
+    Registra as decisões da fila de análise. decisoes é uma lista de tuplas (id do
+    empréstimo, id do usuário, 'aprovado' ou 'recusado', saldo devedor do empréstimo em
+    centavos)
+    """
+    return registrar([evento(id_emprestimo, id_usuario, decisao,
+            saldo_centavos=saldo if decisao == 'aprovado' else 0)
+        for id_emprestimo, id_usuario, decisao, saldo in decisoes])
+
+
+def registrar_pagamentos(id_usuario, pagamentos):
+    """
+    Registra pagamentos de parcelas de empréstimos do usuário. pagamentos é uma lista de
+    tuplas (id do empréstimo, parcelas pagas, parcelas do empréstimo, valor da parcela em
+    centavos, parcelas restantes após o pagamento). O valor pago é a soma das parcelas
+    pagas no cronograma salvo, ou o valor da parcela vezes a quantidade paga quando o
+    empréstimo não possui cronograma. O pagamento da última parcela também registra a
+    quitação
+    """
+    pagos = somar_parcelas({id_emprestimo: (parcelas - restantes - quantidade + 1, parcelas - restantes)
+        for id_emprestimo, quantidade, parcelas, _, restantes in pagamentos})
+    eventos = []
+    for id_emprestimo, quantidade, _, valor_parcela, restantes in pagamentos:
+        valor = pagos.get(id_emprestimo, quantidade * valor_parcela)
+        eventos.append(evento(id_emprestimo, id_usuario, 'parcela_paga', quantidade, valor, -valor))
+        if restantes == 0:
+            eventos.append(evento(id_emprestimo, id_usuario, 'quitado'))
+    return registrar(eventos)
+
+
+def eventos_iniciais(id_emprestimo, id_usuario, situacao, parcelas, parcelas_restantes, valor_centavos,
+        saldo_inicial_centavos, valor_pago_centavos):
+    """
+    Retorna os eventos que levam um empréstimo criado antes do registro de eventos existir
+    ao seu estado atual: a originação e, conforme a situação, a decisão da análise, as
+    parcelas já pagas (num único evento) e a quitação. saldo_inicial_centavos e
+    valor_pago_centavos são as somas de todas as parcelas e das parcelas já pagas (ver
+    migracoes.gerar_eventos_iniciais()). O momento desses eventos é desconhecido, então
+    criado_em fica vazio
+    """
+    eventos = [evento(id_emprestimo, id_usuario, 'originado', parcelas, valor_centavos,
+        saldo_inicial_centavos if situacao == 'aprovado' else 0)]
+    if situacao == 'recusado':
+        eventos.append(evento(id_emprestimo, id_usuario, 'recusado'))
+    elif situacao == 'aprovado':
+        pagas = parcelas - parcelas_restantes
+        if pagas:
+            eventos.append(evento(id_emprestimo, id_usuario, 'parcela_paga', pagas, valor_pago_centavos,
+                -valor_pago_centavos))
+        if parcelas_restantes == 0:
+            eventos.append(evento(id_emprestimo, id_usuario, 'quitado'))
+    for linha in eventos:
+        linha['criado_em'] = None
+    return eventos
+
+
+def _totais_dos_eventos():
+    # A mesma regra de variacao(), calculada pelo banco de dados
+    tipo = EventoEmprestimo.tipo
+    originado = tipo == 'originado'
+    return (
+        func.sum(case([(originado, 1)], else_=0)),
+        func.sum(case([(tipo == 'aprovado', 1), (tipo == 'quitado', -1),
+            (and_(originado, EventoEmprestimo.saldo_centavos > 0), 1)], else_=0)),
+        func.sum(EventoEmprestimo.saldo_centavos),
+        func.sum(case([(originado, EventoEmprestimo.valor_centavos)], else_=0)),
+    )
+
+
+def _faixas_usuarios(engine, tamanho_lote):
+    with engine.connect() as conexao:
+        ultimo_id = conexao.execute(select(func.max(Usuario.id))).scalar() or 0
+    for inicio in range(0, ultimo_id, tamanho_lote):
+        yield inicio, inicio + tamanho_lote
+
+
+def reconstruir_saldos(engine=None, tamanho_lote=1000):
+    """
+    Reconstrói a projeção saldo_usuario a partir do registro de eventos, em faixas de
+    tamanho_lote usuários. Em cada faixa, uma única transação apaga as linhas dos usuários
+    e as insere novamente com um INSERT ... SELECT que agrega os eventos no banco de dados.
+    Retorna a quantidade de usuários com saldo
+    """
+    engine = engine or db.engine
+    tabela = SaldoUsuario.__table__
+    reconstruidos = 0
+    for inicio, fim in _faixas_usuarios(engine, tamanho_lote):
+        na_faixa = and_(EventoEmprestimo.id_usuario > inicio, EventoEmprestimo.id_usuario <= fim)
+        totais = select(EventoEmprestimo.id_usuario, *_totais_dos_eventos()) \
+            .where(na_faixa).group_by(EventoEmprestimo.id_usuario)
+        with engine.begin() as conexao:
+            conexao.execute(tabela.delete().where(tabela.c.id_usuario > inicio, tabela.c.id_usuario <= fim))
+            reconstruidos += conexao.execute(
+                tabela.insert().from_select(('id_usuario',) + COLUNAS_SALDO, totais)).rowcount
+    return reconstruidos
+
+
+def divergencias(engine=None, tamanho_lote=1000):
+    """
+    Compara a projeção saldo_usuario com os totais calculados a partir da tabela emprestimo,
+    em faixas de tamanho_lote usuários. Retorna a lista (id do usuário, totais da projeção,
+    totais dos empréstimos) dos usuários cujos totais são diferentes
+    """
+    engine = engine or db.engine
+    ativo = case([(Emprestimo.ativo == True, 1)], else_=0)
+    saldo = case([(Emprestimo.ativo == True, saldo_devedor_emprestimo())], else_=0)
+    diferentes = []
+    for inicio, fim in _faixas_usuarios(engine, tamanho_lote):
+        calculados = select(Emprestimo.id_usuario, func.count(Emprestimo.id), func.sum(ativo), func.sum(saldo),
+                func.sum(Emprestimo.valor_centavos)) \
+            .where(Emprestimo.id_usuario > inicio, Emprestimo.id_usuario <= fim).group_by(Emprestimo.id_usuario)
+        projetados = select(SaldoUsuario.id_usuario, *(getattr(SaldoUsuario, coluna) for coluna in COLUNAS_SALDO)) \
+            .where(SaldoUsuario.id_usuario > inicio, SaldoUsuario.id_usuario <= fim)
+        with engine.connect() as conexao:
+            calculados = {id_usuario: tuple(totais) for id_usuario, *totais in conexao.execute(calculados)}
+            projetados = {id_usuario: tuple(totais) for id_usuario, *totais in conexao.execute(projetados)}
+        for id_usuario in sorted(calculados.keys() | projetados.keys()):
+            projecao = projetados.get(id_usuario, (0, 0, 0, 0))
+            calculo = calculados.get(id_usuario, (0, 0, 0, 0))
+            if projecao != calculo:
+                diferentes.append((id_usuario, projecao, calculo))
+    return diferentes
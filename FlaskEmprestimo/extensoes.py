@@ -0,0 +1,27 @@
+from flask_sqlalchemy import SQLAlchemy
+from flask_login import LoginManager
+from FlaskEmprestimo.senhas import PoolHash
+from FlaskEmprestimo.identidades import CacheUsuarios
+from FlaskEmprestimo.metricas import Metricas
+from FlaskEmprestimo.cache_paginas import CachePaginas
+from FlaskEmprestimo.politicas import MotorPoliticas
+from FlaskEmprestimo.limites import LimiteTentativas
+
+# Extensões usadas pela aplicação, criadas sem uma aplicação e inicializadas com
+# init_app() por criar_app() (ver FlaskEmprestimo/__init__.py). Os módulos da aplicação
+# importam as extensões daqui, então importá-los não cria nem configura uma aplicação.
+
+db = SQLAlchemy()
+pool_hash = PoolHash()
+cache_usuarios = CacheUsuarios()
+metricas = Metricas()
+cache_paginas = CachePaginas()
+motor_politicas = MotorPoliticas()
+limitador = LimiteTentativas()
+
+login_manager = LoginManager()
+login_manager.login_view = 'site.login'
+login_manager.login_message = 'Você precisa estar logado para acessar essa página'
+login_manager.login_message_category = 'info'
+
+metricas.coletor(limitador.exportar_metricas)
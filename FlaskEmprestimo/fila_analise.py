@@ -0,0 +1,340 @@
+import logging
+import secrets
+import threading
+import time
+from sqlalchemy import and_, or_
+from FlaskEmprestimo.extensoes import db, cache_paginas, metricas, motor_politicas
+from FlaskEmprestimo.metricas import Histograma
+from FlaskEmprestimo.amortizacao import centavos
+from FlaskEmprestimo.models import Usuario, Emprestimo, TarefaAnalise
+from FlaskEmprestimo.consultas import saldos_devedores
+from FlaskEmprestimo.eventos import registrar_decisoes
+
+# Fila de análise dos empréstimos cuja parcela passa do recomendado para o salário.
+# A fila é a tabela fila_analise: a requisição que cria o empréstimo apenas insere a
+# tarefa na mesma transação e retorna, e um grupo de threads em segundo plano processa as
+# tarefas em lotes, aplicando as regras de decisão da política em uso (ver
+# FlaskEmprestimo.politicas). Como a fila fica no banco de dados, as tarefas sobrevivem a
+# reinícios e vários processos podem processá-la ao mesmo tempo: cada lote é reservado
+# com um UPDATE condicional, então uma tarefa nunca é processada por dois trabalhadores.
+# As tarefas que nenhuma regra decide continuam na fila, marcadas para avaliação manual,
+# e são decididas com avaliar_manualmente() (comando "flask avaliar-analise").
+
+logger = logging.getLogger(__name__)
+
+BUCKETS_ESPERA = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+
+def enfileirar(emprestimos):
+    """
+    Insere na fila de análise os empréstimos em análise, com um único INSERT com vários
+    valores. Os empréstimos devem ter sido criados por originacao.novo_emprestimo() e já
+    possuir id (após db.session.flush() ou originacao.inserir_emprestimos()). Não faz
+    commit: após o commit, chame fila_analise.notificar() para que os trabalhadores não
+    esperem o próximo intervalo
+    """
+    agora = time.time()
+    linhas = [{'id_emprestimo': emprestimo.id, 'valor_centavos': centavos(emprestimo.valor_emprestado),
+        'criada_em': agora}
+        for emprestimo in emprestimos if emprestimo.situacao == 'em_analise']
+    if linhas:
+        db.session.execute(TarefaAnalise.__table__.insert(), linhas)
+    return len(linhas)
+
+
+def _aplicar_decisoes(decisoes):
+    """
+    Aplica as decisões {id do empréstimo: (id do usuário, 'aprovado' ou 'recusado')} aos
+    empréstimos que ainda estão em análise e registra os seus eventos, com o saldo devedor
+    lido dos cronogramas. Não faz commit. Retorna o conjunto dos ids dos empréstimos
+    decididos
+    """
+    if not decisoes:
+        return set()
+    # A condição situacao == 'em_analise' torna a decisão idempotente, caso a reserva
+    # tenha expirado e a tarefa tenha sido processada também por outro trabalhador: os
+    # empréstimos ainda em análise são lidos (e bloqueados no PostgreSQL) antes do
+    # UPDATE, e apenas as decisões tomadas aqui são registradas como eventos
+    pendentes = {id_emprestimo for id_emprestimo, in db.session.query(Emprestimo.id)
+        .filter(Emprestimo.id.in_(decisoes), Emprestimo.situacao == 'em_analise').with_for_update()}
+    for decisao in ('aprovado', 'recusado'):
+        ids = [id_emprestimo for id_emprestimo in pendentes if decisoes[id_emprestimo][1] == decisao]
+        if ids:
+            Emprestimo.query.filter(Emprestimo.id.in_(ids), Emprestimo.situacao == 'em_analise') \
+                .update({Emprestimo.situacao: decisao, Emprestimo.ativo: decisao == 'aprovado'},
+                    synchronize_session=False)
+    saldos = saldos_devedores(pendentes)
+    registrar_decisoes([(id_emprestimo, *decisoes[id_emprestimo], saldos[id_emprestimo])
+        for id_emprestimo in sorted(pendentes)])
+    return pendentes
+
+
+def avaliacoes_pendentes(limite=100):
+    """
+    Retorna os empréstimos que aguardam uma avaliação manual, dos mais antigos para os mais
+    novos: uma lista de tuplas (id do empréstimo, id do usuário, valor emprestado, parcelas,
+    valor da parcela, salário, momento em que entrou na fila)
+    """
+    return db.session.query(Emprestimo.id, Emprestimo.id_usuario, TarefaAnalise.valor, Emprestimo.parcelas,
+            Emprestimo.valor_parcela, Usuario.salario, TarefaAnalise.criada_em) \
+        .join(Emprestimo, TarefaAnalise.id_emprestimo == Emprestimo.id) \
+        .join(Usuario, Emprestimo.id_usuario == Usuario.id) \
+        .filter(TarefaAnalise.manual == True) \
+        .order_by(TarefaAnalise.id).limit(limite).all()
+
+
+def avaliar_manualmente(id_emprestimo, decisao):
+    """
+    Aprova ou recusa (decisao 'aprovado' ou 'recusado') um empréstimo em análise,
+    removendo a sua tarefa da fila. Retorna True caso o empréstimo tenha sido decidido, ou
+    False caso ele não exista ou não esteja mais em análise
+    """
+    if decisao not in ('aprovado', 'recusado'):
+        raise ValueError(f'Decisão inválida: {decisao}')
+    id_usuario = db.session.query(Emprestimo.id_usuario).filter(Emprestimo.id == id_emprestimo).scalar()
+    if id_usuario is None:
+        return False
+    decididos = _aplicar_decisoes({id_emprestimo: (id_usuario, decisao)})
+    TarefaAnalise.query.filter(TarefaAnalise.id_emprestimo == id_emprestimo).delete(synchronize_session=False)
+    db.session.commit()
+    if decididos:
+        cache_paginas.nova_versao(id_usuario)
+    return bool(decididos)
+
+
+class FilaAnalise:
+    """
+    Trabalhadores da fila de análise e suas métricas.
+
+    Os trabalhadores são threads iniciadas na primeira requisição atendida pela aplicação
+    (cada processo do servidor possui as suas). Comandos e scripts que não atendem
+    requisições podem processar a fila com processar_lote().
+
+    Configurações lidas da aplicação:
+        FILA_ANALISE_TRABALHADORES: Quantidade de threads. Com 0, a fila só é processada
+        pelo comando "flask processar-analises"
+
+        FILA_ANALISE_LOTE: Quantidade máxima de tarefas reservadas e decididas de uma vez
+
+        FILA_ANALISE_INTERVALO: Tempo, em segundos, que um trabalhador espera quando a fila
+        está vazia antes de consultá-la novamente
+
+        FILA_ANALISE_RESERVA: Tempo, em segundos, após o qual uma tarefa reservada por um
+        trabalhador que não terminou volta a ficar disponível
+
+    Atributos:
+        processadas, aprovadas, recusadas, manuais, lotes: Contadores das tarefas processadas
+        por este processo e de suas decisões (manuais são as que não foram decididas pelas
+        regras e foram marcadas para avaliação manual)
+
+        espera: Histograma do tempo entre a entrada na fila e a decisão, em segundos
+
+        tempo_processamento: Soma do tempo gasto processando os lotes, em segundos
+    """
+
+    def __init__(self, app=None):
+        self.trabalhadores = 0
+        self.tamanho_lote = 50
+        self.intervalo = 2
+        self.reserva = 60
+        self.processadas = 0
+        self.aprovadas = 0
+        self.recusadas = 0
+        self.manuais = 0
+        self.lotes = 0
+        self.tempo_processamento = 0
+        self.espera = Histograma(BUCKETS_ESPERA)
+        self._threads = []
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FILA_ANALISE_TRABALHADORES', 2)
+        app.config.setdefault('FILA_ANALISE_LOTE', 50)
+        app.config.setdefault('FILA_ANALISE_INTERVALO', 2)
+        app.config.setdefault('FILA_ANALISE_RESERVA', 60)
+        self.app = app
+        self.trabalhadores = app.config['FILA_ANALISE_TRABALHADORES']
+        self.tamanho_lote = app.config['FILA_ANALISE_LOTE']
+        self.intervalo = app.config['FILA_ANALISE_INTERVALO']
+        self.reserva = app.config['FILA_ANALISE_RESERVA']
+        app.before_first_request(self.iniciar)
+
+    def iniciar(self):
+        """
+        Inicia as threads dos trabalhadores, caso ainda não estejam rodando
+        """
+        with self._lock:
+            if self._threads or self.trabalhadores <= 0:
+                return
+            self._parar.clear()
+            for numero in range(self.trabalhadores):
+                thread = threading.Thread(target=self._trabalhar, name=f'fila-analise-{numero}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def encerrar(self):
+        """
+        Pede que os trabalhadores parem após o lote atual e espera que terminem
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        self._parar.set()
+        self._acordar.set()
+        for thread in threads:
+            thread.join()
+
+    def notificar(self):
+        """
+        Acorda os trabalhadores, chamado após o commit de novas tarefas
+        """
+        self._acordar.set()
+
+    def _trabalhar(self):
+        while not self._parar.is_set():
+            try:
+                with self.app.app_context():
+                    processadas = self.processar_lote()
+            except Exception:
+                logger.exception('Erro ao processar a fila de análise')
+                processadas = 0
+            if not processadas:
+                self._acordar.wait(self.intervalo)
+                self._acordar.clear()
+
+    def _reservar(self):
+        agora = time.time()
+        livre = and_(TarefaAnalise.manual == False,
+            or_(TarefaAnalise.reservada_ate == None, TarefaAnalise.reservada_ate < agora))
+        ids = [id_tarefa for id_tarefa, in db.session.query(TarefaAnalise.id).filter(livre)
+            .order_by(TarefaAnalise.id).limit(self.tamanho_lote)]
+        if not ids:
+            db.session.rollback()
+            return None
+        # A condição é repetida no UPDATE: tarefas reservadas por outro trabalhador entre a
+        # consulta e o UPDATE não são alteradas e ficam fora deste lote
+        dono = secrets.token_hex(8)
+        TarefaAnalise.query.filter(TarefaAnalise.id.in_(ids), livre) \
+            .update({TarefaAnalise.reservada_ate: agora + self.reserva, TarefaAnalise.dono: dono},
+                synchronize_session=False)
+        db.session.commit()
+        return dono
+
+    def processar_lote(self):
+        """
+        Reserva e decide um lote de tarefas. Retorna a quantidade de tarefas processadas
+        """
+        dono = self._reservar()
+        if dono is None:
+            return 0
+        inicio = time.perf_counter()
+
+        tarefas = db.session.query(TarefaAnalise.criada_em, TarefaAnalise.valor, Emprestimo.id,
+                Emprestimo.parcelas, Emprestimo.valor_parcela, Emprestimo.id_usuario, Usuario.salario) \
+            .join(Emprestimo, TarefaAnalise.id_emprestimo == Emprestimo.id) \
+            .join(Usuario, Emprestimo.id_usuario == Usuario.id) \
+            .filter(TarefaAnalise.dono == dono).all()
+
+        politica = motor_politicas.politica
+        decisoes = {}
+        for _, valor, id_emprestimo, parcelas, valor_parcela, id_usuario, salario in tarefas:
+            decisao = politica.decisao_analise(valor, parcelas, valor_parcela, salario)
+            if decisao is not None:
+                decisoes[id_emprestimo] = (id_usuario, decisao)
+
+        decididos_aqui = _aplicar_decisoes(decisoes)
+        usuarios = {decisoes[id_emprestimo][0] for id_emprestimo in decididos_aqui}
+        # Apenas as tarefas decididas saem da fila: as demais são liberadas e marcadas para
+        # avaliação manual, para que não sejam reservadas de novo pelos trabalhadores
+        TarefaAnalise.query.filter(TarefaAnalise.dono == dono, TarefaAnalise.id_emprestimo.in_(decisoes)) \
+            .delete(synchronize_session=False)
+        manuais = TarefaAnalise.query.filter(TarefaAnalise.dono == dono) \
+            .update({TarefaAnalise.manual: True, TarefaAnalise.dono: None, TarefaAnalise.reservada_ate: None},
+                synchronize_session=False)
+        db.session.commit()
+        for id_usuario in usuarios:
+            cache_paginas.nova_versao(id_usuario)
+
+        # Os contadores incluem apenas as decisões aplicadas por este trabalhador: caso a
+        # reserva tenha expirado, as tarefas já decididas ou reservadas por outro trabalhador
+        # são contadas por ele
+        aprovadas = sum(decisoes[id_emprestimo][1] == 'aprovado' for id_emprestimo in decididos_aqui)
+        recusadas = len(decididos_aqui) - aprovadas
+        agora = time.time()
+        with self._lock:
+            self.lotes += 1
+            self.processadas += aprovadas + recusadas + manuais
+            self.aprovadas += aprovadas
+            self.recusadas += recusadas
+            self.manuais += manuais
+            self.tempo_processamento += time.perf_counter() - inicio
+            for tarefa in tarefas:
+                self.espera.observar(agora - tarefa.criada_em)
+        return len(tarefas)
+
+    def processar_tudo(self):
+        """
+        Processa lotes até a fila ficar vazia. Retorna a quantidade de tarefas processadas
+        """
+        total = 0
+        while True:
+            processadas = self.processar_lote()
+            if not processadas:
+                return total
+            total += processadas
+
+    def profundidade(self):
+        """
+        Quantidade de tarefas na fila a serem processadas pelos trabalhadores (incluindo as
+        reservadas)
+        """
+        return db.session.query(db.func.count(TarefaAnalise.id)).filter(TarefaAnalise.manual == False).scalar()
+
+    def aguardando_avaliacao(self):
+        """
+        Quantidade de tarefas marcadas para avaliação manual
+        """
+        return db.session.query(db.func.count(TarefaAnalise.id)).filter(TarefaAnalise.manual == True).scalar()
+
+    def estatisticas(self):
+        profundidade = self.profundidade()
+        aguardando = self.aguardando_avaliacao()
+        with self._lock:
+            return {
+                'profundidade': profundidade,
+                'aguardando_avaliacao': aguardando,
+                'trabalhadores': len(self._threads),
+                'processadas': self.processadas,
+                'aprovadas': self.aprovadas,
+                'recusadas': self.recusadas,
+                'manuais': self.manuais,
+                'lotes': self.lotes,
+                'vazao': round(self.processadas / self.tempo_processamento, 2) if self.tempo_processamento else 0,
+                'espera_media': round(self.espera.soma / self.espera.total, 3) if self.espera.total else 0,
+            }
+
+    def exportar_metricas(self):
+        """
+        Linhas no formato do Prometheus, incluídas em /metrics
+        """
+        profundidade = self.profundidade()
+        aguardando = self.aguardando_avaliacao()
+        with self._lock:
+            linhas = ['# TYPE fila_analise_profundidade gauge', f'fila_analise_profundidade {profundidade}',
+                '# TYPE fila_analise_aguardando_avaliacao gauge', f'fila_analise_aguardando_avaliacao {aguardando}',
+                '# TYPE fila_analise_processadas_total counter']
+            for decisao, total in (('aprovado', self.aprovadas), ('recusado', self.recusadas),
+                    ('manual', self.manuais)):
+                linhas.append(f'fila_analise_processadas_total{{decisao="{decisao}"}} {total}')
+            linhas += ['# TYPE fila_analise_processamento_segundos counter',
+                f'fila_analise_processamento_segundos {self.tempo_processamento}',
+                '# TYPE fila_analise_espera_segundos histogram']
+            linhas += self.espera.exportar('fila_analise_espera_segundos', 'fila="analise"')
+        return linhas
+
+
+fila_analise = FilaAnalise()
+metricas.coletor(fila_analise.exportar_metricas)
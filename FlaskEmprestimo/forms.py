@@ -3,7 +3,7 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, BooleanField, PasswordField, DecimalField, IntegerField
 from wtforms.fields.core import SelectField
 from wtforms.validators import DataRequired, Length, EqualTo, Email, NumberRange, ValidationError
-from FlaskEmprestimo.models import Usuario
+from FlaskEmprestimo.cadastros import normalizar_cpf, normalizar_email, campos_em_uso
 
 class CadastrarUsuarioForm(FlaskForm):
     """
@@ -35,24 +35,22 @@ class CadastrarUsuarioForm(FlaskForm):
         os dados no banco de dados
 
     Métodos:
-        Métodos com validate_[atributo do form] são chamados automaticamente pelo
-        Flask quando se tenta enviar os dados que foram preenchidos no campo referente
-        ao atributo de mesmo nome
+        validate(): Chamado pelo Flask quando se tenta enviar os dados do formulário. Após as
+        validações de cada campo, verifica numa única consulta se o CPF ou o e-mail já foram
+        utilizados por outro usuário, não verifica se o número de CPF em si é válido
 
-        validate_cpf(): Verifica se o mesmo número de CPF já foi utilizado por outro usuário,
-        não verifica se o número de CPF em si é válido
-
-        validate_email(): Verifica se o mesmo e-mail já foi utilzado por outro usuário 
+    O CPF é normalizado para conter apenas os dígitos e o e-mail para letras minúsculas
+    antes das validações, da mesma forma que são salvos no banco de dados
     """
 
 
     nome = StringField('Nome Completo', validators=[DataRequired(), Length(min=2, max=50)])
     
-    cpf = StringField('CPF (somente números)', 
+    cpf = StringField('CPF (somente números)', filters=[normalizar_cpf],
         validators=[DataRequired(message='O preenchimento deste campo é obrigatório'),
         Length(min=11, max=11, message='Este campo deve conter 11 caracteres')])
 
-    email = StringField('E-mail', 
+    email = StringField('E-mail', filters=[normalizar_email],
         validators=[DataRequired(message='O preenchimento deste campo é obrigatório'),
         Email(message='Endereço de e-mail inválido')])
 
@@ -69,15 +67,21 @@ class CadastrarUsuarioForm(FlaskForm):
 
     submit = SubmitField('Cadastrar')
 
-    def validate_cpf(self, cpf):
-        controle = Usuario.query.filter_by(cpf=cpf.data).first()
-        if controle:
-            raise ValidationError('CPF já cadastrado.')
+    def validate(self, extra_validators=None):
+        if not super().validate(extra_validators):
+            return False
+        campos = campos_em_uso(self.cpf.data, self.email.data)
+        self.marcar_em_uso(campos)
+        return not campos
 
-    def validate_email(self, email):
-        controle = Usuario.query.filter_by(email=email.data).first()
-        if controle:
-            raise ValidationError('E-mail já cadastrado.')
+    def marcar_em_uso(self, campos):
+        """
+        Adiciona a mensagem de erro de cadastro repetido aos campos informados ('cpf' e/ou 'email')
+        """
+        if 'cpf' in campos:
+            self.cpf.errors.append('CPF já cadastrado.')
+        if 'email' in campos:
+            self.email.errors.append('E-mail já cadastrado.')
 
 
 class LoginForm(FlaskForm):
@@ -101,7 +105,7 @@ class LoginForm(FlaskForm):
         uma sessão para o usuário em questão
     """
 
-    cpf = StringField('CPF (somente números)',
+    cpf = StringField('CPF (somente números)', filters=[normalizar_cpf],
         validators=[DataRequired(message='O preenchimento deste campo é obrigatório'),
         Length(min=11, max=11, message='Este campo deve conter 11 caracteres')])
 
@@ -132,11 +136,13 @@ class PedirEmprestimoForm(FlaskForm):
         submit: Botão que deve ser apertado pelo usuário após o preenchimento de todos os dados
         anteriores, é usado para ativar a verificação dos dados e, se estiverem corretos, inserir
         os dados do empréstimo no banco de dados
+
+    O formulário é enviado para a rota /emprestimo/confirmar, que aplica as regras de recusa
+    da política em uso com simular_emprestimo()
     """
 
     valor = DecimalField('Valor do empréstimo (R$):',
-        validators=[DataRequired(message='O preenchimento deste campo é obrigatório'),
-        NumberRange(min=1000, max=20000, message='O valor mínimo para emprestimos é R$ 1000.00 e o máximo R$ 20000.00')])
+        validators=[DataRequired(message='O preenchimento deste campo é obrigatório')])
 
     parcelas = SelectField('Quantidade de parcelas:',
         choices=[
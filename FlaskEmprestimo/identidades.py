@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+from flask_login import UserMixin
+
+# Cache das identidades dos usuários logados, lido pelo user_loader do Flask-Login para
+# que cada requisição autenticada não precise consultar a tabela usuario.
+
+
+class Identidade(UserMixin):
+    """
+    Cópia somente leitura dos dados de um Usuario, usada como current_user nas requisições
+    atendidas pelo cache. Não é um objeto do banco de dados: alterações nos dados do
+    usuário devem ser feitas com um UPDATE seguido de CacheUsuarios.invalidar()
+
+    Atributos:
+        id, nome, cpf, email, salario: Mesmos valores das colunas de Usuario
+    """
+    __slots__ = ('id', 'nome', 'cpf', 'email', 'salario')
+
+    def __init__(self, usuario):
+        self.id = usuario.id
+        self.nome = usuario.nome
+        self.cpf = usuario.cpf
+        self.email = usuario.email
+        self.salario = usuario.salario
+
+    def __repr__(self):
+        return f"Usuário: ('{self.nome}', '{self.cpf}')"
+
+
+class CacheUsuarios:
+    """
+    Cache LRU com tempo de expiração das identidades dos usuários.
+
+    Cada processo possui o seu próprio cache, então uma alteração feita em outro processo
+    só é vista aqui depois que a entrada expirar (USUARIO_CACHE_TTL segundos).
+
+    Configurações lidas da aplicação:
+        USUARIO_CACHE_TTL: Tempo, em segundos, que uma identidade pode ficar no cache.
+        Com 0, o cache é desativado
+
+        USUARIO_CACHE_MAX: Quantidade máxima de identidades no cache, a identidade usada
+        há mais tempo é removida quando o limite é atingido
+
+    Atributos:
+        acertos, falhas, remocoes: Contadores de consultas atendidas pelo cache, consultas
+        que precisaram ir ao banco de dados e entradas removidas por falta de espaço
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 60
+        self.tamanho_max = 10000
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('USUARIO_CACHE_TTL', 60)
+        app.config.setdefault('USUARIO_CACHE_MAX', 10000)
+        self.ttl = app.config['USUARIO_CACHE_TTL']
+        self.tamanho_max = app.config['USUARIO_CACHE_MAX']
+
+    def obter(self, id_usuario, carregar):
+        """
+        Retorna a identidade do usuário, chamando carregar(id_usuario) para buscar o Usuario
+        no banco de dados caso ela não esteja no cache ou tenha expirado
+        """
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(id_usuario)
+            if entrada is not None and entrada[0] > agora:
+                self._entradas.move_to_end(id_usuario)
+                self.acertos += 1
+                return entrada[1]
+            self.falhas += 1
+
+        usuario = carregar(id_usuario)
+        if usuario is None:
+            self.invalidar(id_usuario)
+            return None
+
+        identidade = Identidade(usuario)
+        if self.ttl <= 0:
+            return identidade
+
+        with self._lock:
+            self._entradas[id_usuario] = (agora + self.ttl, identidade)
+            self._entradas.move_to_end(id_usuario)
+            while len(self._entradas) > self.tamanho_max:
+                self._entradas.popitem(last=False)
+                self.remocoes += 1
+        return identidade
+
+    def invalidar(self, id_usuario):
+        """
+        Remove a identidade do usuário do cache, deve ser chamado sempre que os dados
+        do usuário forem alterados
+        """
+        with self._lock:
+            self._entradas.pop(id_usuario, None)
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'tamanho': len(self._entradas),
+                'tamanho_max': self.tamanho_max,
+                'ttl': self.ttl,
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'remocoes': self.remocoes,
+            }
@@ -0,0 +1,211 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request
+from werkzeug.exceptions import TooManyRequests
+
+# Limite de tentativas das rotas de login e cadastro, por endereço IP e por CPF.
+# Cada tentativa dessas rotas custa um hash bcrypt, então uma rajada de tentativas (por
+# exemplo, testando senhas vazadas) ocuparia todos os processos do servidor. As tentativas
+# acima do limite são recusadas com 429 antes de qualquer consulta ao banco de dados ou
+# cálculo de hash.
+#
+# As tentativas são contadas com uma janela deslizante aproximada: guarda-se apenas a
+# contagem da janela atual e da anterior, e a contagem da anterior é ponderada pela parte
+# dela que ainda está dentro da janela deslizante. Cada chave ocupa poucos bytes e cada
+# verificação custa O(1).
+
+
+def _estimativa(anterior, atual, decorrido, janela):
+    return anterior * (1 - decorrido / janela) + atual
+
+
+def _espera(anterior, atual, decorrido, janela, limite):
+    """
+    Segundos até que a contagem estimada fique abaixo do limite
+    """
+    if anterior and atual < limite:
+        # A contagem da janela anterior perde peso linearmente até o fim da janela atual
+        espera = janela * (1 - (limite - 1 - atual) / anterior) - decorrido
+    elif atual and limite > 0:
+        # A janela atual já está cheia: depois do seu fim, ela passa a ser a anterior e
+        # também perde peso linearmente
+        espera = janela - decorrido + janela * (1 - (limite - 1) / atual)
+    else:
+        espera = janela - decorrido
+    return max(1, math.ceil(espera))
+
+
+class BackendMemoria:
+    """
+    Contadores dentro do próprio processo, com remoção LRU quando a quantidade de chaves
+    passa de max_chaves. As chaves removidas são as usadas há mais tempo, cujas janelas
+    normalmente já expiraram
+    """
+
+    def __init__(self, max_chaves=100000):
+        self.max_chaves = max_chaves
+        self.remocoes = 0
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consumir(self, chave, limite, janela, agora=None):
+        """
+        Conta uma tentativa para a chave. Retorna 0 caso a tentativa seja permitida, ou os
+        segundos que devem ser esperados antes da próxima tentativa
+        """
+        agora = time.time() if agora is None else agora
+        inicio = agora - agora % janela
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                anterior = atual = 0
+            else:
+                inicio_entrada, anterior, atual = entrada
+                if inicio_entrada != inicio:
+                    anterior = atual if inicio_entrada == inicio - janela else 0
+                    atual = 0
+                self._entradas.move_to_end(chave)
+
+            decorrido = agora - inicio
+            if _estimativa(anterior, atual, decorrido, janela) + 1 > limite:
+                self._entradas[chave] = (inicio, anterior, atual)
+                return _espera(anterior, atual, decorrido, janela, limite)
+
+            self._entradas[chave] = (inicio, anterior, atual + 1)
+            if len(self._entradas) > self.max_chaves:
+                self._entradas.popitem(last=False)
+                self.remocoes += 1
+            return 0
+
+    def tamanho(self):
+        return len(self._entradas)
+
+
+class BackendCompartilhado:
+    """
+    Contadores num cliente compartilhado entre processos, com a mesma interface do Redis
+    (get, incr e expire), para que o limite valha para todos os processos do servidor.
+    Cada janela é uma chave que expira sozinha, então não há remoção a fazer
+    """
+
+    def __init__(self, cliente):
+        self.cliente = cliente
+
+    def consumir(self, chave, limite, janela, agora=None):
+        agora = time.time() if agora is None else agora
+        numero = int(agora // janela)
+        decorrido = agora - numero * janela
+        atual_chave = f'limite:{chave}:{numero}'
+        # A tentativa é contada antes da verificação, então tentativas recusadas também
+        # contam, o que só atrasa quem continua tentando
+        atual = int(self.cliente.incr(atual_chave))
+        if atual == 1:
+            self.cliente.expire(atual_chave, int(janela * 2) + 1)
+        anterior = int(self.cliente.get(f'limite:{chave}:{numero - 1}') or 0)
+        if _estimativa(anterior, atual - 1, decorrido, janela) + 1 > limite:
+            # A espera considera a tentativa recusada, que continua contada
+            return _espera(anterior, atual, decorrido, janela, limite)
+        return 0
+
+    def tamanho(self):
+        return None
+
+
+class LimiteTentativas:
+    """
+    Limite de tentativas por IP e por CPF, aplicado às rotas com o decorador limitar().
+
+    Configurações lidas da aplicação:
+        LIMITE_ATIVO: Ativa os limites
+
+        LIMITE_IP, LIMITE_IP_JANELA: Quantidade de tentativas permitidas para um mesmo
+        endereço IP a cada LIMITE_IP_JANELA segundos
+
+        LIMITE_CPF, LIMITE_CPF_JANELA: Quantidade de tentativas permitidas para um mesmo
+        CPF a cada LIMITE_CPF_JANELA segundos, qualquer que seja o IP
+
+        LIMITE_MAX_CHAVES: Quantidade máxima de chaves (IPs e CPFs) no backend em memória
+
+        LIMITE_REDIS_URL: Caso configurado, usa um servidor Redis (pacote redis) como
+        backend compartilhado entre os processos. Sem ele, cada processo conta as suas
+        tentativas, e o limite efetivo é multiplicado pela quantidade de processos
+
+    O endereço IP é o request.remote_addr: atrás de um proxy reverso, a aplicação deve ser
+    envolvida pelo ProxyFix do werkzeug para que seja o IP do cliente.
+
+    Atributos:
+        recusadas: Contador das tentativas recusadas por tipo de chave ('ip' e 'cpf')
+    """
+
+    def __init__(self, app=None, backend=None):
+        self.ativo = True
+        self.backend = backend or BackendMemoria()
+        self.limites = {'ip': (30, 60), 'cpf': (5, 300)}
+        self.recusadas = {'ip': 0, 'cpf': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LIMITE_ATIVO', True)
+        app.config.setdefault('LIMITE_IP', 30)
+        app.config.setdefault('LIMITE_IP_JANELA', 60)
+        app.config.setdefault('LIMITE_CPF', 5)
+        app.config.setdefault('LIMITE_CPF_JANELA', 300)
+        app.config.setdefault('LIMITE_MAX_CHAVES', 100000)
+        app.config.setdefault('LIMITE_REDIS_URL', None)
+        self.ativo = app.config['LIMITE_ATIVO']
+        self.limites = {'ip': (app.config['LIMITE_IP'], app.config['LIMITE_IP_JANELA']),
+            'cpf': (app.config['LIMITE_CPF'], app.config['LIMITE_CPF_JANELA'])}
+        if app.config['LIMITE_REDIS_URL']:
+            import redis
+            self.backend = BackendCompartilhado(redis.Redis.from_url(app.config['LIMITE_REDIS_URL']))
+        else:
+            self.backend = BackendMemoria(app.config['LIMITE_MAX_CHAVES'])
+
+    def verificar(self, ip, cpf=None):
+        """
+        Conta uma tentativa para o IP e, caso informado, para o CPF. Retorna 0 caso a
+        tentativa seja permitida, ou os segundos que devem ser esperados
+        """
+        for tipo, valor in (('ip', ip), ('cpf', cpf)):
+            if not valor:
+                continue
+            limite, janela = self.limites[tipo]
+            espera = self.backend.consumir(f'{tipo}:{valor}', limite, janela)
+            if espera:
+                self.recusadas[tipo] += 1
+                return espera
+        return 0
+
+    def limitar(self, obter_cpf=None):
+        """
+        Decorador que aplica os limites às requisições POST da rota, antes da função da rota.
+        obter_cpf() deve retornar o CPF (normalizado) enviado na requisição, ou None.
+        Tentativas acima do limite recebem 429 com o cabeçalho Retry-After
+        """
+        def decorador(funcao):
+            @wraps(funcao)
+            def rota(*args, **kwargs):
+                if self.ativo and request.method == 'POST':
+                    espera = self.verificar(request.remote_addr, obter_cpf() if obter_cpf else None)
+                    if espera:
+                        raise TooManyRequests(
+                            f'Muitas tentativas, tente novamente em {espera} segundos', retry_after=espera)
+                return funcao(*args, **kwargs)
+            return rota
+        return decorador
+
+    def exportar_metricas(self):
+        """
+        Linhas no formato do Prometheus, incluídas em /metrics
+        """
+        linhas = ['# TYPE limite_tentativas_recusadas_total counter']
+        linhas += [f'limite_tentativas_recusadas_total{{chave="{tipo}"}} {total}'
+            for tipo, total in self.recusadas.items()]
+        tamanho = self.backend.tamanho()
+        if tamanho is not None:
+            linhas += ['# TYPE limite_tentativas_chaves gauge', f'limite_tentativas_chaves {tamanho}']
+        return linhas
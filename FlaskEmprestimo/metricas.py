@@ -0,0 +1,199 @@
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from flask import abort, current_app, g, request, has_request_context, Response
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Instrumentação opcional das requisições: latência por rota, consultas SQL e tempo de
+# renderização dos templates, exportados no formato de texto do Prometheus em /metrics.
+# Ativada com METRICAS_ATIVAS=1.
+
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_CONSULTAS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histograma:
+    """
+    Histograma cumulativo no formato do Prometheus, com buckets fixos
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.contagens = [0] * (len(buckets) + 1)
+        self.soma = 0
+        self.total = 0
+
+    def observar(self, valor):
+        self.contagens[bisect_left(self.buckets, valor)] += 1
+        self.soma += valor
+        self.total += 1
+
+    def exportar(self, nome, rotulos):
+        linhas = []
+        acumulado = 0
+        for limite, contagem in zip(self.buckets + ('+Inf',), self.contagens):
+            acumulado += contagem
+            linhas.append(f'{nome}_bucket{{{rotulos},le="{limite}"}} {acumulado}')
+        linhas.append(f'{nome}_sum{{{rotulos}}} {self.soma}')
+        linhas.append(f'{nome}_count{{{rotulos}}} {self.total}')
+        return linhas
+
+
+class TemplateMedido(Template):
+    """
+    Template do Jinja que soma o seu tempo de renderização ao da requisição atual.
+    Templates incluídos ou estendidos são renderizados dentro do template principal,
+    então o tempo medido é o da página inteira
+    """
+
+    def render(self, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            if has_request_context() and 'metricas' in g:
+                g.metricas['template'] += time.perf_counter() - inicio
+
+
+def autorizar_status():
+    """
+    Exige o cabeçalho "Authorization: Bearer <STATUS_TOKEN>" numa rota de monitoramento
+    (/metrics e /status/...), que expõem contadores internos da aplicação. Responde 404
+    enquanto STATUS_TOKEN não for configurado, e 401 caso o token seja inválido
+    """
+    token = current_app.config.get('STATUS_TOKEN')
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+
+
+class Metricas:
+    """
+    Coleta de métricas por rota da aplicação.
+
+    Para cada requisição são registrados a latência total, a quantidade e o tempo das
+    consultas SQL (por eventos do engine do SQLAlchemy) e o tempo de renderização dos
+    templates. Uma requisição que executa o mesmo comando SQL METRICAS_LIMITE_N_MAIS_UM
+    vezes ou mais é contada como um provável padrão N+1 (por exemplo, carregar um
+    relacionamento lazy dentro de um loop), e o comando é registrado no log.
+
+    Configurações lidas da aplicação:
+        METRICAS_ATIVAS: Ativa a coleta e a rota /metrics, que exige o STATUS_TOKEN (ver
+        autorizar_status())
+
+        METRICAS_LIMITE_N_MAIS_UM: Quantidade de repetições de um mesmo comando SQL numa
+        requisição a partir da qual ela é sinalizada como N+1
+    """
+
+    def __init__(self, app=None):
+        self.limite_n_mais_um = 5
+        self._lock = threading.Lock()
+        self._latencia = {}
+        self._consultas = {}
+        self._tempo_sql = {}
+        self._tempo_template = {}
+        self._requisicoes = Counter()
+        self._n_mais_um = Counter()
+        self._coletores = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICAS_ATIVAS', False)
+        app.config.setdefault('METRICAS_LIMITE_N_MAIS_UM', 5)
+        if not app.config['METRICAS_ATIVAS']:
+            return
+        self.limite_n_mais_um = app.config['METRICAS_LIMITE_N_MAIS_UM']
+        self.logger = app.logger
+
+        app.jinja_env.template_class = TemplateMedido
+        app.before_request(self._iniciar)
+        app.after_request(self._finalizar)
+        # Os eventos valem para todos os engines, então são registrados uma única vez
+        # mesmo que várias aplicações sejam criadas no processo
+        if not event.contains(Engine, 'before_cursor_execute', self._antes_sql):
+            event.listen(Engine, 'before_cursor_execute', self._antes_sql)
+            event.listen(Engine, 'after_cursor_execute', self._depois_sql)
+        app.add_url_rule('/metrics', 'metrics', self.exportar)
+
+    def _iniciar(self):
+        g.metricas = {'inicio': time.perf_counter(), 'sql': Counter(), 'tempo_sql': 0, 'template': 0}
+
+    def _antes_sql(self, conexao, cursor, comando, parametros, contexto, executemany):
+        # O início fica no contexto da execução, e não na conexão: quando o comando falha,
+        # after_cursor_execute não é chamado e o início é descartado junto com o contexto
+        if contexto is not None:
+            contexto.inicio_sql = time.perf_counter()
+
+    def _depois_sql(self, conexao, cursor, comando, parametros, contexto, executemany):
+        if has_request_context() and 'metricas' in g:
+            g.metricas['sql'][comando] += 1
+            inicio = getattr(contexto, 'inicio_sql', None)
+            if inicio is not None:
+                g.metricas['tempo_sql'] += time.perf_counter() - inicio
+
+    def _finalizar(self, resposta):
+        dados = g.pop('metricas', None)
+        if dados is None:
+            return resposta
+
+        rota = request.endpoint or 'desconhecida'
+        consultas = sum(dados['sql'].values())
+        repetidos = [comando for comando, vezes in dados['sql'].items() if vezes >= self.limite_n_mais_um]
+
+        with self._lock:
+            if rota not in self._latencia:
+                self._latencia[rota] = Histograma(BUCKETS_SEGUNDOS)
+                self._consultas[rota] = Histograma(BUCKETS_CONSULTAS)
+                self._tempo_sql[rota] = Histograma(BUCKETS_SEGUNDOS)
+                self._tempo_template[rota] = Histograma(BUCKETS_SEGUNDOS)
+            self._requisicoes[(rota, resposta.status_code)] += 1
+            self._latencia[rota].observar(time.perf_counter() - dados['inicio'])
+            self._consultas[rota].observar(consultas)
+            self._tempo_sql[rota].observar(dados['tempo_sql'])
+            self._tempo_template[rota].observar(dados['template'])
+            if repetidos:
+                self._n_mais_um[rota] += 1
+
+        for comando in repetidos:
+            self.logger.warning('Possível N+1 em %s: comando executado %d vezes: %s',
+                rota, dados['sql'][comando], comando)
+        return resposta
+
+    def coletor(self, funcao):
+        """
+        Registra uma função que retorna linhas adicionais (no formato do Prometheus) para a
+        rota /metrics, usada por outras partes da aplicação que possuem as suas métricas
+        """
+        self._coletores.append(funcao)
+        return funcao
+
+    def exportar(self):
+        """
+        Rota /metrics, com as métricas no formato de texto do Prometheus
+        """
+        autorizar_status()
+        linhas = []
+        with self._lock:
+            linhas.append('# TYPE flask_requisicoes_total counter')
+            for (rota, status), total in sorted(self._requisicoes.items()):
+                linhas.append(f'flask_requisicoes_total{{rota="{rota}",status="{status}"}} {total}')
+            for nome, historicos in (
+                    ('flask_requisicao_segundos', self._latencia),
+                    ('flask_sql_consultas', self._consultas),
+                    ('flask_sql_segundos', self._tempo_sql),
+                    ('flask_template_segundos', self._tempo_template)):
+                linhas.append(f'# TYPE {nome} histogram')
+                for rota, histograma in sorted(historicos.items()):
+                    linhas.extend(histograma.exportar(nome, f'rota="{rota}"'))
+            linhas.append('# TYPE flask_n_mais_um_total counter')
+            for rota, total in sorted(self._n_mais_um.items()):
+                linhas.append(f'flask_n_mais_um_total{{rota="{rota}"}} {total}')
+        for coletor in self._coletores:
+            linhas.extend(coletor())
+        return Response('\n'.join(linhas) + '\n', mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,358 @@
+import logging
+import sqlite3
+import time
+from sqlalchemy import case, func, inspect, select, text, Table, Column, Integer, String, Float, MetaData
+from sqlalchemy.schema import CreateTable
+from FlaskEmprestimo.extensoes import db
+from FlaskEmprestimo.models import Emprestimo, Parcela, TarefaAnalise, EventoEmprestimo, SaldoUsuario
+from FlaskEmprestimo.consultas import saldo_devedor_emprestimo
+from FlaskEmprestimo.eventos import evento, eventos_iniciais, reconstruir_saldos
+
+# Migrações do esquema do banco de dados, aplicadas com "flask migrar".
+#
+# Cada migração possui um número de versão e as versões aplicadas ficam na tabela
+# versao_esquema. Um banco de dados vazio é criado diretamente com o esquema atual, e
+# um banco criado antes das migrações existirem (sem a tabela versao_esquema) recebe
+# todas elas: por isso cada migração verifica o que já existe antes de alterar o esquema.
+#
+# As migrações foram escritas para rodar com a aplicação antiga no ar: colunas novas são
+# adicionadas sem valor padrão (o que não reescreve a tabela), os índices são criados
+# com CONCURRENTLY no PostgreSQL e os dados são convertidos em lotes, cada um numa
+# transação curta, então nenhuma tabela fica bloqueada durante toda a conversão.
+
+logger = logging.getLogger(__name__)
+
+MIGRACOES = []
+
+_metadata = MetaData()
+versao_esquema = Table('versao_esquema', _metadata,
+    Column('versao', Integer, primary_key=True),
+    Column('descricao', String(200), nullable=False),
+    Column('aplicada_em', Float, nullable=False))
+
+# Colunas em reais (float) convertidas para as colunas em centavos, por tabela
+CONVERSOES_CENTAVOS = {
+    'usuario': {'salario': 'salario_centavos'},
+    'emprestimo': {'valor': 'valor_centavos', 'valor_parcela': 'valor_parcela_centavos'},
+    'fila_analise': {'valor': 'valor_centavos'},
+}
+
+
+def migracao(versao, descricao):
+    """
+    Registra uma função como a migração de número versao. A função recebe o engine e o
+    dicionário de opções passado para migrar() e é responsável pelas próprias transações
+    """
+    def registrar(funcao):
+        MIGRACOES.append((versao, descricao, funcao))
+        MIGRACOES.sort(key=lambda migracao: migracao[0])
+        return funcao
+    return registrar
+
+
+def _colunas(conexao, tabela):
+    return {coluna['name'] for coluna in inspect(conexao).get_columns(tabela)}
+
+
+@migracao(1, 'Situação dos empréstimos, cronogramas e fila de análise')
+def _situacao_cronogramas_fila(engine, opcoes):
+    with engine.begin() as conexao:
+        if 'situacao' not in _colunas(conexao, 'emprestimo'):
+            conexao.execute(text(
+                "ALTER TABLE emprestimo ADD COLUMN situacao VARCHAR(10) NOT NULL DEFAULT 'aprovado'"))
+        Parcela.__table__.create(conexao, checkfirst=True)
+        TarefaAnalise.__table__.create(conexao, checkfirst=True)
+
+
+@migracao(2, 'Índices das consultas por usuário e da fila de análise')
+def _indices(engine, opcoes):
+    postgres = engine.dialect.name == 'postgresql'
+    # CREATE INDEX CONCURRENTLY não pode rodar dentro de uma transação
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conexao:
+        for indice in (*Emprestimo.__table__.indexes, *TarefaAnalise.__table__.indexes):
+            colunas = ', '.join(coluna.name for coluna in indice.columns)
+            conexao.execute(text(f'CREATE INDEX {"CONCURRENTLY " if postgres else ""}IF NOT EXISTS '
+                f'{indice.name} ON {indice.table.name} ({colunas})'))
+
+
+@migracao(3, 'Valores em centavos')
+def _valores_em_centavos(engine, opcoes):
+    for tabela, colunas in CONVERSOES_CENTAVOS.items():
+        with engine.begin() as conexao:
+            existentes = _colunas(conexao, tabela)
+            for nova in colunas.values():
+                if nova not in existentes:
+                    conexao.execute(text(f'ALTER TABLE {tabela} ADD COLUMN {nova} INTEGER'))
+        antigas = {antiga: nova for antiga, nova in colunas.items() if antiga in existentes}
+        if antigas:
+            converter_para_centavos(engine, tabela, antigas, opcoes.get('tamanho_lote', 1000),
+                opcoes.get('pausa', 0))
+
+
+def converter_para_centavos(engine, tabela, colunas, tamanho_lote=1000, pausa=0):
+    """
+    Preenche as colunas em centavos a partir das colunas em reais e remove as colunas em
+    reais. colunas é um dicionário {coluna em reais: coluna em centavos}.
+
+    As linhas são convertidas em faixas de tamanho_lote ids, cada faixa numa transação
+    curta (com uma pausa de pausa segundos entre elas, para dar vez às outras escritas),
+    e a conversão pode ser interrompida e retomada. As linhas inseridas durante a conversão
+    são convertidas na última transação, junto com a remoção das colunas em reais
+    """
+    atribuicoes = ', '.join(f'{nova} = CAST(ROUND({antiga} * 100) AS INTEGER)' for antiga, nova in colunas.items())
+    pendente = ' OR '.join(f'{nova} IS NULL' for nova in colunas.values())
+    converter = text(f'UPDATE {tabela} SET {atribuicoes} WHERE id > :inicio AND id <= :fim AND ({pendente})')
+
+    with engine.connect() as conexao:
+        ultimo_id = conexao.execute(text(f'SELECT MAX(id) FROM {tabela}')).scalar() or 0
+    inicio = 0
+    convertidas = 0
+    while inicio < ultimo_id:
+        with engine.begin() as conexao:
+            convertidas += conexao.execute(converter, {'inicio': inicio, 'fim': inicio + tamanho_lote}).rowcount
+        inicio += tamanho_lote
+        if pausa:
+            time.sleep(pausa)
+    logger.info('%s: %d linhas convertidas para centavos', tabela, convertidas)
+
+    if engine.dialect.name == 'sqlite' and sqlite3.sqlite_version_info < (3, 35, 0):
+        raise RuntimeError(f'Remover as colunas em reais requer o SQLite 3.35 ou mais novo '
+            f'(versão atual: {sqlite3.sqlite_version})')
+    with engine.begin() as conexao:
+        conexao.execute(text(f'UPDATE {tabela} SET {atribuicoes} WHERE {pendente}'))
+        for antiga in colunas:
+            conexao.execute(text(f'ALTER TABLE {tabela} DROP COLUMN {antiga}'))
+
+
+@migracao(4, 'Registro de eventos dos empréstimos e saldos por usuário')
+def _eventos_saldos(engine, opcoes):
+    with engine.begin() as conexao:
+        EventoEmprestimo.__table__.create(conexao, checkfirst=True)
+        SaldoUsuario.__table__.create(conexao, checkfirst=True)
+    gerar_eventos_iniciais(engine, opcoes.get('tamanho_lote', 1000), opcoes.get('pausa', 0))
+    reconstruir_saldos(engine, opcoes.get('tamanho_lote', 1000))
+
+
+def gerar_eventos_iniciais(engine, tamanho_lote=1000, pausa=0):
+    """
+    Insere os eventos dos empréstimos que ainda não possuem nenhum evento (criados antes do
+    registro de eventos existir), a partir do seu estado atual (ver
+    eventos.eventos_iniciais()). Os empréstimos são lidos em faixas de tamanho_lote ids,
+    cada faixa numa transação curta, e os empréstimos criados durante a geração são
+    tratados numa última transação. A projeção de saldos deve ser reconstruída depois.
+    Retorna a quantidade de empréstimos com eventos gerados
+    """
+    sem_eventos = ~select(EventoEmprestimo.id).where(EventoEmprestimo.id_emprestimo == Emprestimo.id).exists()
+    # Somas de todas as parcelas e das parcelas já pagas do cronograma salvo, ou múltiplos
+    # do valor da parcela para os empréstimos sem cronograma (como em consultas.saldo_devedor_emprestimo())
+    pagas = Emprestimo.parcelas - Emprestimo.parcelas_restantes
+    todas = select(func.sum(Parcela.valor)).where(Parcela.id_emprestimo == Emprestimo.id).scalar_subquery()
+    ja_pagas = select(func.sum(Parcela.valor)) \
+        .where(Parcela.id_emprestimo == Emprestimo.id, Parcela.numero <= pagas).scalar_subquery()
+    colunas = select(Emprestimo.id, Emprestimo.id_usuario, Emprestimo.situacao, Emprestimo.parcelas,
+        Emprestimo.parcelas_restantes, Emprestimo.valor_centavos,
+        func.coalesce(todas, Emprestimo.valor_parcela_centavos * Emprestimo.parcelas),
+        func.coalesce(ja_pagas, Emprestimo.valor_parcela_centavos * pagas)) \
+        .where(sem_eventos)
+
+    def gerar(conexao, consulta):
+        eventos = [evento for linha in conexao.execute(consulta) for evento in eventos_iniciais(*linha)]
+        if eventos:
+            conexao.execute(EventoEmprestimo.__table__.insert(), eventos)
+        return sum(evento['tipo'] == 'originado' for evento in eventos)
+
+    with engine.connect() as conexao:
+        ultimo_id = conexao.execute(text('SELECT MAX(id) FROM emprestimo')).scalar() or 0
+    gerados = 0
+    for inicio in range(0, ultimo_id, tamanho_lote):
+        with engine.begin() as conexao:
+            gerados += gerar(conexao, colunas.where(Emprestimo.id > inicio, Emprestimo.id <= inicio + tamanho_lote))
+        if pausa:
+            time.sleep(pausa)
+    with engine.begin() as conexao:
+        gerados += gerar(conexao, colunas.where(Emprestimo.id > ultimo_id))
+    logger.info('Eventos gerados para %d empréstimos', gerados)
+    return gerados
+
+
+@migracao(5, 'Tarefas da fila de análise para avaliação manual')
+def _avaliacao_manual(engine, opcoes):
+    with engine.begin() as conexao:
+        if 'manual' not in _colunas(conexao, 'fila_analise'):
+            conexao.execute(text('ALTER TABLE fila_analise ADD COLUMN manual BOOLEAN NOT NULL DEFAULT FALSE'))
+        # Antes desta migração, as tarefas que nenhuma regra decidia eram removidas da fila
+        # e os seus empréstimos ficavam em análise sem tarefa: elas voltam para a fila, onde
+        # são decididas pelas regras ou marcadas para avaliação manual. O valor emprestado
+        # é a soma das amortizações do cronograma (ou, sem cronograma, o valor total sem os
+        # 15% de juros)
+        recolocadas = conexao.execute(text(
+            'INSERT INTO fila_analise (id_emprestimo, valor_centavos, criada_em, manual) '
+            'SELECT e.id, COALESCE((SELECT SUM(p.amortizacao) FROM parcela p WHERE p.id_emprestimo = e.id), '
+            'CAST(ROUND(e.valor_centavos / 1.15) AS INTEGER)), :agora, FALSE FROM emprestimo e '
+            "WHERE e.situacao = 'em_analise' "
+            'AND NOT EXISTS (SELECT 1 FROM fila_analise f WHERE f.id_emprestimo = e.id)'),
+            {'agora': time.time()}).rowcount
+    logger.info('%d empréstimos em análise recolocados na fila', recolocadas)
+
+
+@migracao(6, 'Colunas em centavos obrigatórias')
+def _centavos_obrigatorios(engine, opcoes):
+    for tabela, colunas in CONVERSOES_CENTAVOS.items():
+        exigir_valores(engine, tabela, colunas.values())
+
+
+def exigir_valores(engine, tabela, colunas):
+    """
+    Torna NOT NULL as colunas de tabela que ainda aceitam valores vazios (as colunas em
+    centavos são adicionadas sem essa restrição, para que a tabela não seja reescrita), como
+    no esquema criado a partir dos modelos. Lança RuntimeError caso alguma linha ainda possua
+    um valor vazio.
+
+    No PostgreSQL, a restrição é verificada primeiro por uma CHECK NOT VALID validada sem
+    bloquear as escritas, o que permite que o SET NOT NULL não percorra a tabela. O SQLite não
+    altera restrições de colunas, então a tabela é recriada com o esquema do modelo, copiada
+    e renomeada numa única transação
+    """
+    with engine.connect() as conexao:
+        anulaveis = [coluna['name'] for coluna in inspect(conexao).get_columns(tabela)
+            if coluna['name'] in colunas and coluna['nullable']]
+        if not anulaveis:
+            return
+        vazias = conexao.execute(text(f'SELECT COUNT(*) FROM {tabela} WHERE '
+            + ' OR '.join(f'{coluna} IS NULL' for coluna in anulaveis))).scalar()
+    if vazias:
+        raise RuntimeError(f'{tabela}: {vazias} linhas sem valor em {", ".join(anulaveis)}')
+
+    if engine.dialect.name == 'sqlite':
+        recriar_tabela(engine, tabela)
+    elif engine.dialect.name == 'postgresql':
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conexao:
+            for coluna in anulaveis:
+                restricao = f'{tabela}_{coluna}_not_null'
+                conexao.execute(text(f'ALTER TABLE {tabela} ADD CONSTRAINT {restricao} '
+                    f'CHECK ({coluna} IS NOT NULL) NOT VALID'))
+                conexao.execute(text(f'ALTER TABLE {tabela} VALIDATE CONSTRAINT {restricao}'))
+                conexao.execute(text(f'ALTER TABLE {tabela} ALTER COLUMN {coluna} SET NOT NULL'))
+                conexao.execute(text(f'ALTER TABLE {tabela} DROP CONSTRAINT {restricao}'))
+    else:
+        with engine.begin() as conexao:
+            for coluna in anulaveis:
+                conexao.execute(text(f'ALTER TABLE {tabela} ALTER COLUMN {coluna} SET NOT NULL'))
+    logger.info('%s: colunas %s passaram a ser obrigatórias', tabela, ', '.join(anulaveis))
+
+
+def recriar_tabela(engine, tabela):
+    """
+    Recria uma tabela do SQLite com o esquema do seu modelo: cria uma tabela nova, copia as
+    colunas que existem nas duas, remove a tabela antiga, renomeia a nova e recria os
+    índices do modelo, tudo numa única transação. Colunas do modelo que ainda não existem na
+    tabela antiga recebem o seu valor padrão
+    """
+    # A tabela nova é criada a partir de uma cópia dos modelos, para que as chaves
+    # estrangeiras encontrem as tabelas a que se referem sem alterar db.metadata
+    metadata = MetaData()
+    for modelo in db.metadata.sorted_tables:
+        modelo.to_metadata(metadata)
+    nova = metadata.tables[tabela].to_metadata(metadata, name=f'{tabela}_nova')
+
+    with engine.begin() as conexao:
+        existentes = _colunas(conexao, tabela)
+        colunas = ', '.join(coluna.name for coluna in nova.columns if coluna.name in existentes)
+        conexao.execute(CreateTable(nova))
+        conexao.execute(text(f'INSERT INTO {tabela}_nova ({colunas}) SELECT {colunas} FROM {tabela}'))
+        conexao.execute(text(f'DROP TABLE {tabela}'))
+        conexao.execute(text(f'ALTER TABLE {tabela}_nova RENAME TO {tabela}'))
+        for indice in db.metadata.tables[tabela].indexes:
+            indice.create(conexao)
+
+
+@migracao(7, 'Saldos devedores a partir dos cronogramas')
+def _saldos_dos_cronogramas(engine, opcoes):
+    tamanho_lote = opcoes.get('tamanho_lote', 1000)
+    ajustar_saldos(engine, tamanho_lote)
+    reconstruir_saldos(engine, tamanho_lote)
+
+
+def ajustar_saldos(engine, tamanho_lote=1000):
+    """
+    Registra um evento 'ajuste' para cada empréstimo cujo saldo devedor somado pelos seus
+    eventos difere do saldo devedor atual (ver consultas.saldo_devedor_emprestimo()). Os eventos
+    registrados antes dos saldos serem lidos dos cronogramas usavam o valor da primeira
+    parcela, sem o arredondamento absorvido pela última. Os empréstimos são lidos em faixas
+    de tamanho_lote ids, cada faixa numa transação curta. A projeção de saldos deve ser
+    reconstruída depois. Retorna a quantidade de empréstimos ajustados
+    """
+    registrado = select(func.sum(EventoEmprestimo.saldo_centavos)) \
+        .where(EventoEmprestimo.id_emprestimo == Emprestimo.id).scalar_subquery()
+    diferenca = case([(Emprestimo.ativo == True, saldo_devedor_emprestimo())], else_=0) - func.coalesce(registrado, 0)
+    consulta = select(Emprestimo.id, Emprestimo.id_usuario, diferenca).where(diferenca != 0)
+
+    with engine.connect() as conexao:
+        ultimo_id = conexao.execute(text('SELECT MAX(id) FROM emprestimo')).scalar() or 0
+    ajustados = 0
+    for inicio in range(0, ultimo_id, tamanho_lote):
+        with engine.begin() as conexao:
+            eventos = [evento(id_emprestimo, id_usuario, 'ajuste', saldo_centavos=ajuste)
+                for id_emprestimo, id_usuario, ajuste in
+                conexao.execute(consulta.where(Emprestimo.id > inicio, Emprestimo.id <= inicio + tamanho_lote))]
+            if eventos:
+                conexao.execute(EventoEmprestimo.__table__.insert(), eventos)
+            ajustados += len(eventos)
+    logger.info('Saldos de %d empréstimos ajustados', ajustados)
+    return ajustados
+
+
+def versao_atual(engine):
+    """
+    Retorna a maior versão aplicada, 0 para um banco criado antes das migrações existirem
+    e None para um banco vazio
+    """
+    tabelas = set(inspect(engine).get_table_names())
+    if 'versao_esquema' not in tabelas:
+        return 0 if 'usuario' in tabelas else None
+    with engine.connect() as conexao:
+        return conexao.execute(text('SELECT MAX(versao) FROM versao_esquema')).scalar() or 0
+
+
+def pendentes(engine=None):
+    """
+    Retorna a lista (versao, descricao) das migrações ainda não aplicadas
+    """
+    versao = versao_atual(engine or db.engine)
+    if versao is None:
+        return [(numero, descricao) for numero, descricao, _ in MIGRACOES]
+    return [(numero, descricao) for numero, descricao, _ in MIGRACOES if numero > versao]
+
+
+def _registrar(conexao, versao, descricao):
+    conexao.execute(versao_esquema.insert(), {'versao': versao, 'descricao': descricao, 'aplicada_em': time.time()})
+
+
+def migrar(engine=None, tamanho_lote=1000, pausa=0):
+    """
+    Aplica as migrações pendentes, em ordem. Um banco vazio é criado com o esquema atual e
+    todas as migrações são registradas como aplicadas.
+    Retorna a lista (versao, descricao) das migrações aplicadas
+    """
+    engine = engine or db.engine
+    versao = versao_atual(engine)
+    _metadata.create_all(engine)
+
+    if versao is None:
+        db.metadata.create_all(engine)
+        with engine.begin() as conexao:
+            for numero, descricao, _ in MIGRACOES:
+                _registrar(conexao, numero, descricao)
+        return [(numero, descricao) for numero, descricao, _ in MIGRACOES]
+
+    opcoes = {'tamanho_lote': tamanho_lote, 'pausa': pausa}
+    aplicadas = []
+    for numero, descricao, funcao in MIGRACOES:
+        if numero <= versao:
+            continue
+        logger.info('Aplicando a migração %d: %s', numero, descricao)
+        funcao(engine, opcoes)
+        with engine.begin() as conexao:
+            _registrar(conexao, numero, descricao)
+        aplicadas.append((numero, descricao))
+    return aplicadas
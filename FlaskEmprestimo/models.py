@@ -1,15 +1,43 @@
 from enum import unique
 from logging import NullHandler
-from FlaskEmprestimo import db, login_manager
+from sqlalchemy import Float, cast
+from sqlalchemy.ext.hybrid import hybrid_property
+from FlaskEmprestimo.extensoes import db, login_manager, cache_usuarios
+from FlaskEmprestimo.amortizacao import centavos
 from flask_login import UserMixin
 
 # Criação das classes que darão origem às tabelas do banco de dados local
 
 # Método __repr__() define o que uma instância dessa classe deve retornar
 # caso seja transformada em uma string
+
+# Os valores em dinheiro são guardados em centavos, em colunas inteiras (com o sufixo
+# _centavos), para que somas e comparações sejam exatas. Cada coluna possui um atributo
+# em reais com o nome sem o sufixo, que pode ser lido, atribuído e usado em consultas
+# como se fosse a própria coluna (UPDATEs devem usar a coluna em centavos)
+
+def valor_em_reais(coluna):
+    """
+    Cria o atributo em reais (float) correspondente à coluna em centavos de nome coluna
+    """
+    def ler(self):
+        valor = getattr(self, coluna)
+        return None if valor is None else valor / 100
+
+    def escrever(self, valor):
+        setattr(self, coluna, None if valor is None else centavos(valor))
+
+    def expressao(cls):
+        return cast(getattr(cls, coluna), Float) / 100
+
+    return hybrid_property(ler, escrever, expr=expressao)
+
+
+# O usuário logado é lido do cache de identidades, o banco de dados só é consultado
+# quando o usuário não está no cache ou sua entrada expirou
 @login_manager.user_loader
 def load_user(user_id):
-    return Usuario.query.get(int(user_id))
+    return cache_usuarios.obter(int(user_id), Usuario.query.get)
 
 
 class Usuario(db.Model, UserMixin):
@@ -35,7 +63,8 @@ class Usuario(db.Model, UserMixin):
         senha: Hash da senha informada pelo usuário
 
         salario: Salário informado pelo usuário enquanto se preenche
-        o formulário de requisição para um empréstimo
+        o formulário de requisição para um empréstimo (em reais, guardado em
+        salario_centavos)
 
         emprestimos: Lista de empréstimos já realizados pelo usuário, ativos ou não
 
@@ -45,7 +74,8 @@ class Usuario(db.Model, UserMixin):
     cpf = db.Column(db.String(11), nullable = False, unique=True)
     email = db.Column(db.String(50), nullable=False, unique=True)
     senha = db.Column(db.String(60), nullable=False)
-    salario = db.Column(db.Float, nullable=False)
+    salario_centavos = db.Column(db.Integer, nullable=False)
+    salario = valor_em_reais('salario_centavos')
     emprestimos = db.relationship('Emprestimo', backref='beneficiado', lazy=True)
 
     def __repr__(self):
@@ -64,29 +94,209 @@ class Emprestimo(db.Model):
         id: Valor atribuído automáticamente para uma instancia da classe
         quando ela for inserida no banco de dados
 
-        valor: Valor total do empréstimo
+        valor: Valor total do empréstimo (em reais, guardado em valor_centavos)
 
         parcelas: Número total de parcelas do empréstimo
 
-        valor_parcela: Valor de cada parcela do emprestimo (valor / parcelas)
+        valor_parcela: Valor de cada parcela do emprestimo (em reais, guardado em
+        valor_parcela_centavos)
         
         parcelas_restantes: Número de parcelas ainda não pagas do empréstimo. **Atualizado quando
         o usuário escolhe pagar uma parcela no detalhamento do empréstimo.
 
         ativo: Valor booleano, indica se um empréstimo está ativo (parcelas_restantes > 0) ou se já 
-        foi pago (parcelas_restantes == 0)
+        foi pago (parcelas_restantes == 0). Empréstimos em análise ou recusados não são ativos
+
+        situacao: 'aprovado', 'em_analise' (parcela acima do recomendado para o salário,
+        aguardando a fila de análise ou uma avaliação manual) ou 'recusado'
 
         id_usuario = Chave estrangeira, identifica a qual usuário o empréstimo está vinculado
+
+    Índices:
+        ix_emprestimo_usuario_ativo: (id_usuario, ativo), usado pelas consultas agregadas
+        do perfil e do detalhamento de empréstimos
+
+        ix_emprestimo_usuario_parcelas: (id_usuario, parcelas_restantes, id), usado pela
+        paginação e exportação do histórico de empréstimos
     """
+    __table_args__ = (
+        db.Index('ix_emprestimo_usuario_ativo', 'id_usuario', 'ativo'),
+        db.Index('ix_emprestimo_usuario_parcelas', 'id_usuario', 'parcelas_restantes', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    valor = db.Column(db.Float, nullable=False)
+    valor_centavos = db.Column(db.Integer, nullable=False)
+    valor = valor_em_reais('valor_centavos')
     parcelas = db.Column(db.Integer, nullable=False)
-    valor_parcela = db.Column(db.Float, nullable=False)
+    valor_parcela_centavos = db.Column(db.Integer, nullable=False)
+    valor_parcela = valor_em_reais('valor_parcela_centavos')
     parcelas_restantes = db.Column(db.Integer, nullable=False)
     ativo = db.Column(db.Boolean)
+    situacao = db.Column(db.String(10), nullable=False, default='aprovado', server_default='aprovado')
     id_usuario = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
 
     def __repr__(self):
         return f"""Valor total: R$ {self.valor}
 Parcelas restantes: {self.parcelas_restantes}
-Valor à ser pago: {self.valor_parcela * self.parcelas_restantes:.2f}"""
\ No newline at end of file
+Valor à ser pago: {self.valor_parcela * self.parcelas_restantes:.2f}"""
+
+
+class Parcela(db.Model):
+    """
+    Classe utilizada para representar uma parcela do cronograma de pagamento de um empréstimo,
+    cada atributo da classe representando uma coluna na tabela parcela.
+    O cronograma é calculado uma única vez, quando o empréstimo é criado (ver
+    FlaskEmprestimo.amortizacao), e lido no detalhamento dos empréstimos.
+    Uma parcela está paga quando numero <= parcelas - parcelas_restantes do empréstimo.
+    Os valores são guardados em centavos.
+
+    Atributos:
+        id_emprestimo: Chave estrangeira, identifica a qual empréstimo a parcela pertence
+
+        numero: Número da parcela, de 1 até o número de parcelas do empréstimo
+
+        valor: Valor da parcela (juros + amortizacao)
+
+        juros: Parte da parcela referente aos juros
+
+        amortizacao: Parte da parcela que abate o valor emprestado
+
+        saldo: Valor emprestado ainda não amortizado após o pagamento desta parcela
+    """
+    id_emprestimo = db.Column(db.Integer, db.ForeignKey('emprestimo.id'), primary_key=True)
+    numero = db.Column(db.SmallInteger, primary_key=True)
+    valor = db.Column(db.Integer, nullable=False)
+    juros = db.Column(db.Integer, nullable=False)
+    amortizacao = db.Column(db.Integer, nullable=False)
+    saldo = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f"Parcela {self.numero}: R$ {self.valor / 100:.2f}"
+
+
+class TarefaAnalise(db.Model):
+    """
+    Classe utilizada para representar um empréstimo na fila de análise (tabela fila_analise),
+    processada pelos trabalhadores de FlaskEmprestimo.fila_analise.
+    Uma tarefa é reservada por um trabalhador por um tempo limitado: caso o trabalhador
+    pare antes de terminar, a reserva expira e a tarefa volta a ser processada.
+
+    Atributos:
+        id_emprestimo: Chave estrangeira, identifica o empréstimo em análise
+
+        valor: Valor emprestado (sem juros), usado pelas regras de decisão (em reais,
+        guardado em valor_centavos)
+
+        criada_em: Momento (timestamp Unix) em que o empréstimo entrou na fila
+
+        reservada_ate: Momento até o qual a tarefa está reservada por um trabalhador,
+        ou None caso esteja livre
+
+        dono: Identificador da reserva do trabalhador que está processando a tarefa
+
+        manual: Indica que nenhuma regra da política decidiu o empréstimo. A tarefa deixa de
+        ser reservada pelos trabalhadores e aguarda uma avaliação manual (comando
+        "flask avaliar-analise")
+
+    Índices:
+        ix_fila_analise_dono: usado para ler e remover as tarefas de um lote reservado
+    """
+    __tablename__ = 'fila_analise'
+    __table_args__ = (
+        db.Index('ix_fila_analise_dono', 'dono'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    id_emprestimo = db.Column(db.Integer, db.ForeignKey('emprestimo.id'), nullable=False, unique=True)
+    valor_centavos = db.Column(db.Integer, nullable=False)
+    valor = valor_em_reais('valor_centavos')
+    criada_em = db.Column(db.Float, nullable=False)
+    reservada_ate = db.Column(db.Float)
+    dono = db.Column(db.String(16))
+    manual = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+
+class EventoEmprestimo(db.Model):
+    """
+    Classe utilizada para representar um evento do registro de eventos dos empréstimos
+    (tabela evento_emprestimo). Os eventos são apenas inseridos, nunca alterados, na mesma
+    transação da alteração do empréstimo que registram, e guardam o histórico que a tabela
+    emprestimo não guarda (ver FlaskEmprestimo.eventos).
+
+    Atributos:
+        id_emprestimo: Chave estrangeira, identifica o empréstimo do evento
+
+        id_usuario: Chave estrangeira, identifica o usuário do empréstimo (repetido aqui para
+        que os saldos de um usuário possam ser reconstruídos sem consultar os empréstimos)
+
+        tipo: 'originado', 'aprovado', 'recusado' (decisões da fila de análise),
+        'parcela_paga', 'quitado' (pagamento da última parcela) ou 'ajuste' (correção do
+        saldo devedor, ver migracoes.ajustar_saldos())
+
+        parcelas: Número de parcelas do empréstimo ('originado') ou de parcelas pagas
+        ('parcela_paga'), 0 nos demais eventos
+
+        valor_centavos: Valor total do empréstimo ('originado') ou valor pago ('parcela_paga'),
+        0 nos demais eventos
+
+        saldo_centavos: Variação do saldo devedor do usuário causada pelo evento
+
+        criado_em: Momento (timestamp Unix) do evento, ou None para os eventos gerados a
+        partir de empréstimos criados antes do registro de eventos existir
+
+    Índices:
+        ix_evento_emprestimo_emprestimo: usado para ler o histórico de um empréstimo
+
+        ix_evento_emprestimo_usuario: usado para reconstruir os saldos em faixas de usuários
+    """
+    __tablename__ = 'evento_emprestimo'
+    __table_args__ = (
+        db.Index('ix_evento_emprestimo_emprestimo', 'id_emprestimo', 'id'),
+        db.Index('ix_evento_emprestimo_usuario', 'id_usuario', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    id_emprestimo = db.Column(db.Integer, db.ForeignKey('emprestimo.id'), nullable=False)
+    id_usuario = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
+    tipo = db.Column(db.String(20), nullable=False)
+    parcelas = db.Column(db.Integer, nullable=False, default=0)
+    valor_centavos = db.Column(db.Integer, nullable=False, default=0)
+    saldo_centavos = db.Column(db.Integer, nullable=False, default=0)
+    criado_em = db.Column(db.Float)
+
+    def __repr__(self):
+        return f"Evento {self.tipo} do empréstimo {self.id_emprestimo}"
+
+
+class SaldoUsuario(db.Model):
+    """
+    Classe utilizada para representar os totais dos empréstimos de um usuário (tabela
+    saldo_usuario), uma projeção do registro de eventos atualizada na mesma transação de
+    cada evento. O perfil lê os totais daqui, pela chave primária, em vez de agregar os
+    empréstimos do usuário. Usuários sem empréstimos não possuem linha.
+
+    Atributos:
+        id_usuario: Chave estrangeira e chave primária, identifica o usuário
+
+        qtd_total: Quantidade de empréstimos já feitos pelo usuário, em qualquer situação
+
+        qtd_ativos: Quantidade de empréstimos aprovados e ainda não quitados
+
+        saldo_devedor: Soma das parcelas ainda não pagas dos empréstimos ativos (em reais,
+        guardado em saldo_devedor_centavos)
+
+        valor_total: Soma do valor total (com juros) de todos os empréstimos (em reais,
+        guardado em valor_total_centavos)
+    """
+    __tablename__ = 'saldo_usuario'
+
+    id_usuario = db.Column(db.Integer, db.ForeignKey('usuario.id'), primary_key=True, autoincrement=False)
+    qtd_total = db.Column(db.Integer, nullable=False, default=0)
+    qtd_ativos = db.Column(db.Integer, nullable=False, default=0)
+    saldo_devedor_centavos = db.Column(db.Integer, nullable=False, default=0)
+    saldo_devedor = valor_em_reais('saldo_devedor_centavos')
+    valor_total_centavos = db.Column(db.Integer, nullable=False, default=0)
+    valor_total = valor_em_reais('valor_total_centavos')
+
+    def __repr__(self):
+        return f"Saldo do usuário {self.id_usuario}: R$ {self.saldo_devedor_centavos / 100:.2f}"
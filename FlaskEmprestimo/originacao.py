@@ -0,0 +1,329 @@
+import csv
+import json
+import math
+from functools import lru_cache
+from itertools import islice, product
+from flask import current_app
+from sqlalchemy import func, select
+from FlaskEmprestimo.extensoes import db, cache_paginas, motor_politicas
+from FlaskEmprestimo.models import Usuario, Emprestimo, Parcela
+from FlaskEmprestimo.amortizacao import cronograma, cronogramas_em_lote
+from FlaskEmprestimo.consultas import saldos_devedores
+from FlaskEmprestimo.fila_analise import fila_analise, enfileirar
+from FlaskEmprestimo.eventos import evento, registrar, registrar_originacao
+
+# Criação de empréstimos, usada tanto na confirmação de um empréstimo pelo site quanto na
+# importação em lote de empréstimos enviados por parceiros. Os limites de valor, os prazos
+# permitidos e as regras de análise vêm da política em uso (ver FlaskEmprestimo.politicas)
+
+# Quantidade de cotações (valor, parcelas, sistema) mantidas em memória por cotacao()
+TAMANHO_CACHE_COTACOES = 4096
+
+# Quantidade máxima de cotações calculadas numa chamada de simular_cotacoes()
+LIMITE_COTACOES = 100
+
+# Colunas da tabela emprestimo preenchidas por novo_emprestimo(), inseridas em lote por
+# inserir_emprestimos()
+COLUNAS_INSERCAO = ('valor_centavos', 'parcelas', 'valor_parcela_centavos', 'parcelas_restantes', 'ativo',
+    'situacao', 'id_usuario')
+
+
+class EmprestimoInvalidoError(ValueError):
+    """
+    Lançada quando os valores de um empréstimo não respeitam as regras de criação.
+    A mensagem é a mesma que é mostrada ao usuário
+    """
+
+
+def ofertas(usuario):
+    """
+    Retorna para o usuário as ofertas do catálogo da política em uso, dependendo de sua
+    renda mensal
+    """
+    return motor_politicas.politica.ofertas(usuario.salario)
+
+
+def simular_emprestimo(valor, parcelas, salario):
+    """
+    Calcula os valores de um empréstimo (valor total com juros e valor de cada parcela)
+    a partir do seu cronograma de pagamento, lançando EmprestimoInvalidoError caso o valor
+    ou o salário não sejam números finitos ou alguma regra de recusa da política seja
+    satisfeita (as comparações das regras com NaN são sempre falsas, então NaN passaria
+    por todas elas).
+
+    Retorna um dicionário com valor, parcelas, salario, valor_a_pagar, valor_parcela
+    (o valor da primeira parcela, que no sistema Price é igual ao de todas as outras,
+    exceto por centavos de arredondamento na última), em_analise (se alguma regra de
+    análise da política foi satisfeita) e parcela_recomendada (a maior parcela recomendada
+    para o salário)
+    """
+    valor = round(float(valor), 2)
+    parcelas = int(parcelas)
+    salario = float(salario)
+    if not (math.isfinite(valor) and math.isfinite(salario)):
+        raise EmprestimoInvalidoError('Valor ou salário inválido')
+
+    politica = motor_politicas.politica
+    motivo = politica.recusa(valor, parcelas, salario)
+    if motivo is not None:
+        raise EmprestimoInvalidoError(motivo)
+
+    valor_a_pagar, valor_parcela = cotacao(valor, parcelas, current_app.config['AMORTIZACAO_SISTEMA'])
+    return {
+        'valor': valor,
+        'parcelas': parcelas,
+        'salario': salario,
+        'valor_a_pagar': valor_a_pagar,
+        'valor_parcela': valor_parcela,
+        'em_analise': politica.precisa_analise(valor, parcelas, valor_parcela, salario),
+        'parcela_recomendada': round(salario * politica.comprometimento_maximo, 2),
+    }
+
+
+@lru_cache(maxsize=TAMANHO_CACHE_COTACOES)
+def cotacao(valor, parcelas, sistema):
+    """
+    Retorna (valor_a_pagar, valor_parcela) do cronograma de um empréstimo. Os valores
+    dependem apenas dos parâmetros (as regras da política, que podem ser recarregadas, não
+    entram no cálculo), então as cotações mais recentes ficam em memória e um usuário que
+    repete a simulação com os mesmos valores não recalcula o cronograma
+    """
+    parcelas_cronograma = cronograma(valor, parcelas, sistema)
+    return float(sum(parcela[1] for parcela in parcelas_cronograma)), float(parcelas_cronograma[0][1])
+
+
+def simular_cotacoes(valores, prazos, salario):
+    """
+    Simula todas as combinações de valores e prazos para um salário, sem salvar nada.
+    Retorna uma lista, na ordem de itertools.product(valores, prazos), com o dicionário de
+    simular_emprestimo() de cada combinação ou, caso ela seja recusada pela política,
+    {'valor', 'parcelas', 'erro'} com a mensagem do erro.
+    Lança ValueError caso algum valor não seja um número finito (os valores são repetidos
+    na resposta, e NaN não pode ser representado em JSON) ou existam mais de
+    LIMITE_COTACOES combinações
+    """
+    valores = [float(valor) for valor in valores]
+    prazos = [int(prazo) for prazo in prazos]
+    if not all(math.isfinite(numero) for numero in valores + [salario]):
+        raise ValueError('Valores inválidos')
+    if len(valores) * len(prazos) > LIMITE_COTACOES:
+        raise ValueError(f'No máximo {LIMITE_COTACOES} cotações por simulação')
+    cotacoes = []
+    for valor, parcelas in product(valores, prazos):
+        try:
+            cotacoes.append(simular_emprestimo(valor, parcelas, salario))
+        except EmprestimoInvalidoError as erro:
+            cotacoes.append({'valor': round(valor, 2), 'parcelas': parcelas, 'erro': str(erro)})
+    return cotacoes
+
+
+def ler_csv(arquivo):
+    """
+    Lê um arquivo CSV com cabeçalho (colunas cpf, valor, parcelas e, opcionalmente, salario),
+    retornando um dicionário por linha, sem carregar o arquivo inteiro
+    """
+    return csv.DictReader(arquivo)
+
+
+def ler_ndjson(arquivo):
+    """
+    Lê um arquivo com um objeto JSON por linha, ignorando linhas vazias.
+    Linhas que não são JSON válido são retornadas como None, para que sejam rejeitadas
+    """
+    for linha in arquivo:
+        if isinstance(linha, bytes):
+            linha = linha.decode('utf-8')
+        if not linha.strip():
+            continue
+        try:
+            yield json.loads(linha)
+        except ValueError:
+            yield None
+
+
+def _validar_lote(lote, inicio, relatorio):
+    # Busca os usuários de todas as linhas do lote numa única consulta
+    cpfs = {str(linha.get('cpf', '')) for linha in lote if isinstance(linha, dict)}
+    usuarios = {cpf: (id_usuario, salario) for id_usuario, cpf, salario in
+        db.session.query(Usuario.id, Usuario.cpf, Usuario.salario).filter(Usuario.cpf.in_(cpfs))}
+
+    validos = []
+    for numero, linha in enumerate(lote, start=inicio):
+        if not isinstance(linha, dict):
+            relatorio['rejeitados'].append({'linha': numero, 'motivo': 'Linha em formato inválido'})
+            continue
+
+        usuario = usuarios.get(str(linha.get('cpf', '')))
+        if usuario is None:
+            relatorio['rejeitados'].append({'linha': numero, 'motivo': 'CPF não cadastrado'})
+            continue
+        id_usuario, salario = usuario
+
+        try:
+            dados = simular_emprestimo(linha.get('valor'), linha.get('parcelas'),
+                linha.get('salario') or salario)
+        except EmprestimoInvalidoError as erro:
+            relatorio['rejeitados'].append({'linha': numero, 'motivo': str(erro)})
+            continue
+        except (TypeError, ValueError):
+            relatorio['rejeitados'].append({'linha': numero, 'motivo': 'Valor, parcelas ou salário inválido'})
+            continue
+
+        if dados['em_analise']:
+            relatorio['em_analise'] += 1
+
+        validos.append(novo_emprestimo(dados, id_usuario))
+    return validos
+
+
+def novo_emprestimo(dados, id_usuario):
+    """
+    Cria (sem salvar) o Emprestimo correspondente a um dicionário retornado por
+    simular_emprestimo(). O valor emprestado fica no atributo valor_emprestado do objeto,
+    para que o cronograma possa ser salvo por salvar_cronogramas().
+    Empréstimos que precisam de análise são criados inativos, com a situação 'em_analise',
+    e devem ser colocados na fila de análise com fila_analise.enfileirar()
+    """
+    em_analise = dados['em_analise']
+    emprestimo = Emprestimo(valor=dados['valor_a_pagar'], parcelas=dados['parcelas'],
+        valor_parcela=dados['valor_parcela'], parcelas_restantes=dados['parcelas'], ativo=not em_analise,
+        situacao='em_analise' if em_analise else 'aprovado', id_usuario=id_usuario)
+    emprestimo.valor_emprestado = dados['valor']
+    return emprestimo
+
+
+def salvar_cronogramas(emprestimos):
+    """
+    Insere as parcelas dos cronogramas de vários empréstimos com um único INSERT com vários
+    valores (executemany). Os empréstimos devem ter sido criados por novo_emprestimo() e
+    já possuir id (após db.session.flush() ou inserir_emprestimos()). Não faz commit
+    """
+    linhas = cronogramas_em_lote(
+        ((emprestimo.id, emprestimo.valor_emprestado, emprestimo.parcelas) for emprestimo in emprestimos),
+        current_app.config['AMORTIZACAO_SISTEMA'])
+    if linhas:
+        db.session.execute(Parcela.__table__.insert(), linhas)
+
+
+def inserir_emprestimos(emprestimos):
+    """
+    Insere os empréstimos criados por novo_emprestimo() com um único comando pelo Core (sem
+    a unidade de trabalho do ORM) e preenche o id de cada objeto, para que os seus
+    cronogramas, eventos e tarefas possam ser salvos em seguida. Os objetos não são
+    adicionados à sessão. Não faz commit.
+
+    No PostgreSQL, os ids são lidos com RETURNING, na ordem das linhas do INSERT com vários
+    valores. No SQLite, as linhas são inseridas com executemany e os ids formam a faixa que
+    termina no maior id após o INSERT: o SQLite dá a cada linha o maior id mais um, e a
+    transação mantém o banco bloqueado para outras escritas até o commit. Nos demais bancos
+    os ids não são necessariamente consecutivos (inserções simultâneas, ou
+    auto_increment_increment no MySQL), então cada linha é inserida com o seu próprio INSERT
+    """
+    if not emprestimos:
+        return
+    tabela = Emprestimo.__table__
+    linhas = [{coluna: getattr(emprestimo, coluna) for coluna in COLUNAS_INSERCAO} for emprestimo in emprestimos]
+    banco = db.engine.dialect.name
+    if banco == 'postgresql':
+        ids = db.session.execute(tabela.insert().values(linhas).returning(tabela.c.id)).scalars().all()
+    elif banco == 'sqlite':
+        db.session.execute(tabela.insert(), linhas)
+        ultimo_id = db.session.execute(select(func.max(tabela.c.id))).scalar()
+        ids = range(ultimo_id - len(linhas) + 1, ultimo_id + 1)
+    else:
+        ids = [db.session.execute(tabela.insert(), linha).inserted_primary_key[0] for linha in linhas]
+    for emprestimo, id_emprestimo in zip(emprestimos, ids):
+        emprestimo.id = id_emprestimo
+
+
+def originar_emprestimo(dados, id_usuario):
+    """
+    Salva, numa única transação, o empréstimo correspondente a um dicionário retornado por
+    simular_emprestimo(), o seu cronograma, o evento da sua originação e, caso precise de
+    análise, a sua tarefa na fila de análise. Retorna o id do empréstimo criado
+    """
+    emprestimo = novo_emprestimo(dados, id_usuario)
+    db.session.add(emprestimo)
+    db.session.flush()
+    id_emprestimo = emprestimo.id
+    salvar_cronogramas([emprestimo])
+    registrar_originacao([emprestimo])
+    enfileirar([emprestimo])
+    db.session.commit()
+    cache_paginas.nova_versao(id_usuario)
+    if dados['em_analise']:
+        # A decisão é tomada em segundo plano pelos trabalhadores da fila de análise
+        fila_analise.notificar()
+    return id_emprestimo
+
+
+def importar_emprestimos(linhas, tamanho_lote=1000):
+    """
+    Cria empréstimos a partir de um iterável de dicionários (com cpf, valor, parcelas e,
+    opcionalmente, salario), aplicando as mesmas regras da confirmação de empréstimos.
+
+    As linhas são processadas em lotes de tamanho_lote, cada um numa transação própria:
+    uma consulta busca os usuários do lote, os empréstimos são inseridos com um único
+    comando que recupera os ids gerados (ver inserir_emprestimos()) e as parcelas de todos
+    os cronogramas do lote são inseridas com um único INSERT com vários valores
+    (executemany), assim como os eventos de originação. Assim, apenas um lote fica na
+    memória por vez.
+
+    Retorna um relatório com a quantidade de empréstimos inseridos, quantos deles foram
+    colocados na fila de análise e a lista de linhas rejeitadas com o motivo de cada rejeição
+    """
+    relatorio = {'inseridos': 0, 'em_analise': 0, 'rejeitados': []}
+    linhas = iter(linhas)
+    inicio = 1
+    while True:
+        lote = list(islice(linhas, tamanho_lote))
+        if not lote:
+            break
+        validos = _validar_lote(lote, inicio, relatorio)
+        if validos:
+            inserir_emprestimos(validos)
+            salvar_cronogramas(validos)
+            registrar_originacao(validos)
+            enfileirar(validos)
+            db.session.commit()
+            fila_analise.notificar()
+            relatorio['inseridos'] += len(validos)
+            for id_usuario in {emprestimo.id_usuario for emprestimo in validos}:
+                cache_paginas.nova_versao(id_usuario)
+        inicio += len(lote)
+    return relatorio
+
+
+def gerar_cronogramas_pendentes(tamanho_lote=1000):
+    """
+    Gera os cronogramas dos empréstimos que ainda não possuem parcelas (empréstimos criados
+    antes da tabela parcela existir), em lotes de tamanho_lote, cada um numa transação.
+    Esses empréstimos eram cobrados com 15% de juros sobre o valor emprestado, então o
+    valor emprestado é recuperado a partir do valor total.
+    O saldo devedor dos empréstimos ativos passa a ser a soma das parcelas restantes do
+    cronograma gerado, então a diferença para o saldo anterior (valor da parcela vezes as
+    parcelas restantes) é registrada na mesma transação como um evento 'ajuste'.
+    Retorna a quantidade de cronogramas gerados
+    """
+    sem_cronograma = ~db.session.query(Parcela.id_emprestimo) \
+        .filter(Parcela.id_emprestimo == Emprestimo.id).exists()
+    total = 0
+    while True:
+        lote = db.session.query(Emprestimo.id, Emprestimo.id_usuario, Emprestimo.valor, Emprestimo.parcelas,
+                Emprestimo.ativo) \
+            .filter(sem_cronograma).order_by(Emprestimo.id).limit(tamanho_lote).all()
+        if not lote:
+            return total
+        ativos = {id_emprestimo: id_usuario for id_emprestimo, id_usuario, _, _, ativo in lote if ativo}
+        anteriores = saldos_devedores(list(ativos))
+        linhas = cronogramas_em_lote(
+            ((id_emprestimo, round(valor / 1.15, 2), parcelas) for id_emprestimo, _, valor, parcelas, _ in lote),
+            current_app.config['AMORTIZACAO_SISTEMA'])
+        db.session.execute(Parcela.__table__.insert(), linhas)
+        ajustes = [evento(id_emprestimo, ativos[id_emprestimo], 'ajuste', saldo_centavos=saldo - anteriores[id_emprestimo])
+            for id_emprestimo, saldo in saldos_devedores(list(ativos)).items() if saldo != anteriores[id_emprestimo]]
+        registrar(ajustes)
+        db.session.commit()
+        for id_usuario in {ajuste['id_usuario'] for ajuste in ajustes}:
+            cache_paginas.nova_versao(id_usuario)
+        total += len(lote)
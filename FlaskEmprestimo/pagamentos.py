@@ -0,0 +1,104 @@
+from sqlalchemy import case
+from FlaskEmprestimo.extensoes import db, cache_paginas
+from FlaskEmprestimo.models import Emprestimo
+from FlaskEmprestimo.eventos import registrar_pagamentos
+
+# Pagamento de parcelas com UPDATEs condicionais: a verificação das parcelas restantes e o
+# decremento acontecem num único comando, então dois pagamentos simultâneos nunca perdem
+# uma atualização nem deixam parcelas_restantes negativo.
+# Os pagamentos são registrados no registro de eventos (ver FlaskEmprestimo.eventos) na
+# mesma transação do UPDATE.
+
+
+class PagamentoInvalidoError(Exception):
+    """
+    Lançada quando um pagamento em lote não pode ser feito por completo, por exemplo
+    porque um dos empréstimos não pertence ao usuário ou não possui parcelas suficientes.
+    Nenhum pagamento do lote é salvo
+    """
+
+
+def _pagar(id_emprestimo, id_usuario, quantidade):
+    # O lado direito de cada atribuição usa o valor de parcelas_restantes de antes do UPDATE
+    return Emprestimo.query.filter(
+        Emprestimo.id == id_emprestimo,
+        Emprestimo.id_usuario == id_usuario,
+        Emprestimo.ativo == True,
+        Emprestimo.parcelas_restantes >= quantidade,
+    ).update({
+        Emprestimo.parcelas_restantes: Emprestimo.parcelas_restantes - quantidade,
+        Emprestimo.ativo: case([(Emprestimo.parcelas_restantes > quantidade, True)], else_=False),
+    }, synchronize_session=False)
+
+
+def _pagos(ids_emprestimos, quantidade):
+    # Lidos após o UPDATE, na mesma transação: as linhas alteradas continuam bloqueadas até
+    # o commit, então parcelas_restantes é o valor deixado por este pagamento
+    return [(id_emprestimo, quantidade, *colunas) for id_emprestimo, *colunas in
+        db.session.query(Emprestimo.id, Emprestimo.parcelas, Emprestimo.valor_parcela_centavos,
+                Emprestimo.parcelas_restantes)
+            .filter(Emprestimo.id.in_(ids_emprestimos))]
+
+
+def pagar_parcelas(id_emprestimo, id_usuario, quantidade=1):
+    """
+    Paga uma ou mais parcelas de um empréstimo do usuário, marcando o empréstimo como
+    inativo quando a última parcela for paga.
+    Retorna True caso o pagamento tenha sido feito, ou False caso o empréstimo não exista,
+    não pertença ao usuário, não esteja ativo (por exemplo, ainda em análise) ou não possua
+    parcelas restantes suficientes
+    """
+    pago = _pagar(id_emprestimo, id_usuario, quantidade) == 1
+    if pago:
+        registrar_pagamentos(id_usuario, _pagos([id_emprestimo], quantidade))
+    db.session.commit()
+    if pago:
+        cache_paginas.nova_versao(id_usuario)
+    return pago
+
+
+def pagar_em_lote(id_usuario, ids_emprestimos, quantidade=None):
+    """
+    Paga parcelas de vários empréstimos do usuário numa única transação.
+
+    Parâmetros:
+        ids_emprestimos: Ids dos empréstimos que devem ser pagos
+
+        quantidade: Número de parcelas pagas de cada empréstimo, ou None para quitar todas
+        as parcelas restantes
+
+    Caso algum dos pagamentos não possa ser feito, a transação é desfeita e
+    PagamentoInvalidoError é lançada. Retorna a quantidade de empréstimos pagos
+    """
+    ids_emprestimos = set(ids_emprestimos)
+    try:
+        if quantidade is None:
+            # As parcelas restantes de cada empréstimo são lidas (e bloqueadas no
+            # PostgreSQL) antes do UPDATE, para que os eventos registrem quantas foram pagas.
+            # No SQLite a leitura não bloqueia nada, então cada empréstimo é quitado com o
+            # UPDATE condicional de _pagar() para a quantidade lida: caso outro pagamento
+            # tenha sido salvo entre a leitura e o UPDATE, o empréstimo não é pago e o lote
+            # inteiro é desfeito
+            pagamentos = [(id_emprestimo, restantes, parcelas, valor_parcela, 0)
+                for id_emprestimo, restantes, parcelas, valor_parcela in
+                db.session.query(Emprestimo.id, Emprestimo.parcelas_restantes, Emprestimo.parcelas,
+                        Emprestimo.valor_parcela_centavos)
+                    .filter(Emprestimo.id.in_(ids_emprestimos), Emprestimo.id_usuario == id_usuario,
+                        Emprestimo.ativo == True, Emprestimo.parcelas_restantes > 0)
+                    .order_by(Emprestimo.id).with_for_update()]
+            pagos = sum(_pagar(id_emprestimo, id_usuario, restantes) for id_emprestimo, restantes, *_ in pagamentos)
+        else:
+            pagos = sum(_pagar(id_emprestimo, id_usuario, quantidade) for id_emprestimo in ids_emprestimos)
+            pagamentos = _pagos(ids_emprestimos, quantidade)
+
+        if pagos != len(ids_emprestimos):
+            raise PagamentoInvalidoError(
+                f'Apenas {pagos} de {len(ids_emprestimos)} empréstimos puderam ser pagos')
+        registrar_pagamentos(id_usuario, pagamentos)
+    except Exception:
+        db.session.rollback()
+        raise
+
+    db.session.commit()
+    cache_paginas.nova_versao(id_usuario)
+    return pagos
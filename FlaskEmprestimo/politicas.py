@@ -0,0 +1,228 @@
+import ast
+import json
+import logging
+import os
+import threading
+import time
+from FlaskEmprestimo.catalogo import TabelaOfertas
+
+# Motor das regras de crédito. As regras ficam num arquivo JSON (por padrão,
+# FlaskEmprestimo/politicas.json) com quatro seções:
+#
+#   constantes: valores que podem ser usados nas condições e nas mensagens, como os
+#   limites de valor e os prazos permitidos. comprometimento_maximo (fração do salário que
+#   a parcela pode ocupar) é obrigatória, pois também define a elegibilidade das ofertas
+#
+#   recusar: regras que impedem o empréstimo, avaliadas em ordem. A mensagem da primeira
+#   regra satisfeita é mostrada ao usuário. As condições podem usar valor, parcelas e salario
+#
+#   analisar: regras que enviam o empréstimo para a análise da equipe. As condições também
+#   podem usar valor_parcela
+#
+#   decidir_analise: regras aplicadas pela fila de análise (ver FlaskEmprestimo.fila_analise),
+#   com as listas "recusar" e "aprovar", verificadas nessa ordem. Empréstimos que não
+#   satisfazem nenhuma delas continuam em análise, para uma avaliação manual
+#
+#   ofertas: catálogo de ofertas da página inicial (ver FlaskEmprestimo.catalogo)
+#
+# As condições são expressões Python simples (comparações, and/or/not, aritmética e
+# "in"), verificadas e então compiladas numa única função por seção, então avaliar um
+# pedido custa poucos microssegundos.
+
+logger = logging.getLogger(__name__)
+
+ARQUIVO_PADRAO = os.path.join(os.path.dirname(__file__), 'politicas.json')
+
+VARIAVEIS_RECUSA = ('valor', 'parcelas', 'salario')
+VARIAVEIS_ANALISE = ('valor', 'parcelas', 'valor_parcela', 'salario')
+
+_NOS_PERMITIDOS = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.BinOp, ast.Add,
+    ast.Sub, ast.Mult, ast.Div, ast.Compare, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq, ast.In,
+    ast.NotIn, ast.Name, ast.Load, ast.Constant, ast.Tuple, ast.List,
+)
+
+
+class PoliticaInvalidaError(ValueError):
+    """
+    Lançada quando o arquivo de políticas não pode ser lido ou possui uma regra inválida
+    """
+
+
+def _validar_condicao(regra, nomes):
+    try:
+        arvore = ast.parse(regra['condicao'], mode='eval')
+    except (KeyError, TypeError, SyntaxError) as erro:
+        raise PoliticaInvalidaError(f'Condição inválida na regra {regra.get("nome")}: {erro}')
+    for no in ast.walk(arvore):
+        if not isinstance(no, _NOS_PERMITIDOS):
+            raise PoliticaInvalidaError(
+                f'Expressão não permitida na regra {regra.get("nome")}: {type(no).__name__}')
+        if isinstance(no, ast.Name) and no.id not in nomes:
+            raise PoliticaInvalidaError(f'Nome desconhecido na regra {regra.get("nome")}: {no.id}')
+    return ast.unparse(arvore)
+
+
+def _compilar(nome, variaveis, corpo, constantes):
+    fonte = f'def {nome}({", ".join(variaveis)}):\n' + ''.join(f'    {linha}\n' for linha in corpo)
+    escopo = dict(constantes, __builtins__={})
+    exec(compile(fonte, f'<politica:{nome}>', 'exec'), escopo)
+    return escopo[nome]
+
+
+class Politica:
+    """
+    Versão compilada de um arquivo de políticas.
+
+    Atributos:
+        constantes: Constantes do arquivo (listas convertidas em frozenset)
+
+        mensagens: Mensagem de cada regra de recusa, já formatada com as constantes
+
+        tabela_ofertas: TabelaOfertas compilada a partir das ofertas do arquivo
+
+    Métodos:
+        recusa(valor, parcelas, salario): Retorna a mensagem da primeira regra de recusa
+        satisfeita, ou None caso o empréstimo seja permitido
+
+        precisa_analise(valor, parcelas, valor_parcela, salario): Retorna True caso alguma
+        regra de análise seja satisfeita
+
+        decisao_analise(valor, parcelas, valor_parcela, salario): Retorna 'recusado' ou
+        'aprovado' de acordo com as regras de decidir_analise, ou None caso o empréstimo
+        precise de uma avaliação manual
+    """
+
+    def __init__(self, dados):
+        try:
+            constantes = {nome: frozenset(valor) if isinstance(valor, list) else valor
+                for nome, valor in dados.get('constantes', {}).items()}
+            self.comprometimento_maximo = float(constantes['comprometimento_maximo'])
+            recusar = list(dados.get('recusar', ()))
+            analisar = list(dados.get('analisar', ()))
+            decidir = dados.get('decidir_analise', {})
+            decidir = {decisao: list(decidir.get(chave, ())) for decisao, chave in
+                (('recusado', 'recusar'), ('aprovado', 'aprovar'))}
+            ofertas = [(o['limite'], o['titulo'], o['valor'], o['parcelas']) for o in dados.get('ofertas', ())]
+        except (AttributeError, KeyError, TypeError, ValueError) as erro:
+            raise PoliticaInvalidaError(f'Arquivo de políticas inválido: {erro!r}')
+        self.constantes = constantes
+
+        condicoes = [_validar_condicao(regra, set(VARIAVEIS_RECUSA) | set(constantes)) for regra in recusar]
+        try:
+            self.mensagens = tuple(regra.get('mensagem', regra.get('nome', '')).format(**constantes)
+                for regra in recusar)
+        except (KeyError, ValueError) as erro:
+            raise PoliticaInvalidaError(f'Mensagem inválida: {erro!r}')
+        corpo = [f'if {condicao}: return {i}' for i, condicao in enumerate(condicoes)] + ['return None']
+        self._recusa = _compilar('recusa', VARIAVEIS_RECUSA, corpo, constantes)
+
+        condicoes = [_validar_condicao(regra, set(VARIAVEIS_ANALISE) | set(constantes)) for regra in analisar]
+        corpo = [f'return {" or ".join(f"({c})" for c in condicoes) or "False"}']
+        self.precisa_analise = _compilar('precisa_analise', VARIAVEIS_ANALISE, corpo, constantes)
+
+        corpo = []
+        for decisao, regras in decidir.items():
+            condicoes = [_validar_condicao(regra, set(VARIAVEIS_ANALISE) | set(constantes)) for regra in regras]
+            if condicoes:
+                corpo.append(f'if {" or ".join(f"({c})" for c in condicoes)}: return {decisao!r}')
+        self.decisao_analise = _compilar('decisao_analise', VARIAVEIS_ANALISE, corpo + ['return None'], constantes)
+
+        self.tabela_ofertas = TabelaOfertas(ofertas, self.comprometimento_maximo)
+
+    def recusa(self, valor, parcelas, salario):
+        indice = self._recusa(valor, parcelas, salario)
+        return None if indice is None else self.mensagens[indice]
+
+    def recusas_em_lote(self, valores, parcelas, salarios):
+        """
+        Avalia vários pedidos de uma só vez, retornando uma lista com o índice da regra de
+        recusa satisfeita por cada pedido (ou None), na mesma ordem
+        """
+        return list(map(self._recusa, valores, parcelas, salarios))
+
+    def analises_em_lote(self, valores, parcelas, valores_parcela, salarios):
+        """
+        Avalia as regras de análise de vários pedidos de uma só vez, retornando uma lista de bool
+        """
+        return list(map(self.precisa_analise, valores, parcelas, valores_parcela, salarios))
+
+    def ofertas(self, salario):
+        """
+        Retorna a lista de ofertas elegíveis para um salário, no formato enviado para o template
+        """
+        tabela = self.tabela_ofertas
+        return tabela.ofertas_de(tabela.elegibilidade((salario,))[0])
+
+
+def carregar_politica(caminho):
+    try:
+        with open(caminho, encoding='utf-8') as arquivo:
+            dados = json.load(arquivo)
+    except (OSError, ValueError) as erro:
+        raise PoliticaInvalidaError(f'Não foi possível ler {caminho}: {erro}')
+    return Politica(dados)
+
+
+class MotorPoliticas:
+    """
+    Mantém a política em uso pela aplicação e a recarrega quando o arquivo é alterado,
+    sem reiniciar a aplicação. A data de modificação do arquivo é verificada no máximo a
+    cada POLITICAS_INTERVALO segundos, no momento em que a política é usada. Caso o novo
+    arquivo seja inválido, o erro é registrado no log e a política anterior continua em uso.
+
+    Configurações lidas da aplicação:
+        POLITICAS_ARQUIVO: Caminho do arquivo de políticas
+
+        POLITICAS_INTERVALO: Intervalo mínimo, em segundos, entre duas verificações do
+        arquivo. Com 0, o arquivo nunca é recarregado
+
+    Atributos:
+        versao: Identifica a política carregada (a data de modificação do arquivo, igual em
+        todos os processos), usada para invalidar as páginas em cache que dependem da
+        política, como as ofertas
+    """
+
+    def __init__(self, app=None):
+        self.caminho = ARQUIVO_PADRAO
+        self.intervalo = 5
+        self.versao = 0
+        self._politica = None
+        self._modificacao = None
+        self._proxima_verificacao = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('POLITICAS_ARQUIVO', ARQUIVO_PADRAO)
+        app.config.setdefault('POLITICAS_INTERVALO', 5)
+        self.caminho = app.config['POLITICAS_ARQUIVO']
+        self.intervalo = app.config['POLITICAS_INTERVALO']
+        self.recarregar()
+
+    def recarregar(self):
+        """
+        Lê e compila o arquivo de políticas, lançando PoliticaInvalidaError caso seja inválido
+        """
+        with self._lock:
+            modificacao = os.stat(self.caminho).st_mtime_ns
+            self._politica = carregar_politica(self.caminho)
+            self._modificacao = modificacao
+            self._proxima_verificacao = time.monotonic() + self.intervalo
+            self.versao = modificacao
+
+    @property
+    def politica(self):
+        if self.intervalo > 0 and time.monotonic() >= self._proxima_verificacao:
+            self._verificar_arquivo()
+        return self._politica
+
+    def _verificar_arquivo(self):
+        self._proxima_verificacao = time.monotonic() + self.intervalo
+        try:
+            if os.stat(self.caminho).st_mtime_ns != self._modificacao:
+                self.recarregar()
+                logger.info('Políticas recarregadas de %s', self.caminho)
+        except (OSError, PoliticaInvalidaError):
+            logger.exception('Erro ao recarregar as políticas, a política anterior continua em uso')
@@ -1,12 +1,60 @@
-from flask import render_template, flash, url_for, request, redirect, abort
-from FlaskEmprestimo import app, db, bcrypt, is_number, ofertas
+import csv
+import hmac
+import io
+import json
+from datetime import datetime
+from flask import Blueprint, current_app, render_template, flash, url_for, request, redirect, abort, Response, \
+    stream_with_context, jsonify
+from FlaskEmprestimo.extensoes import db, pool_hash, cache_usuarios, cache_paginas, motor_politicas, limitador
 from FlaskEmprestimo.models import Usuario, Emprestimo
+from FlaskEmprestimo.amortizacao import centavos
 from FlaskEmprestimo.forms import CadastrarUsuarioForm, LoginForm, PedirEmprestimoForm, ConfirmarEmprestimoForm
+from FlaskEmprestimo.senhas import FilaCheiaError
+from FlaskEmprestimo.cadastros import cadastrar_usuario, normalizar_cpf, CadastroDuplicadoError
+from FlaskEmprestimo.fila_analise import fila_analise
+from FlaskEmprestimo.metricas import autorizar_status
+from FlaskEmprestimo.originacao import simular_emprestimo, importar_emprestimos, ler_ndjson, \
+    originar_emprestimo, simular_cotacoes, ofertas, EmprestimoInvalidoError
+from FlaskEmprestimo.pagamentos import pagar_parcelas, pagar_em_lote, PagamentoInvalidoError
+from FlaskEmprestimo.consultas import resumo_emprestimos, pagina_emprestimos, historico_emprestimos, proximas_parcelas, \
+    cronograma_emprestimo, datas_pagamento, COLUNAS_EXPORTACAO
 from flask_login import login_user, logout_user, current_user, login_required
 
 # Definição das rotas do site, métodos e usados nelas e as páginas que devem ser retornadas
+# As rotas ficam no blueprint site, registrado na aplicação por criar_app()
+
+site = Blueprint('site', __name__)
+
+def is_number(n):
+    try:
+        float(n)
+        return True
+    except ValueError:
+        return False
+
+# Função para checar se um valor é ou não um número
+
+def cpf_do_formulario():
+    """
+    CPF enviado nos formulários de login e cadastro, usado no limite de tentativas
+    """
+    return normalizar_cpf(request.form.get('cpf'))
+
+def pagina_em_cache(nome, renderizar, titulo=None):
+    """
+    Retorna uma página cujo conteúdo fica no cache de páginas do usuário logado.
+    renderizar() deve retornar o trecho da página (um template da pasta fragmentos) e só é
+    chamada quando o trecho não está em cache. Caso os dados do usuário não tenham mudado
+    desde a última visita, o navegador recebe 304 e reutiliza a página que já possui.
+    Os trechos são renderizados com o current_user do cache de identidades, que em outro
+    processo pode ter o salário anterior até expirar, então o salário faz parte da chave:
+    um trecho renderizado com o salário anterior nunca é servido com o novo
+    """
+    etag = cache_paginas.etag(current_user.id, f'{nome}:{current_user.salario}')
+    return cache_paginas.resposta(etag, lambda: render_template('pagina_em_cache.html', title=titulo,
+        fragmento=cache_paginas.fragmento(etag, renderizar)))
   
-@app.route('/', methods=['GET', 'POST'])
+@site.route('/', methods=['GET', 'POST'])
 def index():
     """
     Carrega a página principal quando se inicia a aplicação e quando o usuário volta para ela.
@@ -14,42 +62,56 @@ def index():
     """
     if current_user.is_authenticated:
 
-        lista_ofertas = ofertas(current_user)
-
-        return render_template('index.html', ofertas=lista_ofertas)
+        # As ofertas dependem da política em uso, então uma nova versão da política gera
+        # uma nova página em cache
+        return pagina_em_cache(f'index:{motor_politicas.versao}', lambda: render_template('fragmentos/index.html',
+            ofertas=ofertas(current_user)))
     else:
-        return redirect(url_for('emprestimo'))
-
-@app.route('/cadastro', methods=['GET', 'POST'])
+        return redirect(url_for('site.emprestimo'))
 
+@site.route('/cadastro', methods=['GET', 'POST'])
+@limitador.limitar(cpf_do_formulario)
 def cadastro():
     """
     Criando uma instância da classe usuário com os dados do cadastro, caso os campos estejam
     corretamente preenchidos, o usuário é redirecionado para a página principal e 
     sua conta é inserida no banco de dados, caso contrário, a página é recarregada
     e os erros são mostrados ao usuário.
+    O hash da senha é gerado pelo pool de hashing, caso a fila esteja cheia o usuário
+    recebe uma mensagem para tentar novamente.
+    A verificação de CPF e e-mail repetidos é feita pelo formulário, e o INSERT de
+    cadastrar_usuario() é protegido pelas restrições de unicidade do banco de dados.
     """
     if current_user.is_authenticated:
-        return(redirect(url_for('index')))
+        return(redirect(url_for('site.index')))
 
     form = CadastrarUsuarioForm()
     
     if form.validate_on_submit():
         
-        senha_hash = bcrypt.generate_password_hash(form.senha.data).decode('utf-8')
-        usuario = Usuario(nome=form.nome.data, cpf=form.cpf.data, email=form.email.data,
-            senha=senha_hash, salario=form.salario.data)
-        db.session.add(usuario)
-        db.session.commit()
+        try:
+            senha_hash = pool_hash.gerar_hash(form.senha.data)
+        except FilaCheiaError:
+            flash('Muitas requisições no momento, tente novamente em alguns segundos', 'warning')
+            return render_template('cadastro.html', title='Cadastrar', form=form), 503
+
+        try:
+            usuario = cadastrar_usuario(form.nome.data, form.cpf.data, form.email.data, senha_hash,
+                form.salario.data)
+        except CadastroDuplicadoError as erro:
+            # Outro cadastro com o mesmo CPF ou e-mail foi salvo depois da validação do formulário
+            form.marcar_em_uso(erro.campos)
+            return render_template('cadastro.html', title='Cadastrar', form=form)
         login_user(usuario, form.lembrar.data)
 
         flash('Conta criada com sucesso!', 'success')
-        return redirect(url_for('index'))
+        return redirect(url_for('site.index'))
 
     return render_template('cadastro.html', title='Cadastrar', form=form)
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@site.route('/login', methods=['GET', 'POST'])
+@limitador.limitar(cpf_do_formulario)
 def login():
     """
     Verifica se um usuário com o CPF informado existe no banco de dados,
@@ -64,57 +126,132 @@ def login():
 
     Caso o usuário tente fazer uma ação que requer estar logado numa conta, ele pode
     realizar o login e então será redirecionado para a página que tentou acessar anteriormente 
+
+    Caso o hash da senha tenha sido gerado com um fator de custo diferente do configurado
+    atualmente, um novo hash é gerado e salvo após o login bem sucedido
     """
     if current_user.is_authenticated:
-        return(redirect(url_for('index')))
+        return(redirect(url_for('site.index')))
 
     form = LoginForm()
     if form.validate_on_submit():
 
         usuario = Usuario.query.filter_by(cpf=form.cpf.data).first()
-        if usuario and bcrypt.check_password_hash(usuario.senha, form.senha.data):
+        try:
+            senha_correta = usuario and pool_hash.verificar(usuario.senha, form.senha.data)
+        except FilaCheiaError:
+            flash('Muitas requisições no momento, tente novamente em alguns segundos', 'warning')
+            return render_template('login.html', title='Login', form=form), 503
+
+        if senha_correta:
+            if pool_hash.precisa_rehash(usuario.senha):
+                try:
+                    usuario.senha = pool_hash.gerar_hash(form.senha.data)
+                    db.session.commit()
+                except FilaCheiaError:
+                    pass # o hash será atualizado num próximo login
             login_user(usuario, form.lembrar.data)
             proxima_pag = request.args.get('next')
 
-            return redirect(proxima_pag) if proxima_pag else redirect(url_for('index'))
+            return redirect(proxima_pag) if proxima_pag else redirect(url_for('site.index'))
         else:
             flash('Login mal sucedido. Verifique seu CPF e sua senha', 'danger')
 
     return render_template('login.html', title='Login', form=form)
 
-@app.route('/logout')
+@site.route('/logout')
 def logout():
     """
     Apenas disponível quando um usuário já está logado, apenas desloga a conta e atualiza a páginia.
     """
     logout_user()
-    return redirect(url_for('index'))
+    return redirect(url_for('site.index'))
 
-@app.route('/perfil')
+@site.route('/perfil')
 @login_required
 def perfil():
     """
-    Apenas disponível quando um usuário estiver logado, exibe as informações do perfil do usuário
+    Apenas disponível quando um usuário estiver logado, exibe as informações do perfil do usuário.
+    Os totais dos empréstimos são lidos da projeção de saldos do usuário, sem consultar os empréstimos
     """
-    qtd_emprestimos = 0
-    emprestimos = Usuario.query.filter_by(id=current_user.id).first().emprestimos
-    for emprestimo in emprestimos:
-        if emprestimo.ativo:
-            qtd_emprestimos += 1 
-    return render_template('perfil.html', title='Perfil', qtd_emprestimos=qtd_emprestimos)
+    return pagina_em_cache('perfil', lambda: render_template('fragmentos/perfil.html',
+        resumo=resumo_emprestimos(current_user.id)), 'Perfil')
 
-@app.route('/perfil/emprestimos')
+@site.route('/perfil/emprestimos')
 @login_required
 def detalhes_emprestimos():
     """
     Apenas disponível quando um usuário estiver logado, mostra o histórico de empréstimos do
-    usuário e quais deles ainda estão ativos
+    usuário e quais deles ainda estão ativos.
+    O histórico é paginado por cursor: o parâmetro "apos" da URL indica o último empréstimo
+    da página anterior
+    """
+    def renderizar():
+        resumo = resumo_emprestimos(current_user.id)
+        emprestimos, proximo_cursor = pagina_emprestimos(current_user.id, request.args.get('apos'))
+        proximas = proximas_parcelas([emprestimo.id for emprestimo in emprestimos if emprestimo.ativo])
+        return render_template('fragmentos/detalhes_emprestimos.html', emprestimos=emprestimos, resumo=resumo,
+            proximo_cursor=proximo_cursor, proximas=proximas)
+
+    return pagina_em_cache('detalhes_emprestimos', renderizar, 'Detalhes')
+
+@site.route('/perfil/emprestimos/<int:emprestimo_id>/cronograma')
+@login_required
+def cronograma(emprestimo_id):
+    """
+    Mostra o cronograma de pagamento salvo de um empréstimo do usuário, com a divisão de cada
+    parcela entre juros e amortização e quais parcelas já foram pagas, com a data de cada
+    pagamento lida do registro de eventos
     """
-    emprestimos = Emprestimo.query.filter_by(beneficiado=current_user).order_by(Emprestimo.parcelas_restantes)
+    emprestimo = Emprestimo.query.get_or_404(emprestimo_id)
+    if emprestimo.id_usuario != current_user.id:
+        abort(403)
+    pagas = emprestimo.parcelas - emprestimo.parcelas_restantes
+    datas = {numero: datetime.fromtimestamp(momento) for numero, momento in datas_pagamento(emprestimo_id).items()}
 
-    return render_template('detalhes_emprestimos.html',title='Detalhes', emprestimos=emprestimos)
+    return render_template('cronograma.html', title='Cronograma', emprestimo=emprestimo,
+        parcelas=cronograma_emprestimo(emprestimo_id), pagas=pagas, datas=datas)
 
-@app.route('/emprestimo', methods=['GET', 'POST'])
+@site.route('/perfil/emprestimos/exportar/<formato>')
+@login_required
+def exportar_emprestimos(formato):
+    """
+    Exporta todo o histórico de empréstimos do usuário em CSV ou JSON.
+    A resposta é enviada aos poucos, conforme as linhas são lidas do banco de dados, sem
+    montar o arquivo inteiro na memória
+    """
+    if formato not in ('csv', 'json'):
+        abort(404)
+
+    linhas = historico_emprestimos(current_user.id)
+
+    def gerar_csv():
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        escritor.writerow(COLUNAS_EXPORTACAO)
+        for linha in linhas:
+            escritor.writerow(linha)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    def gerar_json():
+        yield '['
+        separador = ''
+        for linha in linhas:
+            yield separador + json.dumps(dict(zip(COLUNAS_EXPORTACAO, linha)))
+            separador = ','
+        yield ']'
+
+    if formato == 'csv':
+        resposta = Response(stream_with_context(gerar_csv()), mimetype='text/csv')
+    else:
+        resposta = Response(stream_with_context(gerar_json()), mimetype='application/json')
+    resposta.headers['Content-Disposition'] = f'attachment; filename=emprestimos.{formato}'
+    return resposta
+
+@site.route('/emprestimo', methods=['GET', 'POST'])
 def emprestimo():
     """
     Responsável por renderizar os campos que devem ser preenchidos por um usuário para que
@@ -123,9 +260,10 @@ def emprestimo():
     """
     form = PedirEmprestimoForm()
 
-    return render_template('emprestimo.html', title='Emprestimo', form=form)
+    return render_template('emprestimo.html', title='Emprestimo', form=form,
+        limites=motor_politicas.politica.constantes)
 
-@app.route('/emprestimo/confirmar', methods=['GET', 'POST'])
+@site.route('/emprestimo/confirmar', methods=['GET', 'POST'])
 def confirmar_emprestimo():
     """
     Tela para revisão do empréstimo, onde são mostradas informações mais detalhadas sobre o empréstimo
@@ -136,12 +274,14 @@ def confirmar_emprestimo():
     pedidos na rota /emprestimo.
     A função is_number() é utilizada para garantir que nenhum valor que não possa ser convertido para um valor
     numérico possa ser atribuído tanto para o valor do empréstimo quanto para o salário do usuário.
+    Os valores do empréstimo e seus limites vêm de simular_emprestimo(), as mesmas regras usadas
+    na importação de empréstimos em lote.
     O usuário pode chegar à essa rota através da rota /emprestimo ou clicando em uma oferta na página inicial,
     as ofertas passam valores por URL e a rota /emprestimo passa os valores por formulário.
     """
     
     if not current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('site.index'))
     form = ConfirmarEmprestimoForm()
 
     valor = request.values.get('valor')
@@ -150,75 +290,173 @@ def confirmar_emprestimo():
         salario = request.values.get('salario')
         if is_number(salario):
 
-            valor = round(float(request.values.get('valor')), 2)
-            parcelas = int(request.values.get('parcelas'))
-            salario = float(request.values.get('salario'))
-            valor_a_pagar = round(float(valor) * 1.15, 2)
-            data = {
-                'valor': valor,
-                'parcelas': parcelas,
-                'salario': salario,
-                'valor_a_pagar': valor_a_pagar,
-                'valor_parcela': round(valor_a_pagar / parcelas, 2),
-            }
-            if valor > 50000:
-                flash('Valor muito alto, o empréstimo deve ser menor que R$ 50000.00','danger')
-                return redirect(url_for('emprestimo'))
-
-            elif valor < 1000:
-                flash('Valor muito baixo, o empréstimo deve ser maior que R$ 1000.00','danger')
-                return redirect(url_for('emprestimo'))
-            
-            salario_ativo = Usuario.query.filter_by(id=current_user.id)
-            if salario_ativo != salario:
-                current_user.salario = salario
+            try:
+                data = simular_emprestimo(valor, request.values.get('parcelas'), salario)
+            except EmprestimoInvalidoError as erro:
+                flash(str(erro), 'danger')
+                return redirect(url_for('site.emprestimo'))
+            except (TypeError, ValueError):
+                flash('Quantidade de parcelas inválida', 'danger')
+                return redirect(url_for('site.emprestimo'))
+            salario = data['salario']
+
+            # A renda só é salva quando muda, então simulações repetidas não escrevem no banco
+            if current_user.salario != salario:
+                Usuario.query.filter_by(id=current_user.id).update({Usuario.salario_centavos: centavos(salario)})
                 db.session.commit()
+                cache_usuarios.invalidar(current_user.id)
+                cache_paginas.nova_versao(current_user.id)
+                current_user.salario = salario
                 flash('Sua renda foi atualizada',' success')
 
             return render_template('confirmar_emprestimo.html', form=form, data=data)
     
         else:
             flash('Valor de salário invalido','danger')
-        return redirect(url_for('emprestimo'))
+        return redirect(url_for('site.emprestimo'))
     else:
         flash('Valor para empréstimo invalido','danger')
-        return redirect(url_for('emprestimo'))
+        return redirect(url_for('site.emprestimo'))
 
-@app.route('/emprestimo/confirmar/upload', methods=['GET', 'POST'])
+@site.route('/emprestimo/simular')
+@login_required
+def simular_emprestimos():
+    """
+    Simula, numa única requisição, várias combinações de valor e quantidade de parcelas
+    (parâmetros valor e parcelas, que podem ser repetidos) para o salário informado em
+    salario ou, por padrão, para o salário cadastrado. Não salva nada, nem mesmo o salário.
+    Retorna em JSON a lista de cotações de simular_cotacoes()
+    """
+    valores = request.args.getlist('valor')
+    prazos = request.args.getlist('parcelas')
+    salario = request.args.get('salario') or current_user.salario
+    if not valores or not prazos or not is_number(salario):
+        abort(400)
+    try:
+        return jsonify(simular_cotacoes(valores, prazos, float(salario)))
+    except ValueError as erro:
+        return jsonify({'erro': str(erro)}), 400
+
+@site.route('/emprestimo/confirmar/upload', methods=['GET', 'POST'])
 @login_required
 def upload_emprestimo():
+    """
+    Salva o empréstimo confirmado pelo usuário junto com o seu cronograma de pagamento.
+    Os valores do empréstimo são calculados novamente a partir do valor, das parcelas e do
+    salário, em vez de usar os totais enviados pelo formulário.
+    Empréstimos que precisam de análise são salvos junto com a sua tarefa na fila de análise
+    """
     if request.method == 'POST':
         if request.form['submit_btn'] == 'Cancelar':
             flash('Empréstimo cancelado','danger')
-            return redirect(url_for('emprestimo'))
+            return redirect(url_for('site.emprestimo'))
         elif request.form['submit_btn'] == 'Confirmar':
             r = request.form
+            try:
+                dados = simular_emprestimo(r['valor'], r['parcelas'], r['salario'])
+            except (EmprestimoInvalidoError, TypeError, ValueError):
+                flash('Valores do empréstimo inválidos', 'danger')
+                return redirect(url_for('site.emprestimo'))
 
-            emprestimo = Emprestimo(valor=float(r['valor_a_pagar']), parcelas=int(r['parcelas']), valor_parcela=float(r['valor_parcela']),
-                    parcelas_restantes=int(r['parcelas']), ativo=True, id_usuario=current_user.id)
-
-            db.session.add(emprestimo)
-            db.session.commit()
-
-            if emprestimo.valor_parcela > float(r['salario']) / 10 * 3:
-                flash('Sua requisição foi enviada para analize', 'danger')
+            originar_emprestimo(dados, current_user.id)
+            if dados['em_analise']:
+                flash('Sua requisição foi enviada para análise', 'danger')
 
-            return redirect(url_for('detalhes_emprestimos'))
+            return redirect(url_for('site.detalhes_emprestimos'))
         else:
             pass # unknown
-    return redirect(url_for('emprestimo'))
+    return redirect(url_for('site.emprestimo'))
 
-@app.route('/perfil/emprestimos/pagar/<int:emprestimo_id>', methods=['GET', 'POST'])
+@site.route('/perfil/emprestimos/pagar/<int:emprestimo_id>', methods=['GET', 'POST'])
 @login_required
 def pagar_emprestimo(emprestimo_id):
+    """
+    Paga uma parcela do empréstimo com um único UPDATE condicional, que só decrementa
+    parcelas_restantes se ainda houver parcelas a pagar. Caso o UPDATE não altere nenhuma
+    linha, o empréstimo é consultado apenas para decidir qual erro mostrar
+    """
+    if pagar_parcelas(emprestimo_id, current_user.id):
+        flash('Parcela do empréstimo paga!', 'success')
+        return redirect(url_for('site.detalhes_emprestimos'))
+
     emprestimo = Emprestimo.query.get_or_404(emprestimo_id)
-    if emprestimo.beneficiado != current_user:
+    if emprestimo.id_usuario != current_user.id:
         abort(403)
+    if emprestimo.situacao != 'aprovado':
+        flash('Este empréstimo não foi aprovado', 'info')
+        return redirect(url_for('site.detalhes_emprestimos'))
+    flash('Este empréstimo já foi pago', 'info')
+    return redirect(url_for('site.detalhes_emprestimos'))
+
+@site.route('/perfil/emprestimos/pagar', methods=['POST'])
+@login_required
+def pagar_emprestimos_lote():
+    """
+    Paga vários empréstimos do usuário numa única transação. Os ids dos empréstimos são
+    enviados no campo emprestimo_id (repetido uma vez por empréstimo). Se o campo parcelas
+    for informado, essa quantidade de parcelas é paga de cada empréstimo, caso contrário
+    os empréstimos são quitados.
+    Se algum dos pagamentos não puder ser feito, nenhum deles é salvo
+    """
+    try:
+        ids_emprestimos = [int(id_emprestimo) for id_emprestimo in request.form.getlist('emprestimo_id')]
+        parcelas = request.form.get('parcelas')
+        parcelas = int(parcelas) if parcelas else None
+    except ValueError:
+        abort(400)
+    if not ids_emprestimos or (parcelas is not None and parcelas < 1):
+        abort(400)
+
+    try:
+        pagos = pagar_em_lote(current_user.id, ids_emprestimos, parcelas)
+    except PagamentoInvalidoError as erro:
+        flash(f'Nenhum pagamento foi feito. {erro}', 'danger')
     else:
-        emprestimo.parcelas_restantes -= 1
-        if emprestimo.parcelas_restantes == 0:
-            emprestimo.ativo = False
+        flash(f'{pagos} empréstimos pagos!', 'success')
+    return redirect(url_for('site.detalhes_emprestimos'))
 
-        db.session.commit()
-        flash('Parcela do empréstimo paga!', 'success')
-        return redirect(url_for('detalhes_emprestimos'))
\ No newline at end of file
+@site.route('/status/cache-usuarios')
+def status_cache_usuarios():
+    """
+    Retorna os contadores do cache de identidades dos usuários (tamanho, acertos, falhas
+    e remoções), usados para dimensionar USUARIO_CACHE_MAX e USUARIO_CACHE_TTL.
+    Requer o STATUS_TOKEN (ver metricas.autorizar_status())
+    """
+    autorizar_status()
+    return jsonify(cache_usuarios.estatisticas())
+
+@site.route('/status/fila-analise')
+def status_fila_analise():
+    """
+    Retorna a profundidade da fila de análise e os contadores dos trabalhadores deste
+    processo (tarefas processadas, decisões, vazão em tarefas por segundo e espera média).
+    Requer o STATUS_TOKEN (ver metricas.autorizar_status())
+    """
+    autorizar_status()
+    return jsonify(fila_analise.estatisticas())
+
+@site.route('/emprestimos/lote', methods=['POST'])
+def importar_emprestimos_lote():
+    """
+    Importação em lote de empréstimos enviados por canais parceiros. Aceita um array JSON
+    ou, com Content-Type application/x-ndjson, um objeto JSON por linha, que é lido aos
+    poucos do corpo da requisição.
+    Cada empréstimo deve conter cpf, valor, parcelas e, opcionalmente, salario.
+    Requer o cabeçalho "Authorization: Bearer <IMPORTACAO_TOKEN>", e fica desativada
+    enquanto IMPORTACAO_TOKEN não for configurado.
+    Retorna o relatório da importação, com o motivo de cada linha rejeitada
+    """
+    token = current_app.config.get('IMPORTACAO_TOKEN')
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+
+    if request.mimetype == 'application/x-ndjson':
+        linhas = ler_ndjson(request.stream)
+    else:
+        linhas = request.get_json(silent=True)
+        if not isinstance(linhas, list):
+            abort(400)
+
+    return jsonify(importar_emprestimos(linhas, current_app.config['IMPORTACAO_TAMANHO_LOTE']))
@@ -0,0 +1,127 @@
+import threading
+import bcrypt as _bcrypt
+
+# Geração e verificação dos hashes de senha fora das threads que atendem as requisições.
+# O bcrypt é limitado por CPU, então o trabalho é feito num pool de processos, que não
+# disputa o GIL com as threads do servidor.
+
+
+class FilaCheiaError(Exception):
+    """
+    Lançada quando a fila do pool de hashing já possui o número máximo de tarefas
+    pendentes, para que a requisição seja recusada em vez de esperar indefinidamente
+    """
+
+
+def _gerar_hash(senha, rounds):
+    return _bcrypt.hashpw(senha.encode('utf-8'), _bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _verificar_hash(senha_hash, senha):
+    return _bcrypt.checkpw(senha.encode('utf-8'), senha_hash.encode('utf-8'))
+
+
+def custo_do_hash(senha_hash):
+    """
+    Retorna o fator de custo (log rounds) com que um hash bcrypt foi gerado,
+    por exemplo 12 para "$2b$12$..."
+    """
+    try:
+        return int(senha_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PoolHash:
+    """
+    Pool limitado de processos para gerar e verificar hashes bcrypt.
+
+    O pool é criado apenas no primeiro uso, com o contexto "spawn", para que nenhum processo
+    seja criado por fork a partir de um servidor que já possui várias threads.
+
+    Configurações lidas da aplicação:
+        BCRYPT_LOG_ROUNDS: Fator de custo usado para gerar novos hashes
+
+        HASH_PROCESSOS: Quantidade de processos do pool. Com 0, os hashes são calculados
+        na própria thread da requisição
+
+        HASH_FILA_MAX: Quantidade máxima de tarefas no pool (em execução ou esperando).
+        Quando atingida, novas tarefas esperam até HASH_FILA_TIMEOUT segundos por uma vaga
+        e então lançam FilaCheiaError
+    """
+
+    def __init__(self, app=None):
+        self.rounds = 12
+        self.processos = 0
+        self.fila_timeout = 0
+        self._executor = None
+        self._vagas = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        app.config.setdefault('HASH_PROCESSOS', 0)
+        app.config.setdefault('HASH_FILA_MAX', 64)
+        app.config.setdefault('HASH_FILA_TIMEOUT', 5)
+        self.configurar(app.config['BCRYPT_LOG_ROUNDS'], app.config['HASH_PROCESSOS'],
+            app.config['HASH_FILA_MAX'], app.config['HASH_FILA_TIMEOUT'])
+
+    def configurar(self, rounds, processos, fila_max, fila_timeout):
+        """
+        Altera a configuração do pool, encerrando o pool de processos atual caso exista
+        """
+        with self._lock:
+            self.encerrar()
+            self.rounds = rounds
+            self.processos = processos
+            self.fila_timeout = fila_timeout
+            self._vagas = threading.BoundedSemaphore(max(fila_max, 1))
+
+    def encerrar(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _obter_executor(self):
+        if self._executor is None:
+            # Importados apenas quando o pool é usado, o que não acontece com HASH_PROCESSOS=0
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.processos,
+                        mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def _executar(self, funcao, *args):
+        if not self.processos:
+            return funcao(*args)
+
+        if not self._vagas.acquire(timeout=self.fila_timeout):
+            raise FilaCheiaError('Fila de hashing cheia')
+        try:
+            return self._obter_executor().submit(funcao, *args).result()
+        finally:
+            self._vagas.release()
+
+    def gerar_hash(self, senha):
+        """
+        Retorna o hash bcrypt da senha, gerado com o fator de custo configurado
+        """
+        return self._executar(_gerar_hash, senha, self.rounds)
+
+    def verificar(self, senha_hash, senha):
+        """
+        Retorna True caso a senha corresponda ao hash
+        """
+        return self._executar(_verificar_hash, senha_hash, senha)
+
+    def precisa_rehash(self, senha_hash):
+        """
+        Retorna True caso o hash tenha sido gerado com um fator de custo diferente do
+        configurado atualmente, indicando que ele deve ser gerado novamente no próximo login
+        """
+        return custo_do_hash(senha_hash) != self.rounds
@@ -0,0 +1,2 @@
+# Scripts de benchmark da aplicação. Devem ser executados a partir da raiz do repositório,
+# por exemplo: python -m benchmarks.bench_ofertas
@@ -0,0 +1,48 @@
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from FlaskEmprestimo import criar_app
+from FlaskEmprestimo.extensoes import db
+from FlaskEmprestimo.analise import analisar_carteira, analisar_saldos
+from benchmarks.dados_sinteticos import popular
+
+# Mede o tempo e o pico de memória da análise da carteira (comando "flask analise-carteira")
+# sobre uma base sintética. O agrupamento é feito pelo banco de dados, então o pico de
+# memória não deve depender da quantidade de empréstimos. Também mede os totais
+# calculados a partir da projeção de saldos dos usuários (opção --saldos), que devem ser
+# iguais aos da carteira.
+# Uso: python -m benchmarks.bench_analise [usuários] [empréstimos por usuário]
+
+
+def main(usuarios=20000, emprestimos_por_usuario=10):
+    caminho = os.path.join(tempfile.mkdtemp(), 'bench_analise.db')
+    app = criar_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{caminho}'})
+
+    with app.app_context():
+        db.create_all()
+        popular(usuarios, emprestimos_por_usuario, cronogramas=False)
+        print(f'{usuarios} usuários, {usuarios * emprestimos_por_usuario} empréstimos')
+
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        linhas = analisar_carteira()
+        duracao = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'carteira: {duracao:>7.3f}s, pico de memória {pico / 1024 / 1024:>7.2f} MiB')
+
+        _, _, emprestimos, ativos, proporcao, saldo, _ = linhas[0]
+        print(f'ativos: {ativos} ({proporcao:.1%}), saldo devedor: R$ {saldo:.2f}')
+
+        inicio = time.perf_counter()
+        saldos = analisar_saldos()
+        print(f'projeção de saldos: {time.perf_counter() - inicio:>7.3f}s')
+        assert saldos == [linha for linha in linhas if linha[0] != 'prazo'], \
+            'Totais da projeção diferentes dos totais da carteira'
+
+
+if __name__ == '__main__':
+    argumentos = [int(a) for a in sys.argv[1:]]
+    main(*argumentos)
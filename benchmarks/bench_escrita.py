@@ -0,0 +1,95 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.exc import OperationalError
+from FlaskEmprestimo import criar_app
+from FlaskEmprestimo.extensoes import db
+from FlaskEmprestimo.config import opcoes_engine, aplicar_pragmas_sqlite
+from FlaskEmprestimo.models import Usuario, Emprestimo
+
+# Compara a vazão de escritas simultâneas no SQLite com as configurações padrão do engine
+# e com a configuração da aplicação (WAL, synchronous, busy_timeout e cache_size).
+# Cada thread repete uma transação parecida com as de upload_emprestimo e pagar_emprestimo:
+# insere um empréstimo e paga uma parcela dele. Ao mesmo tempo, outras threads fazem
+# leituras agregadas, como as da página de perfil.
+# Uso: python -m benchmarks.bench_escrita [transações por thread] [threads] [threads de leitura]
+
+
+def criar_engine(config_app, ajustado):
+    caminho = os.path.join(tempfile.mkdtemp(), 'bench_escrita.db')
+    uri = f'sqlite:///{caminho}'
+    if not ajustado:
+        return create_engine(uri)
+
+    config = dict(config_app, SQLALCHEMY_DATABASE_URI=uri)
+    engine = create_engine(uri, **opcoes_engine(config))
+    event.listen(engine, 'connect', lambda conexao, registro: aplicar_pragmas_sqlite(conexao, config))
+    return engine
+
+
+def rodar(engine, transacoes, threads, leitores):
+    db.metadata.create_all(engine)
+    with engine.begin() as conexao:
+        conexao.execute(Usuario.__table__.insert(), {'id': 1, 'nome': 'Benchmark', 'cpf': '00000000191',
+            'email': 'bench@exemplo.com', 'senha': '-', 'salario_centavos': 500000})
+
+    tabela = Emprestimo.__table__
+    erros = []
+    leituras = []
+    terminou = threading.Event()
+
+    def trabalhador():
+        for _ in range(transacoes):
+            try:
+                with engine.begin() as conexao:
+                    resultado = conexao.execute(tabela.insert(), {'valor_centavos': 115000, 'parcelas': 12,
+                        'valor_parcela_centavos': 9583, 'parcelas_restantes': 12, 'ativo': True, 'id_usuario': 1})
+                    id_emprestimo = resultado.inserted_primary_key[0]
+                    conexao.execute(tabela.update().where(tabela.c.id == id_emprestimo)
+                        .values(parcelas_restantes=tabela.c.parcelas_restantes - 1))
+            except OperationalError:
+                erros.append(1)
+
+    def leitor():
+        consulta = select(func.count(tabela.c.id), func.sum(tabela.c.valor_parcela_centavos * tabela.c.parcelas_restantes)) \
+            .where(tabela.c.id_usuario == 1)
+        while not terminou.is_set():
+            try:
+                with engine.connect() as conexao:
+                    conexao.execute(consulta).one()
+                leituras.append(1)
+            except OperationalError:
+                erros.append(1)
+
+    inicio = time.perf_counter()
+    escritores = [threading.Thread(target=trabalhador) for _ in range(threads)]
+    lista = escritores + [threading.Thread(target=leitor) for _ in range(leitores)]
+    for thread in lista:
+        thread.start()
+    for thread in escritores:
+        thread.join()
+    duracao = time.perf_counter() - inicio
+    terminou.set()
+    for thread in lista:
+        thread.join()
+    engine.dispose()
+
+    concluidas = transacoes * threads - len(erros)
+    return concluidas / duracao, len(leituras) / duracao, len(erros)
+
+
+def main(transacoes=200, threads=8, leitores=4):
+    config_app = criar_app().config
+    print(f'{threads} threads de escrita, {transacoes} transações por thread, {leitores} threads de leitura')
+    for nome, ajustado in (('padrão', False), ('ajustado', True)):
+        vazao, vazao_leitura, erros = rodar(criar_engine(config_app, ajustado), transacoes, threads, leitores)
+        print(f'{nome:>10}: {vazao:>8.1f} escritas/s, {vazao_leitura:>8.1f} leituras/s, '
+            f'{erros} erros "database is locked"')
+
+
+if __name__ == '__main__':
+    argumentos = [int(a) for a in sys.argv[1:]]
+    main(*argumentos)
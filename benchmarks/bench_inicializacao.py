@@ -0,0 +1,94 @@
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Mede o tempo de inicialização de um processo novo em cada cenário: a criação da
+# aplicação (o que um worker do servidor ou um teste faz ao iniciar), um comando "flask"
+# e um processo do pool de hashing de senhas, que importa apenas FlaskEmprestimo.senhas.
+# O tempo de cada cenário é a mediana das repetições, incluindo a inicialização do
+# interpretador, e é comparado com o orçamento do cenário: um cenário acima do orçamento
+# faz o script terminar com código 1. Uma execução com "python -X importtime" mostra os
+# módulos que mais pesam em cada cenário.
+# Uso: python -m benchmarks.bench_inicializacao [repetições] [fator do orçamento]
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cenário: (argumentos do interpretador, orçamento em milissegundos)
+CENARIOS = {
+    'aplicacao': (['-c', 'from FlaskEmprestimo import criar_app; criar_app()'], 1000),
+    'comando flask': (['-m', 'flask', '--help'], 1200),
+    'pool de hashing': (['-c', 'import FlaskEmprestimo.senhas'], 150),
+}
+
+MODULOS_LISTADOS = 8
+
+
+def executar(argumentos, ambiente, importtime=False):
+    """
+    Executa o interpretador num processo novo. Retorna a duração, em segundos, e a saída
+    de erro (onde o -X importtime escreve)
+    """
+    comando = [sys.executable] + (['-X', 'importtime'] if importtime else []) + argumentos
+    inicio = time.perf_counter()
+    processo = subprocess.run(comando, env=ambiente, cwd=RAIZ, capture_output=True, text=True)
+    duracao = time.perf_counter() - inicio
+    if processo.returncode != 0:
+        raise RuntimeError(f'{" ".join(argumentos)} terminou com código {processo.returncode}:\n{processo.stderr}')
+    return duracao, processo.stderr
+
+
+def ler_importtime(saida):
+    """
+    Retorna a lista (módulo, microssegundos) dos módulos importados diretamente pelo
+    cenário, com o tempo acumulado de cada um (incluindo os módulos que ele importa), e a
+    soma do tempo próprio dos módulos do pacote FlaskEmprestimo
+    """
+    modulos = []
+    proprio_pacote = 0
+    for linha in saida.splitlines():
+        if not linha.startswith('import time:') or '|' not in linha:
+            continue
+        proprio, acumulado, nome = linha[len('import time:'):].split('|')
+        if not proprio.strip().isdigit():
+            continue  # cabeçalho
+        if nome.strip().startswith('FlaskEmprestimo'):
+            proprio_pacote += int(proprio)
+        # Os módulos importados diretamente possuem um único espaço antes do nome
+        if not nome.startswith('  '):
+            modulos.append((nome.strip(), int(acumulado)))
+    return sorted(modulos, key=lambda modulo: -modulo[1]), proprio_pacote
+
+
+def main(repeticoes=5, fator=1.0):
+    ambiente = dict(os.environ, FLASK_APP='run.py',
+        DATABASE_URL=f'sqlite:///{os.path.join(tempfile.mkdtemp(), "bench_inicializacao.db")}')
+    acima = []
+    for nome, (argumentos, orcamento) in CENARIOS.items():
+        # A primeira execução compila os arquivos .pyc que ainda não existirem
+        executar(argumentos, ambiente)
+        duracoes = [executar(argumentos, ambiente)[0] * 1000 for _ in range(repeticoes)]
+        mediana = statistics.median(duracoes)
+        limite = orcamento * fator
+        if mediana > limite:
+            acima.append(nome)
+
+        _, saida = executar(argumentos, ambiente, importtime=True)
+        modulos, proprio_pacote = ler_importtime(saida)
+        print(f'\n{nome}: {mediana:.0f} ms (mín. {min(duracoes):.0f} ms, orçamento {limite:.0f} ms)'
+            f'{"   ACIMA DO ORÇAMENTO" if mediana > limite else ""}')
+        print(f'  imports: {sum(tempo for _, tempo in modulos) / 1000:.0f} ms, '
+            f'dos quais {proprio_pacote / 1000:.0f} ms nos módulos de FlaskEmprestimo')
+        for modulo, tempo in modulos[:MODULOS_LISTADOS]:
+            print(f'  {modulo:<40} {tempo / 1000:>7.1f} ms')
+
+    if acima:
+        print(f'\nCenários acima do orçamento: {", ".join(acima)}')
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    argumentos = sys.argv[1:]
+    main(int(argumentos[0]) if argumentos else 5, float(argumentos[1]) if len(argumentos) > 1 else 1.0)
@@ -0,0 +1,81 @@
+import itertools
+import os
+import sys
+import tempfile
+import time
+import timeit
+from FlaskEmprestimo import criar_app
+from FlaskEmprestimo.extensoes import db, pool_hash, limitador
+from FlaskEmprestimo.limites import BackendMemoria
+from FlaskEmprestimo.models import Usuario
+
+# Mede o custo do limite de tentativas: uma verificação no backend em memória (sempre a
+# mesma chave e chaves sempre novas, com remoção LRU), a verificação de IP e CPF feita em
+# cada tentativa de login, e uma requisição ao /login com o limite desativado e recusada
+# com 429.
+# Uso: python -m benchmarks.bench_limites [repetições] [rounds do bcrypt]
+
+CPF = '00000000191'
+
+
+def latencia(funcao, repeticoes):
+    """
+    Retorna o menor tempo médio de uma chamada, em microssegundos
+    """
+    return min(timeit.repeat(funcao, number=repeticoes, repeat=5)) / repeticoes * 1e6
+
+
+def medir_backend(repeticoes):
+    backend = BackendMemoria(max_chaves=10_000)
+    print('Verificação no backend em memória:')
+    print(f'  mesma chave:           {latencia(lambda: backend.consumir("ip:10.0.0.1", 10**9, 60), repeticoes):.2f} µs')
+    chaves = (f'ip:{numero}' for numero in itertools.count())
+    tempo = latencia(lambda: backend.consumir(next(chaves), 30, 60), repeticoes)
+    print(f'  chaves sempre novas:   {tempo:.2f} µs ({backend.tamanho()} chaves, {backend.remocoes} remoções)')
+    limitador.limites = {'ip': (10**9, 60), 'cpf': (10**9, 60)}
+    tempo = latencia(lambda: limitador.verificar('10.0.0.1', CPF), repeticoes)
+    print(f'  IP e CPF (por login):  {tempo:.2f} µs')
+
+
+def preparar_banco(rounds):
+    caminho = os.path.join(tempfile.mkdtemp(), 'bench_limites.db')
+    app = criar_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{caminho}', 'WTF_CSRF_ENABLED': False})
+    pool_hash.configurar(rounds, 0, 1, 0)
+    with app.app_context():
+        db.create_all()
+        db.session.add(Usuario(nome='Benchmark', cpf=CPF, email='bench@exemplo.com',
+            senha=pool_hash.gerar_hash('senha'), salario=5000))
+        db.session.commit()
+    return app
+
+
+def medir_login(cliente, repeticoes, status_esperado):
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        resposta = cliente.post('/login', data={'cpf': CPF, 'senha': 'errada'})
+        assert resposta.status_code == status_esperado, resposta.status_code
+    return (time.perf_counter() - inicio) / repeticoes * 1e6
+
+
+def main(repeticoes=100_000, rounds=12):
+    medir_backend(repeticoes)
+
+    app = preparar_banco(rounds)
+    cliente = app.test_client()
+    logins = 20
+    print(f'Login com senha errada, bcrypt com {rounds} rounds ({logins} requisições):')
+    limitador.ativo = False
+    desativado = medir_login(cliente, logins, 200)
+    print(f'  limite desativado:     {desativado:.0f} µs')
+
+    # Com limite zero por CPF, todas as tentativas são recusadas
+    limitador.ativo = True
+    limitador.limites = {'ip': (10**9, 60), 'cpf': (0, 60)}
+    recusado = medir_login(cliente, logins * 10, 429)
+    print(f'  recusado (429):        {recusado:.0f} µs')
+    pool_hash.encerrar()
+
+
+if __name__ == '__main__':
+    argumentos = [int(a) for a in sys.argv[1:]]
+    main(*argumentos)
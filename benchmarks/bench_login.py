@@ -0,0 +1,79 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+from FlaskEmprestimo import criar_app
+from FlaskEmprestimo.extensoes import db, pool_hash
+from FlaskEmprestimo.models import Usuario
+
+# Teste de carga do /login com diferentes tamanhos do pool de hashing.
+# Para cada tamanho de pool, várias threads fazem logins simultâneos pelo test client do
+# Flask, e são reportadas a vazão (logins por segundo) e a latência p50/p99.
+# Uso: python -m benchmarks.bench_login [logins por pool] [threads] [rounds do bcrypt]
+
+TAMANHOS_POOL = (0, 1, 2, 4, 8)
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    indice = min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))
+    return valores[indice]
+
+
+def preparar_banco(rounds):
+    caminho = os.path.join(tempfile.mkdtemp(), 'bench_login.db')
+    # Sem o limite de tentativas, pois todos os logins usam o mesmo CPF e o mesmo IP
+    app = criar_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{caminho}', 'WTF_CSRF_ENABLED': False,
+        'LIMITE_ATIVO': False})
+    pool_hash.configurar(rounds, 0, 1, 0)
+    with app.app_context():
+        db.create_all()
+        db.session.add(Usuario(nome='Benchmark', cpf='00000000191', email='bench@exemplo.com',
+            senha=pool_hash.gerar_hash('senha'), salario=5000))
+        db.session.commit()
+    return app
+
+
+def rodar(app, logins, threads):
+    latencias = []
+    lock = threading.Lock()
+    por_thread = logins // threads
+
+    def trabalhador():
+        cliente = app.test_client()
+        for _ in range(por_thread):
+            inicio = time.perf_counter()
+            resposta = cliente.post('/login', data={'cpf': '00000000191', 'senha': 'senha'})
+            duracao = time.perf_counter() - inicio
+            assert resposta.status_code == 302, resposta.status_code
+            cliente.get('/logout')
+            with lock:
+                latencias.append(duracao)
+
+    inicio = time.perf_counter()
+    lista = [threading.Thread(target=trabalhador) for _ in range(threads)]
+    for thread in lista:
+        thread.start()
+    for thread in lista:
+        thread.join()
+    total = time.perf_counter() - inicio
+    return len(latencias) / total, percentil(latencias, 50), percentil(latencias, 99)
+
+
+def main(logins=200, threads=8, rounds=10):
+    app = preparar_banco(rounds)
+    print(f'{logins} logins por pool, {threads} threads, bcrypt com {rounds} rounds')
+    print(f'{"processos":>10} {"logins/s":>10} {"p50 (ms)":>10} {"p99 (ms)":>10}')
+    for processos in TAMANHOS_POOL:
+        pool_hash.configurar(rounds, processos, max(threads, 1), 30)
+        # Aquece o pool para que a criação dos processos não entre na medição
+        pool_hash.gerar_hash('aquecimento')
+        vazao, p50, p99 = rodar(app, logins, threads)
+        print(f'{processos:>10} {vazao:>10.1f} {p50 * 1000:>10.1f} {p99 * 1000:>10.1f}')
+    pool_hash.encerrar()
+
+
+if __name__ == '__main__':
+    argumentos = [int(a) for a in sys.argv[1:]]
+    main(*argumentos)
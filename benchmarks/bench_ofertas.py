@@ -0,0 +1,40 @@
+import random
+import time
+from types import SimpleNamespace
+from FlaskEmprestimo import criar_app
+from FlaskEmprestimo.extensoes import motor_politicas
+from FlaskEmprestimo.originacao import ofertas
+
+# Compara o cálculo das ofertas chamando ofertas() usuário por usuário com a avaliação
+# em lote da tabela compilada do catálogo.
+# Uso: python -m benchmarks.bench_ofertas [quantidade de salários]
+
+def medir(funcao, repeticoes=3):
+    melhor = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        duracao = time.perf_counter() - inicio
+        melhor = duracao if melhor is None else min(melhor, duracao)
+    return melhor
+
+
+def main(quantidade=1_000_000):
+    criar_app()
+    aleatorio = random.Random(42)
+    salarios = [round(aleatorio.uniform(800, 20000), 2) for _ in range(quantidade)]
+    usuarios = [SimpleNamespace(salario=salario) for salario in salarios]
+
+    tempo_loop = medir(lambda: [ofertas(usuario) for usuario in usuarios])
+    tabela_ofertas = motor_politicas.politica.tabela_ofertas
+    tempo_lote = medir(lambda: tabela_ofertas.elegibilidade(salarios))
+
+    print(f'Salários avaliados: {quantidade}')
+    print(f'ofertas() em loop:  {tempo_loop:.3f}s ({quantidade / tempo_loop:,.0f} salários/s)')
+    print(f'Avaliação em lote:  {tempo_lote:.3f}s ({quantidade / tempo_lote:,.0f} salários/s)')
+    print(f'Ganho: {tempo_loop / tempo_lote:.1f}x')
+
+
+if __name__ == '__main__':
+    import sys
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,45 @@
+import random
+import sys
+import timeit
+from FlaskEmprestimo import criar_app
+from FlaskEmprestimo.extensoes import motor_politicas
+
+# Mede a latência de uma decisão de crédito com a política compilada (regras de recusa,
+# regras de análise e ofertas de um salário) e a vazão da avaliação em lote.
+# Uso: python -m benchmarks.bench_politicas [quantidade de pedidos]
+
+
+def latencia(funcao, repeticoes=200_000):
+    """
+    Retorna o menor tempo médio de uma chamada, em microssegundos
+    """
+    return min(timeit.repeat(funcao, number=repeticoes, repeat=5)) / repeticoes * 1e6
+
+
+def main(quantidade=1_000_000):
+    criar_app()
+    politica = motor_politicas.politica
+    aleatorio = random.Random(42)
+    valores = [round(aleatorio.uniform(500, 60000), 2) for _ in range(quantidade)]
+    parcelas = [aleatorio.choice((6, 12, 18, 24, 30, 36, 48)) for _ in range(quantidade)]
+    salarios = [round(aleatorio.uniform(800, 20000), 2) for _ in range(quantidade)]
+    valores_parcela = [valor * 1.15 / prazo for valor, prazo in zip(valores, parcelas)]
+
+    print('Latência por decisão:')
+    print(f'  recusa():          {latencia(lambda: politica.recusa(5000.0, 12, 3000.0)):.2f} µs')
+    print(f'  precisa_analise(): {latencia(lambda: politica.precisa_analise(5000.0, 12, 479.17, 3000.0)):.2f} µs')
+    print(f'  ofertas():         {latencia(lambda: politica.ofertas(3000.0)):.2f} µs')
+
+    tempo_recusas = min(timeit.repeat(lambda: politica.recusas_em_lote(valores, parcelas, salarios), number=1, repeat=3))
+    tempo_analises = min(timeit.repeat(
+        lambda: politica.analises_em_lote(valores, parcelas, valores_parcela, salarios), number=1, repeat=3))
+    tempo_ofertas = min(timeit.repeat(lambda: politica.tabela_ofertas.elegibilidade(salarios), number=1, repeat=3))
+    print(f'Avaliação em lote de {quantidade} pedidos:')
+    print(f'  recusas:  {tempo_recusas:.3f}s ({quantidade / tempo_recusas:,.0f} pedidos/s)')
+    print(f'  análises: {tempo_analises:.3f}s ({quantidade / tempo_analises:,.0f} pedidos/s)')
+    print(f'  ofertas:  {tempo_ofertas:.3f}s ({quantidade / tempo_ofertas:,.0f} salários/s)')
+
+
+if __name__ == '__main__':
+    argumentos = [int(a) for a in sys.argv[1:]]
+    main(*argumentos)
@@ -0,0 +1,69 @@
+import os
+import sys
+import tempfile
+import time
+import timeit
+from FlaskEmprestimo import criar_app
+from FlaskEmprestimo.extensoes import db
+from FlaskEmprestimo.models import Emprestimo, EventoEmprestimo
+from FlaskEmprestimo.consultas import resumo_emprestimos, calcular_resumo_emprestimos
+from FlaskEmprestimo.eventos import reconstruir_saldos, divergencias
+from FlaskEmprestimo.pagamentos import pagar_parcelas
+from benchmarks.dados_sinteticos import popular
+
+# Mede o resumo dos empréstimos do perfil lido da projeção de saldos (uma consulta pela
+# chave primária) e calculado a partir dos empréstimos e dos seus cronogramas, para
+# usuários com quantidades diferentes de empréstimos, o custo do registro de eventos no
+# pagamento de uma parcela e a reconstrução da projeção a partir dos eventos, conferida
+# com divergencias().
+# Uso: python -m benchmarks.bench_saldos [usuários] [pagamentos]
+
+EMPRESTIMOS_POR_USUARIO = (10, 100, 1000)
+
+
+def latencia(funcao, repeticoes=200):
+    """
+    Retorna o menor tempo médio de uma chamada, em microssegundos
+    """
+    return min(timeit.repeat(funcao, number=repeticoes, repeat=5)) / repeticoes * 1e6
+
+
+def main(usuarios=2000, pagamentos=500):
+    caminho = os.path.join(tempfile.mkdtemp(), 'bench_saldos.db')
+    app = criar_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{caminho}'})
+
+    with app.app_context():
+        db.create_all()
+        print('Resumo do perfil (projeção / calculado a partir dos empréstimos):')
+        for quantidade in EMPRESTIMOS_POR_USUARIO:
+            id_usuario = popular(1, quantidade, semente=quantidade)[0][0]
+            assert resumo_emprestimos(id_usuario) == calcular_resumo_emprestimos(id_usuario)
+            projecao = latencia(lambda: resumo_emprestimos(id_usuario))
+            calculado = latencia(lambda: calcular_resumo_emprestimos(id_usuario))
+            print(f'  {quantidade:>5} empréstimos: {projecao:>7.1f} µs / {calculado:>7.1f} µs')
+
+        popular(usuarios, 10)
+        ativos = [(id_emprestimo, id_usuario) for id_emprestimo, id_usuario in
+            db.session.query(Emprestimo.id, Emprestimo.id_usuario).filter(Emprestimo.ativo == True)
+                .order_by(Emprestimo.id).limit(pagamentos)]
+        inicio = time.perf_counter()
+        for id_emprestimo, id_usuario in ativos:
+            assert pagar_parcelas(id_emprestimo, id_usuario)
+        duracao = time.perf_counter() - inicio
+        print(f'Pagamento de uma parcela, com o evento e a projeção: {duracao / len(ativos) * 1e6:.0f} µs')
+
+        eventos = db.session.query(db.func.count(EventoEmprestimo.id)).scalar()
+        db.session.remove()
+        for tamanho_lote in (100, 1000, 10000):
+            inicio = time.perf_counter()
+            reconstruidos = reconstruir_saldos(tamanho_lote=tamanho_lote)
+            duracao = time.perf_counter() - inicio
+            print(f'Reconstrução, lote {tamanho_lote:>5}: {duracao:.3f}s ({reconstruidos} usuários, '
+                f'{eventos / duracao:,.0f} eventos/s)')
+        assert not divergencias(), 'Projeção diferente dos totais dos empréstimos'
+    print('OK: projeção igual aos totais dos empréstimos')
+
+
+if __name__ == '__main__':
+    argumentos = [int(a) for a in sys.argv[1:]]
+    main(*argumentos)
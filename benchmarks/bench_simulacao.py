@@ -0,0 +1,43 @@
+import sys
+import timeit
+from FlaskEmprestimo import criar_app
+from FlaskEmprestimo.amortizacao import cronograma
+from FlaskEmprestimo.originacao import cotacao, simular_emprestimo, simular_cotacoes
+
+# Mede o custo de uma simulação de empréstimo com e sem o cache de cotações, e de uma
+# simulação de várias combinações de valor e prazo numa única chamada.
+# Uso: python -m benchmarks.bench_simulacao [repetições]
+
+PRAZOS = (12, 18, 24, 30, 36)
+VALORES = (3000, 5000, 7500, 10000, 20000, 50000)
+
+
+def sem_cache(valor, parcelas, sistema):
+    parcelas_cronograma = cronograma(valor, parcelas, sistema)
+    return float(sum(parcela[1] for parcela in parcelas_cronograma)), float(parcelas_cronograma[0][1])
+
+
+def latencia(funcao, repeticoes):
+    """
+    Retorna o menor tempo médio de uma chamada, em microssegundos
+    """
+    return min(timeit.repeat(funcao, number=repeticoes, repeat=5)) / repeticoes * 1e6
+
+
+def main(repeticoes=20_000):
+    app = criar_app()
+    sistema = app.config['AMORTIZACAO_SISTEMA']
+    with app.app_context():
+        print('Cotação de 5000 em 36 parcelas:')
+        print(f'  sem cache:           {latencia(lambda: sem_cache(5000.0, 36, sistema), repeticoes // 10):.2f} µs')
+        print(f'  com cache:           {latencia(lambda: cotacao(5000.0, 36, sistema), repeticoes):.2f} µs')
+        print(f'  simular_emprestimo(): {latencia(lambda: simular_emprestimo(5000, 36, 3000), repeticoes):.2f} µs')
+        quantidade = len(VALORES) * len(PRAZOS)
+        tempo = latencia(lambda: simular_cotacoes(VALORES, PRAZOS, 3000.0), repeticoes // 100)
+        print(f'{quantidade} cotações numa chamada: {tempo:.1f} µs ({tempo / quantidade:.2f} µs por cotação)')
+        print(f'Cache: {cotacao.cache_info()}')
+
+
+if __name__ == '__main__':
+    argumentos = [int(a) for a in sys.argv[1:]]
+    main(*argumentos)
@@ -0,0 +1,309 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+from werkzeug.serving import make_server
+from FlaskEmprestimo import criar_app
+from FlaskEmprestimo.extensoes import db, pool_hash
+from FlaskEmprestimo.models import Emprestimo
+from FlaskEmprestimo.migracoes import migrar
+from benchmarks.bench_login import percentil
+from benchmarks.dados_sinteticos import popular, SENHA_PADRAO
+
+# Teste de carga das principais rotas do site sobre uma base sintética. Cada thread
+# representa um usuário que, a cada iteração, faz login, visita as ofertas, o perfil e o
+# detalhamento dos empréstimos, simula um empréstimo, paga uma parcela e sai.
+# As requisições são feitas pelo test client do Flask (mede apenas a aplicação), por
+# HTTP ao servidor de desenvolvimento (um processo, uma thread por requisição, como no
+# run.py) ou por HTTP ao servidor de produção (servidor.py, em outro processo, com
+# --processos workers de --threads-servidor threads), para comparar a vazão dos dois.
+#
+# São reportadas a vazão e a latência p50/p90/p99 de cada rota. Os resultados são salvos
+# em JSON no diretório de baselines e, caso já exista uma baseline com os mesmos
+# parâmetros, comparados com ela: um aumento do p99 acima da tolerância é uma regressão
+# e faz o script terminar com código 1.
+# Uso: python -m benchmarks.carga --help
+
+ROTAS = ('/login', '/', '/perfil', '/perfil/emprestimos', '/emprestimo/confirmar',
+    '/perfil/emprestimos/pagar/<id>')
+
+
+class ClienteTeste:
+    """
+    Faz as requisições pelo test client do Flask
+    """
+
+    def __init__(self, app):
+        self.cliente = app.test_client()
+
+    def requisitar(self, metodo, caminho, dados=None):
+        return self.cliente.open(caminho, method=metodo, data=dados).status_code
+
+
+class _SemRedirecionamento(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class ClienteHttp:
+    """
+    Faz as requisições por HTTP a um servidor local, guardando os cookies da sessão.
+    Os redirecionamentos não são seguidos, para que cada requisição seja medida sozinha
+    """
+
+    def __init__(self, endereco):
+        self.endereco = endereco
+        self.abridor = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()),
+            _SemRedirecionamento())
+
+    def requisitar(self, metodo, caminho, dados=None):
+        corpo = urllib.parse.urlencode(dados).encode() if dados is not None else None
+        pedido = urllib.request.Request(self.endereco + caminho, data=corpo, method=metodo)
+        try:
+            with self.abridor.open(pedido) as resposta:
+                resposta.read()
+                return resposta.status
+        except urllib.error.HTTPError as erro:
+            erro.read()
+            return erro.code
+
+
+def preparar(usuarios, emprestimos_por_usuario, rounds):
+    """
+    Cria a aplicação sobre uma base sintética nova. Retorna a aplicação e a lista de
+    (cpf, id do empréstimo pago no cenário) dos usuários
+    """
+    caminho = os.path.join(tempfile.mkdtemp(), 'carga.db')
+    # Sem o limite de tentativas, pois todos os usuários simulados fazem login pelo mesmo IP
+    app = criar_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{caminho}', 'WTF_CSRF_ENABLED': False,
+        'LIMITE_ATIVO': False})
+    pool_hash.configurar(rounds, 0, 1, 0)
+    with app.app_context():
+        # Cria o esquema pelas migrações, para que o servidor de produção não avise de
+        # migrações pendentes
+        migrar(db.engine)
+        criados = popular(usuarios, emprestimos_por_usuario)
+        # Empréstimo com mais parcelas restantes de cada usuário, usado nos pagamentos
+        restantes = {}
+        for id_emprestimo, id_usuario, parcelas in db.session.query(
+                Emprestimo.id, Emprestimo.id_usuario, Emprestimo.parcelas_restantes):
+            if parcelas >= restantes.get(id_usuario, (None, -1))[1]:
+                restantes[id_usuario] = (id_emprestimo, parcelas)
+    return app, [(cpf, restantes.get(id_usuario, (0, 0))[0]) for id_usuario, cpf in criados]
+
+
+def cenario(cliente, cpf, id_emprestimo):
+    """
+    Uma iteração de um usuário. Retorna uma lista com (rota, status, segundos)
+    """
+    passos = (
+        ('/login', 'POST', '/login', {'cpf': cpf, 'senha': SENHA_PADRAO}),
+        ('/', 'GET', '/', None),
+        ('/perfil', 'GET', '/perfil', None),
+        ('/perfil/emprestimos', 'GET', '/perfil/emprestimos', None),
+        ('/emprestimo/confirmar', 'POST', '/emprestimo/confirmar', {'valor': '5000', 'parcelas': '12', 'salario': '5000'}),
+        ('/perfil/emprestimos/pagar/<id>', 'POST', f'/perfil/emprestimos/pagar/{id_emprestimo}', None),
+    )
+    medidas = []
+    for rota, metodo, caminho, dados in passos:
+        inicio = time.perf_counter()
+        status = cliente.requisitar(metodo, caminho, dados)
+        medidas.append((rota, status, time.perf_counter() - inicio))
+    cliente.requisitar('GET', '/logout')
+    return medidas
+
+
+def rodar(criar_cliente, contas, iteracoes, threads):
+    latencias = {rota: [] for rota in ROTAS}
+    erros = {rota: 0 for rota in ROTAS}
+    lock = threading.Lock()
+
+    def trabalhador(indice):
+        cliente = criar_cliente()
+        for iteracao in range(iteracoes):
+            cpf, id_emprestimo = contas[(indice + iteracao * threads) % len(contas)]
+            medidas = cenario(cliente, cpf, id_emprestimo)
+            with lock:
+                for rota, status, duracao in medidas:
+                    latencias[rota].append(duracao)
+                    if status >= 400:
+                        erros[rota] += 1
+
+    inicio = time.perf_counter()
+    lista = [threading.Thread(target=trabalhador, args=(i,)) for i in range(threads)]
+    for thread in lista:
+        thread.start()
+    for thread in lista:
+        thread.join()
+    duracao = time.perf_counter() - inicio
+
+    resultado = {}
+    for rota in ROTAS:
+        valores = latencias[rota]
+        resultado[rota] = {
+            'requisicoes': len(valores),
+            'erros': erros[rota],
+            'vazao': round(len(valores) / duracao, 2),
+            'p50_ms': round(percentil(valores, 50) * 1000, 2),
+            'p90_ms': round(percentil(valores, 90) * 1000, 2),
+            'p99_ms': round(percentil(valores, 99) * 1000, 2),
+        }
+    total = sum(len(valores) for valores in latencias.values())
+    return {'duracao_s': round(duracao, 3), 'vazao_total': round(total / duracao, 2), 'rotas': resultado}
+
+
+def rodar_servidor(app, contas, iteracoes, threads):
+    # Sem o log de cada requisição, que pesaria na medição
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    servidor = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=servidor.serve_forever, daemon=True)
+    thread.start()
+    try:
+        endereco = f'http://127.0.0.1:{servidor.server_port}'
+        return rodar(lambda: ClienteHttp(endereco), contas, iteracoes, threads)
+    finally:
+        servidor.shutdown()
+
+
+def _porta_livre():
+    with socket.socket() as conexao:
+        conexao.bind(('127.0.0.1', 0))
+        return conexao.getsockname()[1]
+
+
+def _esperar_porta(porta, processo, timeout=30):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f'O servidor terminou com código {processo.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', porta), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('O servidor não começou a aceitar conexões a tempo')
+
+
+def rodar_producao(app, contas, iteracoes, threads, modo_servidor, processos, threads_servidor, rounds):
+    """
+    Inicia o servidor de produção (servidor.py) em outro processo, sobre a mesma base
+    sintética, e roda o teste por HTTP. O servidor é encerrado ao final
+    """
+    porta = _porta_livre()
+    ambiente = dict(os.environ, DATABASE_URL=app.config['SQLALCHEMY_DATABASE_URI'],
+        BCRYPT_LOG_ROUNDS=str(rounds), HASH_PROCESSOS='0', FILA_ANALISE_TRABALHADORES='0',
+        LIMITE_ATIVO='0')
+    # O formulário de login do cenário é enviado sem o token CSRF
+    codigo = 'import servidor; servidor.main(configuracao={"WTF_CSRF_ENABLED": False})'
+    processo = subprocess.Popen([sys.executable, '-c', codigo, '--modo', modo_servidor,
+        '--endereco', f'127.0.0.1:{porta}', '--processos', str(processos), '--threads', str(threads_servidor)],
+        env=ambiente, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        _esperar_porta(porta, processo)
+        return rodar(lambda: ClienteHttp(f'http://127.0.0.1:{porta}'), contas, iteracoes, threads)
+    finally:
+        processo.terminate()
+        processo.wait()
+
+
+def imprimir(modo, resultado):
+    print(f'\n{modo}: {resultado["vazao_total"]} requisições/s em {resultado["duracao_s"]}s')
+    print(f'{"rota":<32} {"req":>6} {"erros":>6} {"req/s":>8} {"p50 (ms)":>9} {"p90 (ms)":>9} {"p99 (ms)":>9}')
+    for rota, r in resultado['rotas'].items():
+        print(f'{rota:<32} {r["requisicoes"]:>6} {r["erros"]:>6} {r["vazao"]:>8.1f} '
+            f'{r["p50_ms"]:>9.1f} {r["p90_ms"]:>9.1f} {r["p99_ms"]:>9.1f}')
+
+
+def comparar(modo, resultado, baseline, tolerancia):
+    """
+    Compara o resultado com a baseline, imprimindo a variação do p50 e do p99 de cada rota.
+    Retorna a lista de rotas cujo p99 aumentou mais que tolerancia (em %)
+    """
+    regressoes = []
+    print(f'\n{modo}: comparação com a baseline de {baseline["data"]}')
+    for rota, atual in resultado['rotas'].items():
+        anterior = baseline['resultado']['rotas'].get(rota)
+        if not anterior or not anterior['p99_ms']:
+            continue
+        variacao_p50 = (atual['p50_ms'] / anterior['p50_ms'] - 1) * 100 if anterior['p50_ms'] else 0
+        variacao_p99 = (atual['p99_ms'] / anterior['p99_ms'] - 1) * 100
+        regressao = variacao_p99 > tolerancia
+        if regressao:
+            regressoes.append(rota)
+        print(f'{rota:<32} p50 {variacao_p50:>+7.1f}%   p99 {variacao_p99:>+7.1f}%'
+            f'{"   REGRESSÃO" if regressao else ""}')
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga das rotas do site')
+    parser.add_argument('--usuarios', type=int, default=200, help='Usuários criados na base sintética')
+    parser.add_argument('--emprestimos', type=int, default=5, help='Empréstimos por usuário')
+    parser.add_argument('--iteracoes', type=int, default=25, help='Iterações do cenário por thread')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=4, help='Rounds do bcrypt dos usuários sintéticos')
+    parser.add_argument('--modo', choices=('cliente', 'servidor', 'producao', 'ambos', 'todos'), default='ambos',
+        help='ambos: cliente e servidor; todos: cliente, servidor e producao')
+    parser.add_argument('--servidor-modo', choices=('wsgi', 'asgi'), default='wsgi',
+        help='Modo do servidor de produção')
+    parser.add_argument('--processos', type=int, default=4, help='Workers do servidor de produção')
+    parser.add_argument('--threads-servidor', type=int, default=4, help='Threads por worker do servidor de produção')
+    parser.add_argument('--baselines', default=os.path.join(os.path.dirname(__file__), 'baselines'),
+        help='Diretório onde as baselines em JSON são salvas')
+    parser.add_argument('--tolerancia', type=float, default=20, help='Aumento máximo do p99, em %%')
+    parser.add_argument('--nao-salvar', action='store_true', help='Apenas compara, sem salvar o resultado como baseline')
+    args = parser.parse_args()
+
+    parametros = {chave: getattr(args, chave) for chave in ('usuarios', 'emprestimos', 'iteracoes', 'threads', 'rounds')}
+    print(f'{args.usuarios} usuários, {args.emprestimos} empréstimos por usuário, {args.threads} threads, '
+        f'{args.iteracoes} iterações por thread, bcrypt com {args.rounds} rounds')
+    app, contas = preparar(args.usuarios, args.emprestimos, args.rounds)
+
+    modos = {'ambos': ('cliente', 'servidor'), 'todos': ('cliente', 'servidor', 'producao')}.get(args.modo, (args.modo,))
+    regressoes = []
+    for modo in modos:
+        parametros_modo = parametros
+        if modo == 'cliente':
+            resultado = rodar(lambda: ClienteTeste(app), contas, args.iteracoes, args.threads)
+        elif modo == 'servidor':
+            resultado = rodar_servidor(app, contas, args.iteracoes, args.threads)
+        else:
+            parametros_modo = dict(parametros, processos=args.processos, threads_servidor=args.threads_servidor)
+            resultado = rodar_producao(app, contas, args.iteracoes, args.threads, args.servidor_modo,
+                args.processos, args.threads_servidor, args.rounds)
+            modo = f'producao_{args.servidor_modo}'
+        imprimir(modo, resultado)
+
+        caminho = os.path.join(args.baselines, f'carga_{modo}.json')
+        regressoes_modo = []
+        if os.path.exists(caminho):
+            with open(caminho, encoding='utf-8') as arquivo:
+                baseline = json.load(arquivo)
+            if baseline['parametros'] == parametros_modo:
+                regressoes_modo = comparar(modo, resultado, baseline, args.tolerancia)
+            else:
+                print(f'\n{modo}: baseline com outros parâmetros, comparação ignorada')
+            regressoes += regressoes_modo
+        # Uma baseline só é substituída por um resultado sem regressões
+        if not args.nao_salvar and not regressoes_modo:
+            os.makedirs(args.baselines, exist_ok=True)
+            with open(caminho, 'w', encoding='utf-8') as arquivo:
+                json.dump({'data': time.strftime('%Y-%m-%d %H:%M:%S'), 'parametros': parametros_modo,
+                    'resultado': resultado}, arquivo, indent=2, ensure_ascii=False)
+
+    if regressoes:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
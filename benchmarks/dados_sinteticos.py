@@ -0,0 +1,133 @@
+import os
+import random
+import sys
+import time
+from flask import current_app
+from FlaskEmprestimo import criar_app
+from FlaskEmprestimo.extensoes import db, pool_hash
+from FlaskEmprestimo.models import Usuario, Emprestimo, Parcela
+from FlaskEmprestimo.amortizacao import cronograma, cronogramas_em_lote, centavos, PRAZOS_SUPORTADOS
+from FlaskEmprestimo.eventos import reconstruir_saldos
+from FlaskEmprestimo.migracoes import gerar_eventos_iniciais
+
+# Gerador de dados sintéticos para os benchmarks: cria usuários (com CPFs válidos e a
+# mesma senha, cujo hash é calculado uma única vez) e empréstimos com valores e
+# cronogramas coerentes com as regras da aplicação, inseridos em lotes com executemany.
+# A mesma semente sempre gera os mesmos dados.
+# Uso: python -m benchmarks.dados_sinteticos [arquivo .db] [usuários] [empréstimos por usuário]
+
+NOMES = ('Ana', 'Bruno', 'Carla', 'Daniel', 'Eduarda', 'Felipe', 'Gabriela', 'Henrique', 'Isabela', 'João',
+    'Larissa', 'Marcos', 'Natália', 'Otávio', 'Paula', 'Rafael', 'Sofia', 'Thiago', 'Vitória', 'William')
+SOBRENOMES = ('Silva', 'Santos', 'Oliveira', 'Souza', 'Rodrigues', 'Ferreira', 'Alves', 'Pereira', 'Lima',
+    'Gomes', 'Costa', 'Ribeiro', 'Martins', 'Carvalho', 'Almeida', 'Lopes', 'Soares', 'Fernandes')
+
+SENHA_PADRAO = 'senha'
+
+
+def digitos_verificadores(base):
+    """
+    Calcula os dois dígitos verificadores de um CPF a partir dos seus 9 primeiros dígitos
+    """
+    digitos = [int(d) for d in base]
+    for peso_inicial in (10, 11):
+        resto = sum(d * peso for d, peso in zip(digitos, range(peso_inicial, 1, -1))) * 10 % 11
+        digitos.append(0 if resto == 10 else resto)
+    return ''.join(str(d) for d in digitos[9:])
+
+
+def gerar_cpfs(quantidade, aleatorio):
+    """
+    Retorna uma lista de CPFs válidos e distintos
+    """
+    bases = aleatorio.sample(range(1, 10 ** 9), quantidade)
+    return [f'{base:09d}' + digitos_verificadores(f'{base:09d}') for base in bases]
+
+
+def _inserir(tabela, linhas):
+    if linhas:
+        db.session.execute(tabela.insert(), linhas)
+
+
+def popular(usuarios=1000, emprestimos_por_usuario=5, semente=42, senha=SENHA_PADRAO, cronogramas=True,
+        tamanho_lote=10000, eventos=True):
+    """
+    Insere usuários e empréstimos sintéticos no banco de dados da aplicação (deve ser
+    chamada dentro de um contexto da aplicação).
+
+    Parâmetros:
+        senha: Senha de todos os usuários criados, o hash é calculado uma única vez
+
+        cronogramas: Caso False, as parcelas dos empréstimos não são inseridas, o que deixa a
+        geração de bases grandes bem mais rápida
+
+        eventos: Caso True, os eventos dos empréstimos são gerados a partir do seu estado
+        (como na migração do registro de eventos) e os saldos dos usuários reconstruídos
+
+    Retorna uma lista com (id, cpf) de cada usuário criado
+    """
+    aleatorio = random.Random(semente)
+    sistema = current_app.config['AMORTIZACAO_SISTEMA']
+    hash_senha = pool_hash.gerar_hash(senha)
+    primeiro_usuario = (db.session.query(db.func.max(Usuario.id)).scalar() or 0) + 1
+    proximo_emprestimo = (db.session.query(db.func.max(Emprestimo.id)).scalar() or 0) + 1
+
+    criados = list(zip(range(primeiro_usuario, primeiro_usuario + usuarios), gerar_cpfs(usuarios, aleatorio)))
+    valores = {}
+    linhas_usuarios, linhas_emprestimos, dados_cronogramas = [], [], []
+
+    def salvar():
+        _inserir(Usuario.__table__, linhas_usuarios)
+        _inserir(Emprestimo.__table__, linhas_emprestimos)
+        if dados_cronogramas:
+            _inserir(Parcela.__table__, cronogramas_em_lote(dados_cronogramas, sistema))
+        db.session.commit()
+        for lista in (linhas_usuarios, linhas_emprestimos, dados_cronogramas):
+            lista.clear()
+
+    for id_usuario, cpf in criados:
+        linhas_usuarios.append({'id': id_usuario, 'nome': f'{aleatorio.choice(NOMES)} {aleatorio.choice(SOBRENOMES)}',
+            'cpf': cpf, 'email': f'usuario{id_usuario}@exemplo.com', 'senha': hash_senha,
+            'salario_centavos': aleatorio.randrange(1500, 30001, 50) * 100})
+
+        for _ in range(emprestimos_por_usuario):
+            # Valores múltiplos de R$ 500, para que os cronogramas se repitam e sejam
+            # calculados apenas uma vez
+            valor = aleatorio.randrange(1000, 50001, 500)
+            prazo = aleatorio.choice(PRAZOS_SUPORTADOS)
+            if (valor, prazo) not in valores:
+                parcelas = cronograma(valor, prazo, sistema)
+                valores[valor, prazo] = (centavos(sum(p[1] for p in parcelas)), centavos(parcelas[0][1]))
+            valor_a_pagar, valor_parcela = valores[valor, prazo]
+            restantes = aleatorio.randint(0, prazo)
+
+            linhas_emprestimos.append({'id': proximo_emprestimo, 'valor_centavos': valor_a_pagar, 'parcelas': prazo,
+                'valor_parcela_centavos': valor_parcela, 'parcelas_restantes': restantes, 'ativo': restantes > 0,
+                'id_usuario': id_usuario})
+            if cronogramas:
+                dados_cronogramas.append((proximo_emprestimo, valor, prazo))
+            proximo_emprestimo += 1
+
+        if len(linhas_emprestimos) >= tamanho_lote:
+            salvar()
+    salvar()
+    if eventos:
+        gerar_eventos_iniciais(db.engine, tamanho_lote)
+        reconstruir_saldos(db.engine, tamanho_lote)
+    return criados
+
+
+def main(caminho='sintetico.db', usuarios=1000, emprestimos_por_usuario=5):
+    if os.path.exists(caminho):
+        print(f'{caminho} já existe')
+        return
+    app = criar_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.abspath(caminho)}'})
+    inicio = time.perf_counter()
+    with app.app_context():
+        db.create_all()
+        popular(int(usuarios), int(emprestimos_por_usuario))
+    print(f'{usuarios} usuários e {int(usuarios) * int(emprestimos_por_usuario)} empréstimos criados em '
+        f'{time.perf_counter() - inicio:.1f}s, senha de todos os usuários: "{SENHA_PADRAO}"')
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
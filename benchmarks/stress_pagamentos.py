@@ -0,0 +1,69 @@
+import os
+import sys
+import tempfile
+import threading
+from FlaskEmprestimo import criar_app
+from FlaskEmprestimo.extensoes import db
+from FlaskEmprestimo.models import Usuario, Emprestimo, EventoEmprestimo
+from FlaskEmprestimo.pagamentos import pagar_parcelas
+from FlaskEmprestimo.eventos import registrar_originacao, divergencias
+
+# Teste de estresse dos pagamentos de parcelas: várias threads pagam parcelas do mesmo
+# empréstimo ao mesmo tempo, fazendo mais tentativas do que o número de parcelas.
+# Ao final, a quantidade de pagamentos aceitos deve ser exatamente o número de parcelas,
+# e parcelas_restantes deve ser 0 (nenhuma atualização perdida e nenhum valor negativo).
+# O registro de eventos deve ter um evento por pagamento aceito, e o saldo projetado do
+# usuário deve continuar igual ao calculado a partir do empréstimo.
+# Uso: python -m benchmarks.stress_pagamentos [parcelas] [threads] [tentativas por thread]
+
+
+def main(parcelas=36, threads=8, tentativas=10):
+    caminho = os.path.join(tempfile.mkdtemp(), 'stress_pagamentos.db')
+    app = criar_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{caminho}'})
+
+    with app.app_context():
+        db.create_all()
+        usuario = Usuario(nome='Estresse', cpf='00000000191', email='estresse@exemplo.com', senha='-', salario=5000)
+        db.session.add(usuario)
+        db.session.commit()
+        emprestimo = Emprestimo(valor=parcelas * 100, parcelas=parcelas, valor_parcela=100,
+            parcelas_restantes=parcelas, ativo=True, id_usuario=usuario.id)
+        db.session.add(emprestimo)
+        db.session.flush()
+        registrar_originacao([emprestimo])
+        db.session.commit()
+        id_usuario, id_emprestimo = usuario.id, emprestimo.id
+
+    aceitos = []
+    barreira = threading.Barrier(threads)
+
+    def trabalhador():
+        with app.app_context():
+            barreira.wait()
+            for _ in range(tentativas):
+                if pagar_parcelas(id_emprestimo, id_usuario):
+                    aceitos.append(1)
+
+    lista = [threading.Thread(target=trabalhador) for _ in range(threads)]
+    for thread in lista:
+        thread.start()
+    for thread in lista:
+        thread.join()
+
+    with app.app_context():
+        emprestimo = Emprestimo.query.get(id_emprestimo)
+        print(f'Tentativas: {threads * tentativas}, pagamentos aceitos: {len(aceitos)}, '
+            f'parcelas restantes: {emprestimo.parcelas_restantes}, ativo: {emprestimo.ativo}')
+        esperado = min(parcelas, threads * tentativas)
+        assert len(aceitos) == esperado, 'Quantidade de pagamentos aceitos incorreta'
+        assert emprestimo.parcelas_restantes == parcelas - esperado, 'Atualização perdida'
+        assert emprestimo.ativo == (emprestimo.parcelas_restantes > 0)
+        eventos = EventoEmprestimo.query.filter_by(id_emprestimo=id_emprestimo, tipo='parcela_paga').count()
+        assert eventos == esperado, 'Quantidade de eventos de pagamento incorreta'
+        assert not divergencias(), 'Saldo projetado diferente do empréstimo'
+    print('OK: nenhuma atualização perdida')
+
+
+if __name__ == '__main__':
+    argumentos = [int(a) for a in sys.argv[1:]]
+    main(*argumentos)
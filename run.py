@@ -1,6 +1,8 @@
-from FlaskEmprestimo import app
+from FlaskEmprestimo import criar_app
+
+app = criar_app()
 
 if __name__ == "__main__" :
     app.run(debug=True)
 
-# venv\Scripts\activate
\ No newline at end of file
+# venv\Scripts\activate
@@ -0,0 +1,150 @@
+import argparse
+import logging
+import os
+from FlaskEmprestimo import criar_app
+from FlaskEmprestimo.extensoes import db, cache_paginas
+from FlaskEmprestimo.fila_analise import fila_analise
+from FlaskEmprestimo.migracoes import pendentes
+
+# Servidor de produção. O run.py usa o servidor de desenvolvimento do Flask, que atende
+# as requisições num único processo. Este script roda a aplicação no gunicorn, com vários
+# processos (workers) e várias threads por processo, em um de dois modos:
+#
+#   wsgi: workers gthread do gunicorn, que atendem cada requisição numa thread
+#
+#   asgi: workers do uvicorn (pacotes uvicorn e asgiref), com a aplicação adaptada para
+#   ASGI. As requisições continuam sendo executadas em threads, no pool do asgiref
+#
+# A aplicação é criada (criar_app) uma única vez no processo principal, antes dos workers
+# serem criados por fork, então o código importado é compartilhado entre os workers.
+# Como o código já está carregado, o SIGHUP apenas recria os workers graciosamente (as
+# requisições em andamento terminam antes). Para carregar um código novo sem derrubar
+# as conexões, envie SIGUSR2 ao processo principal (que inicia um novo processo principal
+# com o código atual) e então SIGTERM ao processo antigo, usando o arquivo de PID.
+# Uso: python servidor.py --help
+
+logger = logging.getLogger(__name__)
+
+
+def aplicacao_asgi(app):
+    """
+    Retorna a aplicação adaptada para ASGI
+    """
+    from asgiref.wsgi import WsgiToAsgi
+    return WsgiToAsgi(app)
+
+
+def apos_fork(app):
+    """
+    Retorna a função executada em cada worker logo após o fork. As conexões abertas pelo
+    processo principal não podem ser compartilhadas, e o cache de páginas em memória de
+    cada worker precisa da sua própria época para que as ETags de workers diferentes não
+    coincidam
+    """
+    def gancho(servidor, worker):
+        with app.app_context():
+            db.engine.dispose()
+        cache_paginas.init_app(app)
+    return gancho
+
+
+def ao_sair(servidor, worker):
+    """
+    Executado quando um worker termina, espera os trabalhadores da fila de análise
+    terminarem o lote atual
+    """
+    fila_analise.encerrar()
+
+
+def verificar_configuracao(app, processos):
+    """
+    Avisa sobre configurações que não funcionam corretamente com vários processos e sobre
+    migrações do banco de dados ainda não aplicadas
+    """
+    with app.app_context():
+        if pendentes():
+            logger.warning('O banco de dados possui migrações pendentes, execute "flask migrar"')
+    if processos > 1 and not app.config['CACHE_PAGINAS_REDIS_URL']:
+        logger.warning('O cache de páginas em memória não é compartilhado entre os %d workers: uma '
+            'alteração feita num worker não invalida o cache dos outros. Configure '
+            'CACHE_PAGINAS_REDIS_URL', processos)
+
+
+def opcoes_gunicorn(app, modo, endereco, processos, threads, timeout, timeout_gracioso, max_requisicoes,
+        arquivo_pid=None):
+    opcoes = {
+        'bind': endereco,
+        'workers': processos,
+        'threads': threads,
+        'timeout': timeout,
+        'graceful_timeout': timeout_gracioso,
+        'max_requests': max_requisicoes,
+        'max_requests_jitter': max_requisicoes // 10,
+        'preload_app': True,
+        'pidfile': arquivo_pid,
+        'post_fork': apos_fork(app),
+        'worker_exit': ao_sair,
+    }
+    if modo == 'asgi':
+        opcoes['worker_class'] = 'uvicorn.workers.UvicornWorker'
+    else:
+        opcoes['worker_class'] = 'gthread'
+    return opcoes
+
+
+def servir(app, modo, **opcoes):
+    """
+    Inicia o gunicorn com a aplicação já importada e bloqueia até que ele termine
+    """
+    from gunicorn.app.base import BaseApplication
+
+    if modo == 'asgi':
+        # Tamanho do pool de threads em que o asgiref executa a aplicação WSGI
+        os.environ['ASGI_THREADS'] = str(opcoes['threads'])
+        aplicacao = aplicacao_asgi(app)
+    else:
+        aplicacao = app
+    configuracao = opcoes_gunicorn(app, modo, **opcoes)
+
+    class Servidor(BaseApplication):
+        def load_config(self):
+            for chave, valor in configuracao.items():
+                if valor is not None:
+                    self.cfg.set(chave, valor)
+
+        def load(self):
+            return aplicacao
+
+    verificar_configuracao(app, opcoes['processos'])
+    Servidor().run()
+
+
+def main(argumentos=None, configuracao=None):
+    """
+    Cria a aplicação, com as configurações de configuracao (ver criar_app()), e inicia o
+    servidor com as opções da linha de comando
+    """
+    app = criar_app(configuracao)
+    config = app.config
+    parser = argparse.ArgumentParser(description='Servidor de produção da aplicação')
+    parser.add_argument('--modo', choices=('wsgi', 'asgi'), default=config['SERVIDOR_MODO'])
+    parser.add_argument('--endereco', default=config['SERVIDOR_ENDERECO'], help='host:porta')
+    parser.add_argument('--processos', type=int, default=config['SERVIDOR_PROCESSOS'], help='Quantidade de workers')
+    parser.add_argument('--threads', type=int, default=config['SERVIDOR_THREADS'], help='Threads por worker')
+    parser.add_argument('--timeout', type=int, default=config['SERVIDOR_TIMEOUT'],
+        help='Tempo, em segundos, após o qual um worker sem resposta é reiniciado')
+    parser.add_argument('--timeout-gracioso', type=int, default=config['SERVIDOR_TIMEOUT_GRACIOSO'],
+        help='Tempo, em segundos, que um worker tem para terminar as requisições ao ser reiniciado')
+    parser.add_argument('--max-requisicoes', type=int, default=config['SERVIDOR_MAX_REQUISICOES'],
+        help='Requisições após as quais um worker é reiniciado (0 desativa)')
+    parser.add_argument('--arquivo-pid', default=None, help='Arquivo onde o PID do processo principal é salvo')
+    args = parser.parse_args(argumentos)
+
+    logging.basicConfig(level=logging.INFO)
+    servir(app, args.modo, endereco=args.endereco, processos=args.processos, threads=args.threads,
+        timeout=args.timeout, timeout_gracioso=args.timeout_gracioso, max_requisicoes=args.max_requisicoes,
+        arquivo_pid=args.arquivo_pid)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import pytest
+from FlaskEmprestimo import criar_app
+from FlaskEmprestimo.extensoes import db, pool_hash, cache_usuarios
+from FlaskEmprestimo.models import Usuario
+from FlaskEmprestimo.originacao import simular_emprestimo, originar_emprestimo
+
+# Fixtures compartilhadas pelos testes. Cada teste recebe uma aplicação nova sobre um banco
+# SQLite temporário, com o hash de senhas calculado no próprio processo, sem os
+# trabalhadores da fila de análise e sem o limite de tentativas de login.
+
+SENHA = 'senha'
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = criar_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "teste.db"}',
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'BCRYPT_LOG_ROUNDS': 4,
+        'HASH_PROCESSOS': 0,
+        'FILA_ANALISE_TRABALHADORES': 0,
+        'LIMITE_ATIVO': False,
+        'POLITICAS_INTERVALO': 0,
+    })
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+    # O cache de identidades é compartilhado por todas as aplicações do processo
+    cache_usuarios.limpar()
+
+
+@pytest.fixture
+def cliente(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def criar_usuario(app):
+    """
+    Retorna uma função que cadastra um usuário com a SENHA e retorna o seu id
+    """
+    def criar(cpf='52998224725', salario=5000, email=None):
+        usuario = Usuario(nome='Teste', cpf=cpf, email=email or f'{cpf}@exemplo.com',
+            senha=pool_hash.gerar_hash(SENHA), salario=salario)
+        db.session.add(usuario)
+        db.session.commit()
+        return usuario.id
+    return criar
+
+
+@pytest.fixture
+def criar_emprestimo(app):
+    """
+    Retorna uma função que cria um empréstimo pelas mesmas regras da confirmação pelo site,
+    com o cronograma salvo, e retorna o seu id
+    """
+    def criar(id_usuario, valor=5000, parcelas=12):
+        salario = db.session.query(Usuario.salario_centavos).filter(Usuario.id == id_usuario).scalar() / 100
+        return originar_emprestimo(simular_emprestimo(valor, parcelas, salario), id_usuario)
+    return criar
+
+
+@pytest.fixture
+def logar(cliente):
+    """
+    Retorna uma função que faz login pelo site com o CPF informado e a SENHA
+    """
+    def logar(cpf='52998224725'):
+        resposta = cliente.post('/login', data={'cpf': cpf, 'senha': SENHA})
+        assert resposta.status_code == 302
+        return cliente
+    return logar
@@ -0,0 +1,74 @@
+from decimal import Decimal
+import pytest
+from FlaskEmprestimo.amortizacao import (cronograma, cronogramas_em_lote, dinheiro, CUSTO_TOTAL,
+    PRAZOS_SUPORTADOS, TAXAS_MENSAIS)
+from FlaskEmprestimo.consultas import saldos_devedores, proximas_parcelas
+from FlaskEmprestimo.pagamentos import pagar_parcelas
+
+
+def test_price_soma_o_custo_total():
+    parcelas = cronograma(5000, 12)
+
+    assert sum(parcela for _, parcela, *_ in parcelas) == Decimal('5750.01')
+
+
+@pytest.mark.parametrize('prazo', PRAZOS_SUPORTADOS)
+@pytest.mark.parametrize('valor', (1000, 5000, '12345.67'))
+def test_price_parcelas_iguais(valor, prazo):
+    parcelas = cronograma(valor, prazo)
+
+    assert len(parcelas) == prazo
+    assert sum(amortizacao for *_, amortizacao, _ in parcelas) == dinheiro(valor)
+    assert parcelas[-1][4] == 0
+    assert len({parcela for _, parcela, *_ in parcelas[:-1]}) == 1
+    # A última parcela só difere das outras pelo arredondamento
+    assert abs(parcelas[-1][1] - parcelas[0][1]) <= Decimal('0.01') * prazo
+    total = sum(parcela for _, parcela, *_ in parcelas)
+    assert abs(total - dinheiro(valor) * (1 + CUSTO_TOTAL)) <= Decimal('0.01') * prazo
+
+
+@pytest.mark.parametrize('prazo', PRAZOS_SUPORTADOS)
+def test_sac_amortizacoes_iguais(prazo):
+    parcelas = cronograma(5000, prazo, 'sac')
+    amortizacoes = [amortizacao for *_, amortizacao, _ in parcelas]
+
+    assert sum(amortizacoes) == Decimal('5000.00')
+    assert len(set(amortizacoes[:-1])) == 1
+    assert parcelas[-1][4] == 0
+    # No SAC os juros, e com eles as parcelas, diminuem a cada mês
+    assert all(anterior[1] >= seguinte[1] for anterior, seguinte in zip(parcelas, parcelas[1:]))
+    assert sum(parcela for _, parcela, *_ in parcelas) < sum(parcela for _, parcela, *_ in cronograma(5000, prazo))
+
+
+def test_taxa_informada():
+    padrao = cronograma(5000, 12)
+
+    assert cronograma(5000, 12, taxa=TAXAS_MENSAIS[12]) == padrao
+    assert cronograma(5000, 12, taxa='0.02') != padrao
+
+
+def test_sistema_desconhecido():
+    with pytest.raises(ValueError):
+        cronograma(5000, 12, 'americano')
+
+
+def test_cronogramas_em_lote_em_centavos():
+    linhas = cronogramas_em_lote([(1, 5000, 12), (2, 5000, 12), (3, 1000, 18)])
+
+    assert len(linhas) == 12 + 12 + 18
+    assert sum(linha['valor'] for linha in linhas if linha['id_emprestimo'] == 1) == 575001
+    assert sum(linha['amortizacao'] for linha in linhas if linha['id_emprestimo'] == 3) == 100000
+
+
+def test_saldo_devedor_igual_as_parcelas_restantes(criar_usuario, criar_emprestimo):
+    id_usuario = criar_usuario()
+    id_emprestimo = criar_emprestimo(id_usuario, 5000, 12)
+    parcelas = cronograma(5000, 12)
+
+    assert saldos_devedores([id_emprestimo]) == {id_emprestimo: 575001}
+    assert pagar_parcelas(id_emprestimo, id_usuario)
+
+    restantes = sum(parcela for _, parcela, *_ in parcelas[1:])
+    assert saldos_devedores([id_emprestimo])[id_emprestimo] == restantes * 100
+    assert proximas_parcelas([id_emprestimo])[id_emprestimo]['saldo'] == float(restantes)
+    assert proximas_parcelas([id_emprestimo])[id_emprestimo]['numero'] == 2
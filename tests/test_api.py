@@ -0,0 +1,197 @@
+import gzip
+import json
+import pytest
+from FlaskEmprestimo import api as modulo_api
+from FlaskEmprestimo.api import gerar_token, ler_token
+from FlaskEmprestimo.models import Emprestimo
+from tests.conftest import SENHA
+
+
+@pytest.fixture
+def autenticar(cliente):
+    """
+    Retorna uma função que obtém um token pela API e retorna o cabeçalho Authorization
+    """
+    def autenticar(cpf='52998224725'):
+        resposta = cliente.post('/api/v1/tokens', json={'cpf': cpf, 'senha': SENHA})
+        assert resposta.status_code == 201
+        return {'Authorization': f'Bearer {resposta.get_json()["token"]}'}
+    return autenticar
+
+
+def test_token(app, cliente, criar_usuario):
+    id_usuario = criar_usuario()
+
+    resposta = cliente.post('/api/v1/tokens', json={'cpf': '529.982.247-25', 'senha': SENHA})
+
+    assert resposta.status_code == 201
+    assert resposta.get_json()['expira_em'] == app.config['API_TOKEN_VALIDADE']
+    assert ler_token(resposta.get_json()['token']) == id_usuario
+    assert 'Set-Cookie' not in resposta.headers
+
+
+@pytest.mark.parametrize('corpo, status', (
+    ({'cpf': '52998224725', 'senha': 'errada'}, 401),
+    ({'cpf': '11144477735', 'senha': SENHA}, 401),
+    ([], 400),
+))
+def test_token_recusado(cliente, criar_usuario, corpo, status):
+    criar_usuario()
+
+    resposta = cliente.post('/api/v1/tokens', json=corpo)
+
+    assert resposta.status_code == status
+    assert 'erro' in resposta.get_json()
+
+
+def test_token_expirado_ou_invalido(app, cliente, criar_usuario):
+    token = gerar_token(criar_usuario())
+
+    def ofertas(cabecalho=None):
+        # O usuário autenticado fica em g, que pertence ao contexto da aplicação aberto pela
+        # fixture app, então cada requisição é feita num contexto próprio
+        with app.app_context():
+            return cliente.get('/api/v1/ofertas', headers={'Authorization': cabecalho} if cabecalho else {})
+
+    assert ofertas(f'Bearer {token}').status_code == 200
+    assert ofertas().status_code == 401
+    assert ofertas(f'Bearer {token}x').status_code == 401
+    assert ofertas(token).status_code == 401
+    app.config['API_TOKEN_VALIDADE'] = -1
+    resposta = ofertas(f'Bearer {token}')
+    assert resposta.status_code == 401
+    assert resposta.get_json() == {'erro': 'Token ausente, inválido ou expirado'}
+
+
+def test_simulacao(cliente, criar_usuario, autenticar):
+    criar_usuario()
+    cabecalho = autenticar()
+
+    resposta = cliente.post('/api/v1/simulacoes', json={'valor': 5000, 'parcelas': 12}, headers=cabecalho)
+
+    assert resposta.status_code == 200
+    assert resposta.get_json()['parcelas'] == 12
+    assert Emprestimo.query.count() == 0
+
+
+@pytest.mark.parametrize('corpo, status', (
+    ({'valor': 5000, 'parcelas': 12.9}, 400),
+    ({'valor': 5000, 'parcelas': '12.5'}, 400),
+    ({'valor': 5000, 'parcelas': True}, 400),
+    ({'valor': 'abc', 'parcelas': 12}, 400),
+    ({'valor': 5000}, 400),
+    ([5000, 12], 400),
+    ({'valor': 5000, 'parcelas': 13}, 422),
+    ({'valor': 10 ** 6, 'parcelas': 12}, 422),
+))
+def test_simulacao_invalida(cliente, criar_usuario, autenticar, corpo, status):
+    criar_usuario()
+
+    resposta = cliente.post('/api/v1/simulacoes', json=corpo, headers=autenticar())
+
+    assert resposta.status_code == status
+    assert 'erro' in resposta.get_json()
+
+
+def test_simulacao_aceita_inteiros_como_float(cliente, criar_usuario, autenticar):
+    criar_usuario()
+
+    resposta = cliente.post('/api/v1/simulacoes', json={'valor': 5000, 'parcelas': 12.0}, headers=autenticar())
+
+    assert resposta.status_code == 200
+    assert resposta.get_json()['parcelas'] == 12
+
+
+def test_criar_e_listar_emprestimos(cliente, criar_usuario, autenticar):
+    criar_usuario()
+    cabecalho = autenticar()
+    criados = []
+    for parcelas in (12, 18, 24, 12, 36):
+        resposta = cliente.post('/api/v1/emprestimos', json={'valor': 2000, 'parcelas': parcelas}, headers=cabecalho)
+        assert resposta.status_code == 201
+        criados.append(resposta.get_json()['id'])
+
+    vistos, cursor = [], None
+    while True:
+        resposta = cliente.get('/api/v1/emprestimos', query_string={'limite': 2, 'apos': cursor or ''},
+            headers=cabecalho)
+        pagina = resposta.get_json()
+        assert len(pagina['emprestimos']) <= 2
+        vistos += [emprestimo['id'] for emprestimo in pagina['emprestimos']]
+        cursor = pagina['proximo_cursor']
+        if cursor is None:
+            break
+
+    assert sorted(vistos) == sorted(criados)
+    assert len(vistos) == len(set(vistos))
+
+
+def test_pagamento(cliente, criar_usuario, criar_emprestimo, autenticar):
+    id_emprestimo = criar_emprestimo(criar_usuario())
+    cabecalho = autenticar()
+    url = f'/api/v1/emprestimos/{id_emprestimo}/pagamentos'
+
+    resposta = cliente.post(url, headers=cabecalho)
+    assert resposta.status_code == 200
+    assert resposta.get_json()['parcelas_restantes'] == 11
+
+    resposta = cliente.post(url, json={'parcelas': 3}, headers=cabecalho)
+    assert resposta.get_json()['parcelas_restantes'] == 8
+
+    assert cliente.post(url, json={'parcelas': 9}, headers=cabecalho).status_code == 409
+    assert cliente.post(url, json={'parcelas': 8}, headers=cabecalho).get_json()['ativo'] is False
+    assert cliente.post(url, headers=cabecalho).status_code == 409
+
+
+@pytest.mark.parametrize('corpo', ({'parcelas': 0}, {'parcelas': -1}, {'parcelas': 1.5}, {'parcelas': 'a'}, [1]))
+def test_pagamento_invalido(cliente, criar_usuario, criar_emprestimo, autenticar, corpo):
+    id_emprestimo = criar_emprestimo(criar_usuario())
+
+    resposta = cliente.post(f'/api/v1/emprestimos/{id_emprestimo}/pagamentos', json=corpo, headers=autenticar())
+
+    assert resposta.status_code == 400
+    assert Emprestimo.query.get(id_emprestimo).parcelas_restantes == 12
+
+
+def test_pagamento_de_outro_usuario(cliente, criar_usuario, criar_emprestimo, autenticar):
+    criar_usuario()
+    id_emprestimo = criar_emprestimo(criar_usuario(cpf='11144477735'))
+
+    resposta = cliente.post(f'/api/v1/emprestimos/{id_emprestimo}/pagamentos', headers=autenticar())
+
+    assert resposta.status_code == 404
+    assert cliente.post('/api/v1/emprestimos/999/pagamentos', headers=autenticar()).status_code == 404
+    assert Emprestimo.query.get(id_emprestimo).parcelas_restantes == 12
+
+
+def test_compressao(app, cliente, criar_usuario, criar_emprestimo, autenticar):
+    id_usuario = criar_usuario()
+    for _ in range(30):
+        criar_emprestimo(id_usuario)
+    cabecalho = autenticar()
+
+    sem_gzip = cliente.get('/api/v1/emprestimos?limite=30', headers=cabecalho)
+    com_gzip = cliente.get('/api/v1/emprestimos?limite=30', headers={**cabecalho, 'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in sem_gzip.headers
+    assert com_gzip.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in com_gzip.headers['Vary']
+    assert json.loads(gzip.decompress(com_gzip.get_data())) == sem_gzip.get_json()
+
+    # Respostas pequenas não são comprimidas
+    pequena = cliente.get('/api/v1/emprestimos?limite=1', headers={**cabecalho, 'Accept-Encoding': 'gzip'})
+    assert len(pequena.get_data()) < app.config['API_COMPRESSAO_MINIMO']
+    assert 'Content-Encoding' not in pequena.headers
+
+
+def test_codificacao_json():
+    dados = {'titulo': 'Está querendo trocar de carro?', 'valor': 1.5, 'lista': [1, None]}
+
+    assert json.loads(modulo_api._codificar(dados)) == dados
+
+
+def test_codificacao_com_orjson():
+    orjson = pytest.importorskip('orjson')
+    dados = {'titulo': 'Está querendo trocar de carro?', 'valor': 1.5}
+
+    assert orjson.loads(modulo_api._codificar(dados)) == dados
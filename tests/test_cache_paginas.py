@@ -0,0 +1,88 @@
+from FlaskEmprestimo.cache_paginas import BackendMemoria
+from FlaskEmprestimo.extensoes import db, cache_paginas, cache_usuarios
+from FlaskEmprestimo.models import Usuario
+from FlaskEmprestimo.pagamentos import pagar_parcelas
+
+# Páginas com mensagens flash pendentes nunca recebem 304, então cada teste visita a página
+# uma vez para consumir as mensagens do login (ou da ação anterior) antes de comparar as ETags.
+
+
+def test_perfil_responde_304_enquanto_nada_muda(criar_usuario, logar):
+    criar_usuario()
+    cliente = logar()
+    cliente.get('/perfil')
+    resposta = cliente.get('/perfil')
+    etag = resposta.headers['ETag']
+
+    assert resposta.status_code == 200
+    assert cliente.get('/perfil', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_alteracao_do_salario_gera_nova_pagina(criar_usuario, logar):
+    criar_usuario(salario=5000)
+    cliente = logar()
+    cliente.get('/perfil')
+    antes = cliente.get('/perfil')
+    assert 'Renda mensal: 5000' in antes.get_data(as_text=True)
+
+    cliente.post('/emprestimo/confirmar', data={'valor': 5000, 'parcelas': 12, 'salario': 7000})
+    cliente.get('/perfil')
+    depois = cliente.get('/perfil', headers={'If-None-Match': antes.headers['ETag']})
+
+    assert depois.status_code == 200
+    assert depois.headers['ETag'] != antes.headers['ETag']
+    assert 'Renda mensal: 7000' in depois.get_data(as_text=True)
+
+
+def test_pagamento_gera_nova_pagina(criar_usuario, criar_emprestimo, logar):
+    id_usuario = criar_usuario()
+    id_emprestimo = criar_emprestimo(id_usuario)
+    cliente = logar()
+    cliente.get('/perfil/emprestimos')
+    antes = cliente.get('/perfil/emprestimos')
+
+    assert cliente.post(f'/perfil/emprestimos/pagar/{id_emprestimo}').status_code == 302
+    cliente.get('/perfil/emprestimos')
+    depois = cliente.get('/perfil/emprestimos', headers={'If-None-Match': antes.headers['ETag']})
+
+    assert depois.status_code == 200
+    assert depois.get_data(as_text=True) != antes.get_data(as_text=True)
+
+
+def test_paginas_de_outro_usuario_nao_sao_invalidadas(criar_usuario, criar_emprestimo, logar):
+    id_usuario = criar_usuario()
+    outro = criar_usuario(cpf='11144477735')
+    id_emprestimo = criar_emprestimo(outro)
+    cliente = logar()
+    cliente.get('/perfil')
+    etag = cliente.get('/perfil').headers['ETag']
+
+    assert pagar_parcelas(id_emprestimo, outro)
+    assert cliente.get('/perfil', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_backend_memoria_respeita_o_tamanho_maximo():
+    backend = BackendMemoria(tamanho_max=100)
+    for i in range(10):
+        backend.set(f'pagina:{i}', 'x' * 30)
+
+    assert backend.get('pagina:9') == 'x' * 30
+    assert backend.get('pagina:0') is None
+    assert backend.incr('versao:1') == 1 and backend.incr('versao:1') == 2
+
+
+def test_identidade_desatualizada_nao_substitui_a_pagina(criar_usuario, logar):
+    id_usuario = criar_usuario(salario=5000)
+    cliente = logar()
+    cliente.get('/')
+    # Outro processo salva o novo salário e invalida as páginas compartilhadas, mas a
+    # identidade em cache neste processo ainda possui o salário anterior
+    Usuario.query.filter_by(id=id_usuario).update({Usuario.salario_centavos: 700000})
+    db.session.commit()
+    cache_paginas.nova_versao(id_usuario)
+    antiga = cliente.get('/').get_data(as_text=True)
+    assert 'salario=5000' in antiga
+
+    cache_usuarios.invalidar(id_usuario)
+
+    assert 'salario=7000' in cliente.get('/').get_data(as_text=True)
@@ -0,0 +1,58 @@
+import pytest
+from FlaskEmprestimo.extensoes import pool_hash
+from FlaskEmprestimo.models import Usuario
+from FlaskEmprestimo.cadastros import cadastrar_usuario, campos_em_uso, CadastroDuplicadoError
+
+CADASTRO = {'nome': 'Teste', 'cpf': '529.982.247-25', 'email': ' Teste@Exemplo.com ', 'senha': 'senha',
+    'confirmar_senha': 'senha', 'salario': '5000'}
+
+
+def test_cadastro_normalizado(cliente):
+    resposta = cliente.post('/cadastro', data=CADASTRO)
+
+    assert resposta.status_code == 302
+    usuario = Usuario.query.one()
+    assert (usuario.cpf, usuario.email) == ('52998224725', 'teste@exemplo.com')
+
+
+def test_cadastro_repetido_recusado_pelo_formulario(cliente, criar_usuario):
+    criar_usuario(email='teste@exemplo.com')
+
+    resposta = cliente.post('/cadastro', data=CADASTRO)
+
+    assert resposta.status_code == 200
+    assert 'CPF já cadastrado.' in resposta.get_data(as_text=True)
+    assert 'E-mail já cadastrado.' in resposta.get_data(as_text=True)
+    assert Usuario.query.count() == 1
+
+
+def test_cadastro_simultaneo_recusado_pelo_banco(monkeypatch, cliente, criar_usuario):
+    gerar_hash = pool_hash.gerar_hash
+
+    def cadastrar_outro_antes(senha):
+        # Outro cadastro com o mesmo CPF é salvo depois da validação do formulário (que
+        # verificou com EXISTS que o CPF estava livre) e antes do INSERT
+        monkeypatch.setattr(pool_hash, 'gerar_hash', gerar_hash)
+        criar_usuario(email='outro@exemplo.com')
+        return gerar_hash(senha)
+
+    monkeypatch.setattr(pool_hash, 'gerar_hash', cadastrar_outro_antes)
+    resposta = cliente.post('/cadastro', data=CADASTRO)
+
+    assert resposta.status_code == 200
+    assert 'CPF já cadastrado.' in resposta.get_data(as_text=True)
+    assert 'E-mail já cadastrado.' not in resposta.get_data(as_text=True)
+    assert [usuario.email for usuario in Usuario.query] == ['outro@exemplo.com']
+
+
+def test_cadastrar_usuario_duplicado(criar_usuario):
+    criar_usuario(email='teste@exemplo.com')
+
+    with pytest.raises(CadastroDuplicadoError) as erro:
+        cadastrar_usuario('Outro', '529.982.247-25', 'TESTE@exemplo.com', 'x', 1000)
+
+    assert erro.value.campos == ('cpf', 'email')
+    # A transação desfeita não impede os próximos cadastros
+    cadastrar_usuario('Outro', '11144477735', 'outro@exemplo.com', 'x', 1000)
+    assert Usuario.query.count() == 2
+    assert campos_em_uso('111.444.777-35', 'x@exemplo.com') == ('cpf',)
@@ -0,0 +1,70 @@
+import pytest
+from FlaskEmprestimo.models import Emprestimo
+from FlaskEmprestimo.consultas import pagina_emprestimos, ler_cursor
+from FlaskEmprestimo.pagamentos import pagar_parcelas
+
+
+@pytest.fixture
+def historico(criar_usuario, criar_emprestimo):
+    """
+    Cria um usuário com 23 empréstimos em prazos diferentes, parte deles com parcelas pagas,
+    para que vários empréstimos tenham as mesmas parcelas_restantes
+    """
+    id_usuario = criar_usuario()
+    outro = criar_usuario(cpf='11144477735')
+    for i in range(23):
+        id_emprestimo = criar_emprestimo(id_usuario, parcelas=(12, 18, 24)[i % 3])
+        if i % 4 == 0:
+            assert pagar_parcelas(id_emprestimo, id_usuario, 6)
+        criar_emprestimo(outro)
+    return id_usuario
+
+
+def percorrer(id_usuario, tamanho, colunas=None):
+    paginas, cursor = [], None
+    while True:
+        pagina, cursor = pagina_emprestimos(id_usuario, cursor, tamanho, colunas)
+        paginas.append(pagina)
+        if cursor is None:
+            return paginas
+
+
+@pytest.mark.parametrize('tamanho', (1, 4, 23, 50))
+def test_paginas_cobrem_o_historico_em_ordem(historico, tamanho):
+    esperado = [(e.parcelas_restantes, e.id) for e in
+        Emprestimo.query.filter_by(id_usuario=historico).order_by(Emprestimo.parcelas_restantes, Emprestimo.id)]
+
+    paginas = percorrer(historico, tamanho)
+
+    assert [(e.parcelas_restantes, e.id) for pagina in paginas for e in pagina] == esperado
+    assert all(len(pagina) == tamanho for pagina in paginas[:-1])
+    assert 0 < len(paginas[-1]) <= tamanho
+    assert len(paginas) == -(-23 // tamanho)
+
+
+def test_paginas_com_colunas(historico):
+    completas = percorrer(historico, 5)
+    colunas = percorrer(historico, 5, ('id', 'parcelas_restantes', 'valor'))
+
+    assert [[(e.id, e.parcelas_restantes) for e in pagina] for pagina in completas] == \
+        [[(linha.id, linha.parcelas_restantes) for linha in pagina] for pagina in colunas]
+
+
+def test_pagina_sem_emprestimos(criar_usuario):
+    assert pagina_emprestimos(criar_usuario()) == ([], None)
+
+
+@pytest.mark.parametrize('cursor, esperado', (
+    ('6-10', (6, 10)),
+    (None, None),
+    ('', None),
+    ('abc', None),
+    ('6-x', None),
+    ('1-2-3', None),
+))
+def test_ler_cursor(cursor, esperado):
+    assert ler_cursor(cursor) == esperado
+
+
+def test_cursor_invalido_volta_a_primeira_pagina(historico):
+    assert pagina_emprestimos(historico, 'abc', 5) == pagina_emprestimos(historico, None, 5)
@@ -0,0 +1,89 @@
+import pytest
+from FlaskEmprestimo.extensoes import db
+from FlaskEmprestimo.models import SaldoUsuario, EventoEmprestimo
+from FlaskEmprestimo.eventos import reconstruir_saldos, divergencias, COLUNAS_SALDO
+from FlaskEmprestimo.consultas import resumo_emprestimos, calcular_resumo_emprestimos
+from FlaskEmprestimo.fila_analise import FilaAnalise, avaliar_manualmente
+from FlaskEmprestimo.originacao import importar_emprestimos
+from FlaskEmprestimo.pagamentos import pagar_parcelas, pagar_em_lote
+
+
+def projecao():
+    return {linha.id_usuario: tuple(getattr(linha, coluna) for coluna in COLUNAS_SALDO)
+        for linha in SaldoUsuario.query.order_by(SaldoUsuario.id_usuario)}
+
+
+@pytest.fixture(params=('sqlite', 'outros'))
+def movimentos(request, monkeypatch, criar_usuario, criar_emprestimo):
+    """
+    Registra, pelas funções da aplicação, originações, decisões automáticas e manuais da
+    fila de análise, importações e pagamentos avulsos e em lote. Com 'outros', a projeção
+    é atualizada com UPDATE seguido de INSERT, como nos bancos sem INSERT ... ON CONFLICT
+    """
+    if request.param == 'outros':
+        monkeypatch.setattr(db.engine.dialect, 'name', 'outros')
+    ids = {}
+    for cpf, salario in (('52998224725', 5000), ('11144477735', 900), ('39053344705', 1500),
+            ('87748248800', 1000)):
+        ids[cpf] = criar_usuario(cpf=cpf, salario=salario)
+
+    usuario = ids['52998224725']
+    emprestimos = [criar_emprestimo(usuario, valor, parcelas) for valor, parcelas in
+        ((5000, 12), (1000, 18), (3000, 24), (2000, 36))]
+    for cpf in ('11144477735', '39053344705', '87748248800'):
+        criar_emprestimo(ids[cpf])
+    importar_emprestimos([{'cpf': cpf, 'valor': 1500, 'parcelas': 30} for cpf in ids] * 2)
+
+    FilaAnalise().processar_tudo()
+    manual = EventoEmprestimo.query.filter_by(id_usuario=ids['87748248800']).first().id_emprestimo
+    assert avaliar_manualmente(manual, 'aprovado')
+
+    assert pagar_parcelas(emprestimos[0], usuario, 5)
+    assert pagar_parcelas(emprestimos[0], usuario)
+    assert pagar_em_lote(usuario, emprestimos[1:3], 2) == 2
+    assert pagar_em_lote(usuario, [emprestimos[1], emprestimos[3]]) == 2
+    assert pagar_parcelas(manual, ids['87748248800'], 3)
+    return ids
+
+
+def test_reconstrucao_igual_as_atualizacoes(movimentos):
+    incremental = projecao()
+    assert set(incremental) == set(movimentos.values())
+    assert divergencias() == []
+
+    for tamanho_lote in (1, 2, 1000):
+        assert reconstruir_saldos(tamanho_lote=tamanho_lote) == len(incremental)
+        assert projecao() == incremental
+
+
+def test_resumo_da_projecao_igual_ao_calculado(movimentos):
+    for id_usuario in movimentos.values():
+        assert resumo_emprestimos(id_usuario) == calcular_resumo_emprestimos(id_usuario)
+
+
+def test_reconstrucao_corrige_a_projecao(movimentos):
+    incremental = projecao()
+    id_usuario = movimentos['52998224725']
+    SaldoUsuario.query.filter_by(id_usuario=id_usuario).update({SaldoUsuario.saldo_devedor_centavos: 1})
+    SaldoUsuario.query.filter_by(id_usuario=movimentos['11144477735']).delete()
+    db.session.commit()
+
+    assert [diferente[0] for diferente in divergencias(tamanho_lote=1)] == \
+        sorted((id_usuario, movimentos['11144477735']))
+
+    reconstruir_saldos(tamanho_lote=3)
+
+    assert projecao() == incremental
+    assert divergencias() == []
+
+
+def test_comando_reconstruir_saldos(app, movimentos):
+    SaldoUsuario.query.delete()
+    db.session.commit()
+    runner = app.test_cli_runner()
+
+    assert 'Usuários com saldo diferente dos empréstimos: 4' in runner.invoke(args=['reconstruir-saldos', '--verificar']).output
+    resultado = runner.invoke(args=['reconstruir-saldos', '--lote', '2'])
+
+    assert 'Saldos reconstruídos: 4 usuários' in resultado.output
+    assert 'Usuários com saldo diferente dos empréstimos: 0' in resultado.output
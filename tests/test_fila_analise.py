@@ -0,0 +1,100 @@
+import pytest
+from FlaskEmprestimo import fila_analise as modulo_fila
+from FlaskEmprestimo.fila_analise import FilaAnalise, avaliar_manualmente, avaliacoes_pendentes
+from FlaskEmprestimo.models import Emprestimo, TarefaAnalise, EventoEmprestimo
+from FlaskEmprestimo.eventos import divergencias
+
+
+@pytest.fixture
+def em_analise(criar_usuario, criar_emprestimo):
+    """
+    Cria três empréstimos de R$ 5000 em 12 parcelas que vão para a fila de análise e que
+    as regras padrão aprovam, recusam e deixam para a avaliação manual, nessa ordem
+    """
+    ids = {}
+    for decisao, cpf, salario in (('aprovado', '52998224725', 1500), ('recusado', '11144477735', 900),
+            ('manual', '39053344705', 1000)):
+        ids[decisao] = criar_emprestimo(criar_usuario(cpf=cpf, salario=salario))
+    assert TarefaAnalise.query.count() == 3
+    return ids
+
+
+def trabalhador(reserva=60):
+    fila = FilaAnalise()
+    fila.reserva = reserva
+    return fila
+
+
+def contadores(fila):
+    return fila.processadas, fila.aprovadas, fila.recusadas, fila.manuais
+
+
+def test_processar_lote(em_analise):
+    fila = trabalhador()
+
+    assert fila.processar_lote() == 3
+
+    assert Emprestimo.query.get(em_analise['aprovado']).situacao == 'aprovado'
+    assert Emprestimo.query.get(em_analise['aprovado']).ativo
+    assert Emprestimo.query.get(em_analise['recusado']).situacao == 'recusado'
+    assert Emprestimo.query.get(em_analise['manual']).situacao == 'em_analise'
+    assert [linha[0] for linha in avaliacoes_pendentes()] == [em_analise['manual']]
+    assert contadores(fila) == (3, 1, 1, 1)
+    assert fila.processar_lote() == 0
+    assert divergencias() == []
+
+
+def test_tarefa_reservada_nao_e_processada_por_outro_trabalhador(em_analise):
+    assert trabalhador()._reservar() is not None
+
+    outro = trabalhador()
+
+    assert outro.processar_lote() == 0
+    assert Emprestimo.query.get(em_analise['aprovado']).situacao == 'em_analise'
+
+
+def test_reserva_expirada_volta_para_a_fila(em_analise):
+    # O primeiro trabalhador reserva as tarefas e para antes de decidi-las
+    assert trabalhador(reserva=-1)._reservar() is not None
+
+    outro = trabalhador()
+
+    assert outro.processar_tudo() == 3
+    assert contadores(outro) == (3, 1, 1, 1)
+    assert TarefaAnalise.query.filter_by(manual=False).count() == 0
+    assert divergencias() == []
+
+
+def test_decisao_de_reserva_expirada_contada_uma_vez(monkeypatch, em_analise):
+    lento, outro = trabalhador(reserva=-1), trabalhador()
+    aplicar = modulo_fila._aplicar_decisoes
+
+    def aplicar_depois_do_outro(decisoes):
+        # A reserva do trabalhador lento expira e o outro trabalhador decide as mesmas
+        # tarefas antes que ele aplique as suas decisões
+        monkeypatch.setattr(modulo_fila, '_aplicar_decisoes', aplicar)
+        assert outro.processar_lote() == 3
+        return aplicar(decisoes)
+
+    monkeypatch.setattr(modulo_fila, '_aplicar_decisoes', aplicar_depois_do_outro)
+    lento.processar_lote()
+
+    assert contadores(outro) == (3, 1, 1, 1)
+    assert contadores(lento) == (0, 0, 0, 0)
+    assert EventoEmprestimo.query.filter(EventoEmprestimo.tipo.in_(('aprovado', 'recusado'))).count() == 2
+    assert TarefaAnalise.query.filter_by(manual=True).count() == 1
+    assert divergencias() == []
+
+
+def test_avaliacao_manual(em_analise):
+    trabalhador().processar_lote()
+
+    assert avaliar_manualmente(em_analise['manual'], 'aprovado')
+    assert not avaliar_manualmente(em_analise['manual'], 'recusado')
+    assert not avaliar_manualmente(9999, 'aprovado')
+    with pytest.raises(ValueError):
+        avaliar_manualmente(em_analise['manual'], 'talvez')
+
+    assert Emprestimo.query.get(em_analise['manual']).situacao == 'aprovado'
+    assert TarefaAnalise.query.count() == 0
+    assert divergencias() == []
@@ -0,0 +1,84 @@
+import time
+from types import SimpleNamespace
+from FlaskEmprestimo.extensoes import cache_usuarios
+from FlaskEmprestimo.identidades import CacheUsuarios
+from FlaskEmprestimo.models import Usuario
+
+
+def usuario(id_usuario, salario=5000):
+    return SimpleNamespace(id=id_usuario, nome='Teste', cpf='52998224725', email='teste@exemplo.com',
+        salario=salario)
+
+
+def test_obter_usa_o_cache():
+    cache = CacheUsuarios()
+    carregados = []
+
+    def carregar(id_usuario):
+        carregados.append(id_usuario)
+        return usuario(id_usuario)
+
+    assert cache.obter(1, carregar).salario == 5000
+    assert cache.obter(1, carregar).id == 1
+    assert carregados == [1]
+    assert (cache.acertos, cache.falhas) == (1, 1)
+
+
+def test_invalidar_recarrega_o_usuario():
+    cache = CacheUsuarios()
+    cache.obter(1, lambda id_usuario: usuario(id_usuario))
+
+    cache.invalidar(1)
+
+    assert cache.obter(1, lambda id_usuario: usuario(id_usuario, 7000)).salario == 7000
+
+
+def test_expiracao():
+    cache = CacheUsuarios()
+    cache.ttl = 0.01
+    cache.obter(1, lambda id_usuario: usuario(id_usuario))
+    time.sleep(0.02)
+
+    assert cache.obter(1, lambda id_usuario: usuario(id_usuario, 7000)).salario == 7000
+    assert cache.falhas == 2
+
+
+def test_remove_o_usado_ha_mais_tempo():
+    cache = CacheUsuarios()
+    cache.tamanho_max = 2
+    for id_usuario in (1, 2, 1, 3):
+        cache.obter(id_usuario, usuario)
+
+    assert cache.estatisticas()['tamanho'] == 2
+    assert cache.remocoes == 1
+    assert cache.obter(2, lambda id_usuario: None) is None
+    assert cache.obter(1, lambda id_usuario: None).id == 1
+
+
+def test_cache_desativado_e_usuario_removido():
+    cache = CacheUsuarios()
+    cache.ttl = 0
+    cache.obter(1, usuario)
+    assert cache.estatisticas()['tamanho'] == 0
+
+    cache.ttl = 60
+    cache.obter(1, usuario)
+    assert cache.obter(1, lambda id_usuario: None).id == 1
+    cache.invalidar(1)
+    assert cache.obter(1, lambda id_usuario: None) is None
+    assert cache.estatisticas()['tamanho'] == 0
+
+
+def test_alteracao_do_salario_invalida_a_identidade(criar_usuario, logar):
+    id_usuario = criar_usuario(salario=5000)
+    cliente = logar()
+    assert cliente.get('/perfil').status_code == 200
+    assert cache_usuarios.obter(id_usuario, Usuario.query.get).salario == 5000
+
+    resposta = cliente.post('/emprestimo/confirmar', data={'valor': 5000, 'parcelas': 12, 'salario': 7000})
+
+    assert resposta.status_code == 200
+    assert Usuario.query.get(id_usuario).salario == 7000
+    falhas = cache_usuarios.falhas
+    assert cache_usuarios.obter(id_usuario, Usuario.query.get).salario == 7000
+    assert cache_usuarios.falhas == falhas + 1
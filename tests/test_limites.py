@@ -0,0 +1,125 @@
+from types import SimpleNamespace
+import pytest
+from FlaskEmprestimo import limites
+from FlaskEmprestimo.extensoes import limitador
+from FlaskEmprestimo.limites import BackendMemoria, BackendCompartilhado
+from tests.conftest import SENHA
+
+
+class ClienteFalso:
+    """
+    Cliente com o get, incr e expire do Redis, em memória e sem expiração
+    """
+
+    def __init__(self):
+        self.valores = {}
+
+    def get(self, chave):
+        return self.valores.get(chave)
+
+    def incr(self, chave):
+        self.valores[chave] = self.valores.get(chave, 0) + 1
+        return self.valores[chave]
+
+    def expire(self, chave, segundos):
+        pass
+
+
+@pytest.fixture(params=('memoria', 'compartilhado'))
+def backend(request):
+    return BackendMemoria() if request.param == 'memoria' else BackendCompartilhado(ClienteFalso())
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    """
+    Relógio controlado pelo teste, usado pelo limitador nas requisições
+    """
+    relogio = SimpleNamespace(agora=6000.0)
+    monkeypatch.setattr(limites, 'time', SimpleNamespace(time=lambda: relogio.agora))
+    return relogio
+
+
+def test_limite_dentro_da_janela(backend):
+    assert [backend.consumir('ip:1', 5, 60, 6000 + i) for i in range(5)] == [0] * 5
+
+    espera = backend.consumir('ip:1', 5, 60, 6010)
+
+    assert espera > 0
+    assert backend.consumir('ip:1', 5, 60, 6010 + espera + 1) == 0
+
+
+def test_limite_zero_recusa_todas(backend):
+    assert backend.consumir('cpf:1', 0, 60, 6010) == 50
+    assert backend.consumir('cpf:1', 0, 60, 6070) == 50
+
+
+def test_janela_deslizante(backend):
+    for i in range(5):
+        assert backend.consumir('ip:1', 5, 60, 6000 + i) == 0
+
+    # No início da janela seguinte, as tentativas da anterior ainda contam por inteiro
+    espera = backend.consumir('ip:1', 5, 60, 6060)
+    assert espera > 0
+    # Após a espera indicada, a contagem da janela anterior perdeu peso suficiente
+    assert backend.consumir('ip:1', 5, 60, 6060 + espera) == 0
+
+
+def test_limite_expira_apos_duas_janelas(backend):
+    for i in range(6):
+        backend.consumir('ip:1', 5, 60, 6000 + i)
+
+    assert backend.consumir('ip:1', 5, 60, 6120) == 0
+
+
+def test_chaves_independentes(backend):
+    for i in range(5):
+        backend.consumir('cpf:1', 5, 60, 6000 + i)
+
+    assert backend.consumir('cpf:1', 5, 60, 6010) > 0
+    assert backend.consumir('cpf:2', 5, 60, 6010) == 0
+    assert backend.consumir('ip:1', 5, 60, 6010) == 0
+
+
+def test_remove_chaves_usadas_ha_mais_tempo():
+    backend = BackendMemoria(max_chaves=2)
+    for chave in ('ip:1', 'ip:2', 'ip:1', 'ip:3'):
+        backend.consumir(chave, 5, 60, 6000)
+
+    assert backend.tamanho() == 2
+    assert backend.remocoes == 1
+
+
+def test_login_recusado_com_429(monkeypatch, relogio, criar_usuario, cliente):
+    monkeypatch.setattr(limitador, 'ativo', True)
+    monkeypatch.setattr(limitador, 'limites', {'ip': (30, 60), 'cpf': (2, 300)})
+    criar_usuario()
+    criar_usuario(cpf='11144477735')
+
+    for _ in range(2):
+        assert cliente.post('/login', data={'cpf': '52998224725', 'senha': 'errada'}).status_code == 200
+    resposta = cliente.post('/login', data={'cpf': '52998224725', 'senha': SENHA})
+
+    assert resposta.status_code == 429
+    espera = int(resposta.headers['Retry-After'])
+    assert limitador.recusadas['cpf'] >= 1
+    # O limite é por CPF: outro CPF do mesmo IP continua podendo entrar
+    assert cliente.post('/login', data={'cpf': '11144477735', 'senha': SENHA}).status_code == 302
+
+    relogio.agora += espera
+    assert cliente.post('/login', data={'cpf': '52998224725', 'senha': SENHA}).status_code == 302
+
+
+def test_token_da_api_recusado_com_429(monkeypatch, relogio, criar_usuario, cliente):
+    monkeypatch.setattr(limitador, 'ativo', True)
+    monkeypatch.setattr(limitador, 'limites', {'ip': (3, 60), 'cpf': (5, 300)})
+    criar_usuario()
+
+    for _ in range(3):
+        cliente.post('/api/v1/tokens', json={'cpf': '52998224725', 'senha': 'errada'})
+    resposta = cliente.post('/api/v1/tokens', json={'cpf': '52998224725', 'senha': SENHA})
+
+    assert resposta.status_code == 429
+    assert 'erro' in resposta.get_json()
+    relogio.agora += int(resposta.headers['Retry-After'])
+    assert cliente.post('/api/v1/tokens', json={'cpf': '52998224725', 'senha': SENHA}).status_code == 201
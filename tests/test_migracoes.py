@@ -0,0 +1,102 @@
+import shutil
+import sqlite3
+import pytest
+from sqlalchemy import inspect
+from FlaskEmprestimo import criar_app
+from FlaskEmprestimo.amortizacao import cronograma
+from FlaskEmprestimo.extensoes import db, cache_usuarios
+from FlaskEmprestimo.migracoes import MIGRACOES, migrar, pendentes, versao_atual
+from FlaskEmprestimo.models import Usuario, Emprestimo, Parcela, SaldoUsuario
+from FlaskEmprestimo.eventos import divergencias
+from FlaskEmprestimo.originacao import gerar_cronogramas_pendentes
+
+BANCO_ORIGINAL = 'FlaskEmprestimo/FlaskEmprestimo.db'
+
+
+def aplicacao(caminho):
+    return criar_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{caminho}',
+        'TESTING': True,
+        'HASH_PROCESSOS': 0,
+        'FILA_ANALISE_TRABALHADORES': 0,
+    })
+
+
+@pytest.fixture
+def banco_antigo(tmp_path):
+    """
+    Cópia do banco de dados original da aplicação, anterior às migrações (valores em reais,
+    sem a tabela versao_esquema), com um usuário e dois empréstimos no formato antigo
+    """
+    caminho = tmp_path / 'antigo.db'
+    shutil.copy(BANCO_ORIGINAL, caminho)
+    conexao = sqlite3.connect(caminho)
+    conexao.execute("INSERT INTO usuario (nome, cpf, email, senha, salario) "
+        "VALUES ('Teste', '52998224725', 'teste@exemplo.com', 'x', 1234.5)")
+    conexao.execute('INSERT INTO emprestimo (valor, parcelas, valor_parcela, parcelas_restantes, ativo, id_usuario) '
+        'VALUES (5000, 12, 479.17, 10, 1, 1)')
+    conexao.execute('INSERT INTO emprestimo (valor, parcelas, valor_parcela, parcelas_restantes, ativo, id_usuario) '
+        'VALUES (1000, 18, 63.89, 0, 0, 1)')
+    conexao.commit()
+    conexao.close()
+    app = aplicacao(caminho)
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+    cache_usuarios.limpar()
+
+
+def test_migra_o_banco_original(banco_antigo):
+    assert versao_atual(db.engine) == 0
+    assert len(pendentes()) == len(MIGRACOES)
+
+    aplicadas = migrar(db.engine, tamanho_lote=1)
+
+    assert [numero for numero, _ in aplicadas] == [numero for numero, _, _ in MIGRACOES]
+    assert pendentes() == []
+    assert migrar(db.engine) == []
+
+    colunas = {tabela: {c['name']: c['nullable'] for c in inspect(db.engine).get_columns(tabela)}
+        for tabela in ('usuario', 'emprestimo')}
+    assert colunas['usuario']['salario_centavos'] is False
+    assert colunas['emprestimo']['valor_centavos'] is False
+    assert colunas['emprestimo']['valor_parcela_centavos'] is False
+
+    assert Usuario.query.get(1).salario_centavos == 123450
+    ativo, quitado = Emprestimo.query.order_by(Emprestimo.id).all()
+    assert (ativo.valor_centavos, ativo.valor_parcela_centavos) == (500000, 47917)
+    assert not quitado.ativo
+    # Sem cronograma, o saldo devedor é o valor da parcela vezes as parcelas restantes
+    assert SaldoUsuario.query.get(1).saldo_devedor_centavos == 47917 * 10
+    assert SaldoUsuario.query.get(1).qtd_ativos == 1
+    assert divergencias() == []
+
+
+def test_cronogramas_dos_emprestimos_migrados(banco_antigo):
+    migrar(db.engine)
+
+    assert gerar_cronogramas_pendentes(tamanho_lote=1) == 2
+
+    ativo = Emprestimo.query.get(1)
+    assert Parcela.query.filter_by(id_emprestimo=ativo.id).count() == 12
+    # O valor emprestado é o valor total sem os 15% de juros
+    parcelas = cronograma('4347.83', 12)
+    restantes = sum(parcela for _, parcela, *_ in parcelas[2:])
+    assert SaldoUsuario.query.get(1).saldo_devedor_centavos == restantes * 100
+    assert divergencias() == []
+    assert gerar_cronogramas_pendentes() == 0
+
+
+def test_banco_vazio_recebe_o_esquema_atual(tmp_path):
+    app = aplicacao(tmp_path / 'vazio.db')
+    with app.app_context():
+        assert versao_atual(db.engine) is None
+
+        aplicadas = migrar(db.engine)
+
+        assert len(aplicadas) == len(MIGRACOES)
+        assert pendentes() == []
+        assert versao_atual(db.engine) == MIGRACOES[-1][0]
+        assert {'usuario', 'emprestimo', 'parcela', 'saldo_usuario'} <= set(inspect(db.engine).get_table_names())
+        db.engine.dispose()
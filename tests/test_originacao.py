@@ -0,0 +1,31 @@
+import pytest
+from sqlalchemy import func
+from FlaskEmprestimo.extensoes import db
+from FlaskEmprestimo.models import Emprestimo, Parcela, EventoEmprestimo
+from FlaskEmprestimo.originacao import importar_emprestimos
+from FlaskEmprestimo.eventos import divergencias
+
+
+# Sem um MySQL disponível, o caminho dos demais bancos é exercitado sobre o SQLite
+@pytest.mark.parametrize('banco', ('sqlite', 'mysql'))
+def test_importacao_associa_cada_emprestimo_ao_seu_cronograma(monkeypatch, criar_usuario, banco):
+    monkeypatch.setattr(db.engine.dialect, 'name', banco)
+    usuarios = {'52998224725': criar_usuario(), '11144477735': criar_usuario(cpf='11144477735')}
+    linhas = [{'cpf': cpf, 'valor': valor, 'parcelas': parcelas}
+        for cpf, valor, parcelas in zip(list(usuarios) * 5, range(1000, 11000, 1000), (12, 18, 24, 30, 36) * 2)]
+    linhas.insert(3, {'cpf': '00000000000', 'valor': 1000, 'parcelas': 12})
+
+    relatorio = importar_emprestimos(linhas, tamanho_lote=4)
+
+    assert relatorio['inseridos'] == 10
+    assert [rejeitado['linha'] for rejeitado in relatorio['rejeitados']] == [4]
+    emprestimos = Emprestimo.query.order_by(Emprestimo.id).all()
+    for linha, emprestimo in zip((linha for linha in linhas if linha['cpf'] in usuarios), emprestimos):
+        assert emprestimo.id_usuario == usuarios[linha['cpf']]
+        assert emprestimo.parcelas == linha['parcelas']
+        parcelas, amortizacao = db.session.query(func.count(Parcela.numero), func.sum(Parcela.amortizacao)) \
+            .filter(Parcela.id_emprestimo == emprestimo.id).one()
+        assert (parcelas, amortizacao) == (linha['parcelas'], linha['valor'] * 100)
+        assert EventoEmprestimo.query.filter_by(id_emprestimo=emprestimo.id, tipo='originado',
+            id_usuario=emprestimo.id_usuario).count() == 1
+    assert divergencias() == []
@@ -0,0 +1,127 @@
+import threading
+import pytest
+from FlaskEmprestimo.extensoes import db
+from FlaskEmprestimo.models import Emprestimo, EventoEmprestimo
+from FlaskEmprestimo.pagamentos import pagar_parcelas, pagar_em_lote, PagamentoInvalidoError
+from FlaskEmprestimo.consultas import resumo_emprestimos
+from FlaskEmprestimo.eventos import divergencias
+
+
+def simultaneos(app, funcao, threads):
+    """
+    Executa funcao() ao mesmo tempo em várias threads, cada uma no seu contexto da
+    aplicação, e retorna a lista de resultados (ou das exceções lançadas)
+    """
+    barreira = threading.Barrier(threads)
+    resultados = []
+
+    def executar():
+        with app.app_context():
+            barreira.wait()
+            try:
+                resultados.append(funcao())
+            except Exception as erro:
+                resultados.append(erro)
+            finally:
+                db.session.remove()
+
+    lista = [threading.Thread(target=executar) for _ in range(threads)]
+    for thread in lista:
+        thread.start()
+    for thread in lista:
+        thread.join()
+    return resultados
+
+
+def test_pagar_parcelas_marca_quitado_na_ultima_parcela(criar_usuario, criar_emprestimo):
+    id_usuario = criar_usuario()
+    id_emprestimo = criar_emprestimo(id_usuario, parcelas=12)
+
+    assert pagar_parcelas(id_emprestimo, id_usuario, 11)
+    assert Emprestimo.query.get(id_emprestimo).ativo
+    assert not pagar_parcelas(id_emprestimo, id_usuario, 2)
+    assert pagar_parcelas(id_emprestimo, id_usuario)
+
+    emprestimo = Emprestimo.query.get(id_emprestimo)
+    assert emprestimo.parcelas_restantes == 0 and not emprestimo.ativo
+    assert not pagar_parcelas(id_emprestimo, id_usuario)
+    assert resumo_emprestimos(id_usuario)['saldo_devedor'] == 0
+
+
+def test_pagar_parcelas_de_outro_usuario(criar_usuario, criar_emprestimo):
+    id_usuario = criar_usuario()
+    outro = criar_usuario(cpf='11144477735')
+    id_emprestimo = criar_emprestimo(id_usuario)
+
+    assert not pagar_parcelas(id_emprestimo, outro)
+    assert Emprestimo.query.get(id_emprestimo).parcelas_restantes == 12
+
+
+def test_pagar_parcelas_simultaneos_nao_perdem_atualizacoes(app, criar_usuario, criar_emprestimo):
+    id_usuario = criar_usuario()
+    id_emprestimo = criar_emprestimo(id_usuario, parcelas=12)
+
+    def pagar_varias():
+        return sum(pagar_parcelas(id_emprestimo, id_usuario) for _ in range(5))
+
+    # 8 threads tentam pagar 40 parcelas de um empréstimo com 12
+    aceitos = simultaneos(app, pagar_varias, 8)
+
+    assert sum(aceitos) == 12
+    db.session.expire_all()
+    emprestimo = Emprestimo.query.get(id_emprestimo)
+    assert emprestimo.parcelas_restantes == 0 and not emprestimo.ativo
+    assert EventoEmprestimo.query.filter_by(id_emprestimo=id_emprestimo, tipo='parcela_paga').count() == 12
+    assert EventoEmprestimo.query.filter_by(id_emprestimo=id_emprestimo, tipo='quitado').count() == 1
+    assert not divergencias()
+
+
+def test_pagar_em_lote_simultaneos_quitam_uma_unica_vez(app, criar_usuario, criar_emprestimo):
+    id_usuario = criar_usuario()
+    ids = [criar_emprestimo(id_usuario, parcelas=parcelas) for parcelas in (12, 18, 24)]
+
+    resultados = simultaneos(app, lambda: pagar_em_lote(id_usuario, ids), 4)
+
+    assert resultados.count(3) == 1
+    assert all(isinstance(r, PagamentoInvalidoError) for r in resultados if r != 3)
+    db.session.expire_all()
+    assert all(e.parcelas_restantes == 0 and not e.ativo for e in Emprestimo.query.filter(Emprestimo.id.in_(ids)))
+    assert EventoEmprestimo.query.filter_by(tipo='quitado').count() == 3
+    assert resumo_emprestimos(id_usuario)['saldo_devedor'] == 0
+    assert not divergencias()
+
+
+def test_pagar_em_lote_desfaz_tudo_quando_um_pagamento_falha(criar_usuario, criar_emprestimo):
+    id_usuario = criar_usuario()
+    outro = criar_usuario(cpf='11144477735')
+    do_usuario = criar_emprestimo(id_usuario)
+    de_outro = criar_emprestimo(outro)
+    saldo = resumo_emprestimos(id_usuario)['saldo_devedor']
+
+    with pytest.raises(PagamentoInvalidoError):
+        pagar_em_lote(id_usuario, [do_usuario, de_outro], 1)
+
+    assert Emprestimo.query.get(do_usuario).parcelas_restantes == 12
+    assert resumo_emprestimos(id_usuario)['saldo_devedor'] == saldo
+    assert EventoEmprestimo.query.filter_by(tipo='parcela_paga').count() == 0
+
+
+def test_quitacao_desfeita_quando_outro_pagamento_e_salvo_antes(app, monkeypatch, criar_usuario, criar_emprestimo):
+    from FlaskEmprestimo import pagamentos
+    id_usuario = criar_usuario()
+    id_emprestimo = criar_emprestimo(id_usuario)
+    pagar = pagamentos._pagar
+
+    def pagar_depois_de_outro(*argumentos):
+        # Outro pagamento é salvo entre a leitura das parcelas restantes e o UPDATE
+        monkeypatch.setattr(pagamentos, '_pagar', pagar)
+        assert simultaneos(app, lambda: pagar_parcelas(id_emprestimo, id_usuario), 1) == [True]
+        return pagar(*argumentos)
+
+    monkeypatch.setattr(pagamentos, '_pagar', pagar_depois_de_outro)
+    with pytest.raises(PagamentoInvalidoError):
+        pagar_em_lote(id_usuario, [id_emprestimo])
+
+    db.session.expire_all()
+    assert Emprestimo.query.get(id_emprestimo).parcelas_restantes == 11
+    assert not divergencias()
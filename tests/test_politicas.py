@@ -0,0 +1,91 @@
+import json
+import os
+import pytest
+from FlaskEmprestimo.politicas import (Politica, MotorPoliticas, PoliticaInvalidaError, carregar_politica,
+    ARQUIVO_PADRAO)
+
+
+def politica_com(condicao, secao='recusar'):
+    """
+    Retorna os dados da política padrão com uma regra a mais na seção informada
+    """
+    with open(ARQUIVO_PADRAO, encoding='utf-8') as arquivo:
+        dados = json.load(arquivo)
+    dados[secao].append({'nome': 'teste', 'condicao': condicao})
+    return dados
+
+
+@pytest.fixture(scope='module')
+def politica():
+    return carregar_politica(ARQUIVO_PADRAO)
+
+
+def test_recusa(politica):
+    assert politica.recusa(5000, 12, 5000) is None
+    assert politica.recusa(60000, 12, 5000).startswith('Valor muito alto')
+    assert politica.recusa(500, 12, 5000).startswith('Valor muito baixo')
+    assert politica.recusa(5000, 13, 5000) == 'Quantidade de parcelas inválida'
+    assert politica.recusas_em_lote((5000, 60000, 5000), (12, 12, 13), (5000, 5000, 5000)) == [None, 0, 2]
+
+
+def test_analise(politica):
+    assert not politica.precisa_analise(5000, 12, 479.17, 5000)
+    assert politica.precisa_analise(5000, 12, 479.17, 1000)
+    assert politica.analises_em_lote((5000, 5000), (12, 12), (479.17, 479.17), (5000, 1000)) == [False, True]
+
+
+def test_decisao_analise(politica):
+    assert politica.decisao_analise(5000, 12, 479.17, 900) == 'recusado'
+    assert politica.decisao_analise(5000, 12, 479.17, 1500) == 'aprovado'
+    assert politica.decisao_analise(30000, 36, 958.33, 2500) is None
+
+
+@pytest.mark.parametrize('condicao', (
+    "__import__('os').system('true')",
+    'valor.real > 0',
+    '(lambda: True)()',
+    'valor[0] > 0',
+    'abs(valor) > 0',
+    '[x for x in prazos]',
+    'desconhecido > 0',
+    'valor >',
+))
+def test_rejeita_expressoes_fora_da_lista(condicao):
+    with pytest.raises(PoliticaInvalidaError):
+        Politica(politica_com(condicao))
+
+
+def test_rejeita_expressoes_nas_outras_secoes():
+    with pytest.raises(PoliticaInvalidaError):
+        Politica(politica_com("__import__('os')", 'analisar'))
+    # valor_parcela só existe nas regras de análise
+    with pytest.raises(PoliticaInvalidaError):
+        Politica(politica_com('valor_parcela > 0'))
+
+
+def test_rejeita_arquivo_invalido(tmp_path):
+    with pytest.raises(PoliticaInvalidaError):
+        Politica({'recusar': []})
+    caminho = tmp_path / 'politicas.json'
+    caminho.write_text('{', encoding='utf-8')
+    with pytest.raises(PoliticaInvalidaError):
+        carregar_politica(caminho)
+
+
+def test_motor_mantem_a_politica_anterior(tmp_path):
+    caminho = tmp_path / 'politicas.json'
+    dados = politica_com('valor == 1234')
+    caminho.write_text(json.dumps(dados), encoding='utf-8')
+    motor = MotorPoliticas()
+    motor.caminho, motor.intervalo = str(caminho), 1e-9
+    motor.recarregar()
+    assert motor.politica.recusa(1234, 12, 5000) == 'teste'
+
+    dados['recusar'][-1]['condicao'] = 'valor == 4321'
+    caminho.write_text(json.dumps(dados), encoding='utf-8')
+    os.utime(caminho, ns=(0, motor.versao + 10**9))
+    assert motor.politica.recusa(4321, 12, 5000) == 'teste'
+
+    caminho.write_text(json.dumps(politica_com('open(valor)')), encoding='utf-8')
+    os.utime(caminho, ns=(0, motor.versao + 10**9))
+    assert motor.politica.recusa(4321, 12, 5000) == 'teste'